@@ -0,0 +1,187 @@
+"""
+Agrupamento (clustering) dos pontos do mapa por viewport, usado por GET /api/mapa/agrupamentos.
+
+Para cada nível de zoom, os pontos são projetados em Web Mercator (em pixels daquele zoom) e
+agrupados em uma grade de células de MAPA_AGRUPAMENTO_PX pixels; cada célula com mais de um
+ponto vira um grupo, posicionado no centroide dos seus pontos. O resultado de cada zoom é
+calculado uma vez, com NumPy, sobre todos os pontos, e mantido em memória por processo; cada
+requisição só recorta os grupos do retângulo visível.
+
+Fontes:
+- 'mapa': bases e prestadores de 'mapa_locais' (bases e prestadores nunca se misturam no
+  mesmo grupo);
+- 'manutencoes': locais das manutenções com coordenadas (os mesmos de GET /api/locais).
+
+Os grupos em memória são descartados quando muda a versão das coordenadas (tabela
+'versao_coordenadas'), incrementada por triggers quando um local do mapa é criado, removido
+ou tem coordenadas/tipo alterados, e quando uma manutenção com coordenadas é criada, removida
+ou tem coordenadas/local alterados.
+
+Configuração por variável de ambiente:
+    MAPA_AGRUPAMENTO_PX   tamanho da célula da grade, em pixels de tela (padrão: 60)
+"""
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+from geo import TIPO_UNIDADE
+
+logger = logging.getLogger(__name__)
+
+MAPA_AGRUPAMENTO_PX = int(os.environ.get('MAPA_AGRUPAMENTO_PX', 60))
+ZOOM_MAXIMO = 22
+# Limite de latitude da projeção Web Mercator
+_LATITUDE_MAXIMA = 85.05112878
+
+# fonte -> (consulta dos pontos, colunas extras devolvidas para pontos isolados)
+FONTES = {
+    'mapa': (f"SELECT id, latitude, longitude, CASE WHEN tipo = '{TIPO_UNIDADE}' THEN 1 ELSE 0 END AS categoria, 1 AS peso "
+             'FROM mapa_locais',
+             ('id',)),
+    'manutencoes': ('''SELECT local, latitude, longitude, 0 AS categoria, COUNT(*) AS peso
+                       FROM manutencoes
+                       WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND local IS NOT NULL AND local != ''
+                       GROUP BY local, latitude, longitude''',
+                    ('local',)),
+}
+CATEGORIAS_GRUPO = {0: 'prestador', 1: 'unidade'}
+
+
+def criar_esquema_agrupamentos(c):
+    """Cria (se necessário) a tabela 'versao_coordenadas' e os triggers que a incrementam."""
+    c.execute('''CREATE TABLE IF NOT EXISTS versao_coordenadas
+                 (id INTEGER PRIMARY KEY CHECK (id = 1),
+                  versao INTEGER NOT NULL)''')
+    c.execute('INSERT OR IGNORE INTO versao_coordenadas (id, versao) VALUES (1, 1)')
+    incrementar = 'UPDATE versao_coordenadas SET versao = versao + 1 WHERE id = 1;'
+    gatilhos = {
+        'mapa_locais_coordenadas_ai': 'AFTER INSERT ON mapa_locais',
+        'mapa_locais_coordenadas_ad': 'AFTER DELETE ON mapa_locais',
+        'mapa_locais_coordenadas_au': 'AFTER UPDATE OF latitude, longitude, tipo ON mapa_locais',
+        'manutencoes_coordenadas_ai': 'AFTER INSERT ON manutencoes WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL',
+        'manutencoes_coordenadas_ad': 'AFTER DELETE ON manutencoes WHEN OLD.latitude IS NOT NULL AND OLD.longitude IS NOT NULL',
+        'manutencoes_coordenadas_au': '''AFTER UPDATE OF latitude, longitude, local ON manutencoes
+                                         WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+                                           OR OLD.local IS NOT NEW.local''',
+    }
+    for nome, evento in gatilhos.items():
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS {nome} {evento} BEGIN {incrementar} END')
+
+
+def versao_coordenadas(c):
+    c.execute('SELECT versao FROM versao_coordenadas WHERE id = 1')
+    return c.fetchone()[0]
+
+
+def projetar(lats, lngs, zoom):
+    """Coordenadas Web Mercator, em pixels do nível de zoom informado (tiles de 256 px)."""
+    tamanho = 256 * 2 ** zoom
+    lats = np.radians(np.clip(lats, -_LATITUDE_MAXIMA, _LATITUDE_MAXIMA))
+    x = (np.asarray(lngs) + 180.0) / 360.0 * tamanho
+    y = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / math.pi) / 2.0 * tamanho
+    return x, y
+
+
+def _agrupar(pontos, zoom):
+    """Agrupa os pontos na grade do zoom. Retorna um dicionário de arrays, um elemento por grupo."""
+    lats, lngs, categorias, pesos = pontos['latitude'], pontos['longitude'], pontos['categoria'], pontos['peso']
+    if len(lats) == 0:
+        return None
+    x, y = projetar(lats, lngs, zoom)
+    celula_x = np.floor(x / MAPA_AGRUPAMENTO_PX).astype(np.int64)
+    celula_y = np.floor(y / MAPA_AGRUPAMENTO_PX).astype(np.int64)
+    # Chave única por (categoria, célula): até 2^25 células por eixo, suficiente para o zoom 22
+    chaves = (categorias.astype(np.int64) << 50) | (celula_x << 25) | celula_y
+    _, inverso, quantidades = np.unique(chaves, return_inverse=True, return_counts=True)
+
+    ordem = np.argsort(inverso, kind='stable')
+    inicios = np.concatenate(([0], np.cumsum(quantidades)[:-1]))
+    lats_ord, lngs_ord = lats[ordem], lngs[ordem]
+    return {
+        'latitude': np.bincount(inverso, weights=lats) / quantidades,
+        'longitude': np.bincount(inverso, weights=lngs) / quantidades,
+        'quantidade': quantidades,
+        'peso': np.bincount(inverso, weights=pesos),
+        'categoria': categorias[ordem][inicios],
+        'primeiro': ordem[inicios],  # Índice do primeiro ponto do grupo (o próprio ponto, se isolado)
+        'min_lat': np.minimum.reduceat(lats_ord, inicios),
+        'max_lat': np.maximum.reduceat(lats_ord, inicios),
+        'min_lng': np.minimum.reduceat(lngs_ord, inicios),
+        'max_lng': np.maximum.reduceat(lngs_ord, inicios),
+    }
+
+
+class CacheAgrupamentos:
+    """Pontos de cada fonte e grupos de cada (fonte, zoom), válidos para uma versão das coordenadas."""
+
+    def __init__(self):
+        self._versao = None
+        self._pontos = {}
+        self._grupos = {}
+        self._lock = threading.Lock()
+
+    def _carregar_pontos(self, c, fonte):
+        consulta, extras = FONTES[fonte]
+        c.execute(consulta)
+        rows = c.fetchall()
+        return {
+            'latitude': np.array([row['latitude'] for row in rows], dtype=float),
+            'longitude': np.array([row['longitude'] for row in rows], dtype=float),
+            'categoria': np.array([row['categoria'] for row in rows], dtype=np.int64),
+            'peso': np.array([row['peso'] for row in rows], dtype=float),
+            'extras': [{coluna: row[coluna] for coluna in extras} for row in rows],
+        }
+
+    def obter(self, c, fonte, zoom):
+        """Retorna (pontos, grupos) da fonte no zoom, recalculando o que estiver desatualizado."""
+        versao = versao_coordenadas(c)
+        with self._lock:
+            if versao != self._versao:
+                self._pontos.clear()
+                self._grupos.clear()
+                self._versao = versao
+            if fonte not in self._pontos:
+                self._pontos[fonte] = self._carregar_pontos(c, fonte)
+            if (fonte, zoom) not in self._grupos:
+                self._grupos[(fonte, zoom)] = _agrupar(self._pontos[fonte], zoom)
+                logger.debug(f"Agrupamentos calculados: fonte={fonte}, zoom={zoom}")
+            return self._pontos[fonte], self._grupos[(fonte, zoom)]
+
+
+cache = CacheAgrupamentos()
+
+
+def agrupamentos_viewport(c, fonte, zoom, min_lat, min_lng, max_lat, max_lng):
+    """
+    Grupos e pontos isolados cujo centro está no retângulo visível. Cada item traz latitude,
+    longitude, quantidade e categoria; pontos isolados trazem também a identificação do
+    ponto ('id' no mapa, 'local' nas manutenções) e grupos trazem 'limites'
+    [min_lat, min_lng, max_lat, max_lng]. Na fonte 'manutencoes', 'total_manutencoes' soma
+    as manutenções do grupo.
+    """
+    pontos, grupos = cache.obter(c, fonte, zoom)
+    if grupos is None:
+        return []
+    visiveis = np.nonzero((grupos['latitude'] >= min_lat) & (grupos['latitude'] <= max_lat)
+                          & (grupos['longitude'] >= min_lng) & (grupos['longitude'] <= max_lng))[0]
+    itens = []
+    for i in visiveis:
+        quantidade = int(grupos['quantidade'][i])
+        item = {
+            'latitude': float(grupos['latitude'][i]),
+            'longitude': float(grupos['longitude'][i]),
+            'quantidade': quantidade,
+            'categoria': CATEGORIAS_GRUPO[int(grupos['categoria'][i])] if fonte == 'mapa' else 'local',
+        }
+        if fonte == 'manutencoes':
+            item['total_manutencoes'] = int(grupos['peso'][i])
+        if quantidade == 1:
+            item.update(pontos['extras'][grupos['primeiro'][i]])
+        else:
+            item['limites'] = [float(grupos['min_lat'][i]), float(grupos['min_lng'][i]),
+                               float(grupos['max_lat'][i]), float(grupos['max_lng'][i])]
+        itens.append(item)
+    return itens
@@ -0,0 +1,196 @@
+"""
+Registro de alterações (change feed) para a sincronização incremental dos clientes.
+
+Triggers gravam em 'alteracoes', na mesma transação da gravação, uma linha por INSERT, UPDATE
+e DELETE em 'manutencoes', 'anexos' e 'mapa_locais' (mudanças nos serviços de um local contam
+como atualização do local). `seq` cresce monotonicamente: o cliente guarda o último `seq`
+recebido e pede apenas o que mudou depois dele.
+
+ler_alteracoes() condensa o trecho pedido em, para cada tabela, os ids gravados (inseridos ou
+atualizados) e os excluídos; o conteúdo atual dos gravados é lido na mesma transação de
+leitura. Um registro que aparece várias vezes no trecho é enviado uma única vez.
+
+Compactação (compactar_alteracoes):
+- entradas substituídas por outra mais recente do mesmo registro são apagadas; isso não muda
+  o resultado para nenhum cliente, pois a entrada mais recente continua no registro;
+- entradas com mais de ALTERACOES_RETENCAO_DIAS são apagadas e o maior `seq` apagado fica em
+  'alteracoes_estado'. Clientes que pedirem alterações a partir de um `seq` anterior a ele
+  recebem AlteracoesCompactadas e precisam recarregar tudo.
+
+Configuração por variáveis de ambiente:
+    ALTERACOES_RETENCAO_DIAS             dias mantidos no registro (padrão: 30)
+    ALTERACOES_COMPACTAR_INTERVALO_MIN   intervalo mínimo entre compactações automáticas (padrão: 60)
+
+Compactação manual: python alteracoes.py --compactar
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ALTERACOES_RETENCAO_DIAS = int(os.environ.get('ALTERACOES_RETENCAO_DIAS', 30))
+ALTERACOES_COMPACTAR_INTERVALO = int(os.environ.get('ALTERACOES_COMPACTAR_INTERVALO_MIN', 60)) * 60
+
+# Tabelas acompanhadas, na ordem em que as alterações devem ser aplicadas pelo cliente
+TABELAS_ALTERACOES = ('manutencoes', 'anexos', 'mapa_locais')
+
+_ultima_compactacao = 0.0
+_lock_compactacao = threading.Lock()
+
+
+class AlteracoesCompactadas(Exception):
+    """O trecho pedido já foi compactado; o cliente precisa recarregar os dados completos."""
+
+    def __init__(self, seq_minimo):
+        super().__init__(f'Alterações anteriores a {seq_minimo} não estão mais disponíveis')
+        self.seq_minimo = seq_minimo
+
+
+def criar_esquema_alteracoes(c):
+    """Cria (se necessário) as tabelas e os triggers que gravam o registro de alterações."""
+    c.execute('''CREATE TABLE IF NOT EXISTS alteracoes
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  tabela TEXT NOT NULL,
+                  registro_id INTEGER NOT NULL,
+                  excluido INTEGER NOT NULL DEFAULT 0,
+                  criado_em INTEGER NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS alteracoes_estado
+                 (id INTEGER PRIMARY KEY CHECK (id = 1),
+                  seq_compactado INTEGER NOT NULL -- Maior seq apagado pela retenção
+                 )''')
+    c.execute('INSERT OR IGNORE INTO alteracoes_estado (id, seq_compactado) VALUES (1, 0)')
+    agora = "CAST(strftime('%s', 'now') AS INTEGER)"
+    for tabela in TABELAS_ALTERACOES:
+        for evento, linha, excluido in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1)):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {tabela}_alteracoes_{evento.lower()} AFTER {evento} ON {tabela}
+                          BEGIN
+                              INSERT INTO alteracoes (tabela, registro_id, excluido, criado_em)
+                              VALUES ('{tabela}', {linha}.id, {excluido}, {agora});
+                          END''')
+    # Os serviços de um local ficam em outra tabela; a exclusão do próprio local já foi registrada
+    for evento, linha in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS mapa_locais_servicos_alteracoes_{evento.lower()}
+                      AFTER {evento} ON mapa_locais_servicos
+                      WHEN EXISTS (SELECT 1 FROM mapa_locais WHERE id = {linha}.local_id)
+                      BEGIN
+                          INSERT INTO alteracoes (tabela, registro_id, excluido, criado_em)
+                          VALUES ('mapa_locais', {linha}.local_id, 0, {agora});
+                      END''')
+
+
+def seq_atual(c):
+    """Último seq gravado (0 se o registro estiver vazio)."""
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alteracoes'")
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+def ler_alteracoes(conn, desde, limite, carregadores):
+    """
+    Alterações com seq > `desde`, no máximo `limite` entradas do registro. `carregadores` mapeia
+    cada tabela para uma função (c, ids) -> lista de dicionários com o conteúdo atual.
+    Retorna {'desde', 'seq', 'mais', <tabela>: {'gravados': [...], 'excluidos': [ids]}, ...},
+    apenas com as tabelas que mudaram. Lança AlteracoesCompactadas se `desde` já foi compactado.
+    """
+    c = conn.cursor()
+    # Registro e dados lidos na mesma transação: o conteúdo corresponde ao instante do seq
+    conn.execute('BEGIN')
+    try:
+        c.execute('SELECT seq_compactado FROM alteracoes_estado WHERE id = 1')
+        seq_compactado = c.fetchone()[0]
+        if desde < seq_compactado:
+            raise AlteracoesCompactadas(seq_compactado)
+
+        c.execute('SELECT seq, tabela, registro_id, excluido FROM alteracoes WHERE seq > ? ORDER BY seq LIMIT ?',
+                  (desde, limite + 1))
+        entradas = c.fetchall()
+        mais = len(entradas) > limite
+        entradas = entradas[:limite]
+
+        # Estado final de cada registro no trecho (a última entrada prevalece)
+        por_tabela = {}
+        for _, tabela, registro_id, excluido in entradas:
+            por_tabela.setdefault(tabela, {})[registro_id] = bool(excluido)
+
+        resultado = {'desde': desde, 'seq': entradas[-1][0] if entradas else max(desde, seq_atual(c)), 'mais': mais}
+        for tabela in TABELAS_ALTERACOES:
+            registros = por_tabela.get(tabela)
+            if not registros:
+                continue
+            ids = [registro_id for registro_id, excluido in registros.items() if not excluido]
+            gravados = carregadores[tabela](c, ids) if ids else []
+            # Gravado no trecho e excluído depois dele: já vai como excluído (a exclusão vem no próximo trecho)
+            encontrados = {registro['id'] for registro in gravados}
+            excluidos = [registro_id for registro_id, excluido in registros.items()
+                         if excluido or registro_id not in encontrados]
+            resultado[tabela] = {'gravados': gravados, 'excluidos': excluidos}
+        return resultado
+    finally:
+        conn.rollback()
+        c.close()
+
+
+def compactar_alteracoes(conn, retencao_dias=ALTERACOES_RETENCAO_DIAS):
+    """Apaga as entradas substituídas e as mais antigas que a retenção. Retorna o total apagado."""
+    global _ultima_compactacao
+    limite = int(time.time()) - retencao_dias * 86400
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        c = conn.cursor()
+        c.execute('''DELETE FROM alteracoes WHERE seq NOT IN
+                     (SELECT MAX(seq) FROM alteracoes GROUP BY tabela, registro_id)''')
+        substituidas = c.rowcount
+        # seq cresce junto com o tempo: tudo até a última entrada antiga sai do registro
+        c.execute('SELECT MAX(seq) FROM alteracoes WHERE criado_em < ?', (limite,))
+        seq_antigo = c.fetchone()[0]
+        antigas = 0
+        if seq_antigo is not None:
+            c.execute('DELETE FROM alteracoes WHERE seq <= ?', (seq_antigo,))
+            antigas = c.rowcount
+            c.execute('UPDATE alteracoes_estado SET seq_compactado = MAX(seq_compactado, ?) WHERE id = 1',
+                      (seq_antigo,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _ultima_compactacao = time.time()
+    if substituidas or antigas:
+        logger.info(f"Registro de alterações compactado: {substituidas} entradas substituídas e "
+                    f"{antigas} com mais de {retencao_dias} dias removidas")
+    return substituidas + antigas
+
+
+def compactar_se_necessario(conn):
+    """Compacta o registro se a última compactação deste processo tiver mais de ALTERACOES_COMPACTAR_INTERVALO."""
+    if time.time() - _ultima_compactacao < ALTERACOES_COMPACTAR_INTERVALO:
+        return
+    # Apenas uma thread do processo compacta; as demais seguem sem esperar
+    if not _lock_compactacao.acquire(blocking=False):
+        return
+    try:
+        if time.time() - _ultima_compactacao >= ALTERACOES_COMPACTAR_INTERVALO:
+            compactar_alteracoes(conn)
+    except Exception as e:
+        logger.error(f"Erro ao compactar o registro de alterações: {str(e)}", exc_info=True)
+    finally:
+        _lock_compactacao.release()
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = pool.obter()
+    try:
+        criar_esquema_alteracoes(conn.cursor())
+        conn.commit()
+        if '--compactar' in sys.argv:
+            removidas = compactar_alteracoes(conn)
+            logger.info(f"{removidas} entradas removidas; seq atual: {seq_atual(conn.cursor())}")
+        else:
+            print(__doc__)
+    finally:
+        conn.close()
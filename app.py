@@ -1,19 +1,59 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, g, has_app_context, Response, stream_with_context
 from flask_cors import CORS
-import sqlite3
 import pandas as pd
-from io import BytesIO
+from openpyxl import load_workbook
+import xlsxwriter
+from io import BytesIO, StringIO, TextIOWrapper
 import base64
-from datetime import datetime
+import csv
+import hashlib
+import json
+from datetime import datetime, date
 import logging
 import os
-
-# Configuração de logging
-logging.basicConfig(level=logging.DEBUG)
+import re
+import tempfile
+import time
+
+from banco import pool, DB_PATH
+from tarefas import (registrar_tarefa, enviar_tarefa, obter_tarefa, cancelar_tarefa,
+                     criar_esquema_tarefas, recuperar_tarefas_interrompidas, TAREFAS_DIR)
+from resumos import (criar_esquema_resumos, consultar_ranking, resumo_dashboard, opcoes_filtros,
+                     PERIODOS_DASHBOARD)
+from cubo import criar_esquema_cubo, consultar_cubo, copia as copia_cubo
+from colunar import (criar_esquema_colunar, gravar_colunar, gerar_instantaneo, ler_manifesto, FORMATOS_COLUNARES,
+                     MIMETYPES_COLUNARES, PYARROW_DISPONIVEL)
+from metricas import configurar_metricas
+from respostas import configurar_respostas, resposta_json_em_fluxo, serializar_json
+from cache_respostas import criar_esquema_versao, resposta_em_cache, versao_dados
+from geo import (criar_esquema_geo, condicoes_filtros, locais_no_raio, locais_mais_proximos, locais_no_retangulo,
+                 CATEGORIAS)
+from agrupamentos import criar_esquema_agrupamentos, agrupamentos_viewport, FONTES, ZOOM_MAXIMO
+from busca import criar_esquema_busca, indexacao_adiada, consulta_texto, subconsulta_texto, condicao_parcial
+from servicos import (criar_esquema_servicos, gravar_servicos, gravar_servicos_lote, anexar_servicos, listar_servicos,
+                      MODOS_FILTRO)
+from lote import TabelaLote, executar_lote, MODOS as MODOS_LOTE, LOTE_MAXIMO_OPERACOES
+from duplicatas import (criar_esquema_duplicatas, condicao_impressao, grupos_manutencoes, grupos_locais,
+                        DUPLICATAS_SIMILARIDADE, DUPLICATAS_DIAS, DUPLICATAS_RAIO_M)
+from geocodificacao import (criar_esquema_geocodificacao, geocodificar, geocodificar_reverso, geocodificar_lote,
+                            preencher_coordenadas_manutencoes)
+from alteracoes import (criar_esquema_alteracoes, ler_alteracoes, compactar_se_necessario, seq_atual,
+                         AlteracoesCompactadas)
+from armazenamento import (criar_esquema_arquivos, caminho_arquivo, decodificar_data_url,
+                           inserir_anexo, remover_arquivos_orfaos, ArquivosNovos)
+
+# Configuração de logging: nível pela variável LOG_LEVEL (DEBUG, INFO, WARNING, ...), padrão INFO
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
+# Latência, consultas SQL e tamanho das respostas por rota em /metrics (ver metricas.py)
+configurar_metricas(app)
+
+# Serialização JSON mais rápida e compressão gzip/brotli das respostas (ver respostas.py)
+configurar_respostas(app)
+
 # Configuração de CORS simplificada.
 # Permite que o frontend em desenvolvimento (ex: porta 5500) e o frontend
 # em produção no Render acessem a API.
@@ -25,16 +65,67 @@ origins = [
 CORS(app, resources={
     r"/api/*": {
         "origins": origins,
-        "expose_headers": "Content-Disposition" # Permite que o frontend leia o nome do arquivo
+        "expose_headers": ["Content-Disposition", "ETag", "Content-Range"] # Permite que o frontend leia o nome do arquivo
     }
 })
 
+# Colunas da tabela 'manutencoes' retornadas pela API (listagens, relatórios e registro de
+# alterações) e que podem ser solicitadas via parâmetro `fields=`. 'data_iso' (somente leitura)
+# é a data em 'YYYY-MM-DD' pela qual as listagens são ordenadas; 'data' é o texto informado.
+MANUTENCOES_CAMPOS = ('id', 'data', 'placa', 'motorista', 'telefone', 'tipo', 'oc', 'valor',
+                      'pix', 'favorecido', 'local', 'defeito', 'latitude', 'longitude', 'data_iso')
+MANUTENCOES_COLUNAS_SQL = ', '.join(MANUTENCOES_CAMPOS)
+
+# Limites da paginação da listagem de manutenções
+PAGINA_LIMITE_PADRAO = 50
+PAGINA_LIMITE_MAXIMO = 500
+
+# Ordenação padrão das manutenções (mais recentes primeiro), atendida pelo índice (data_iso, id)
+ORDEM_MANUTENCOES = 'ORDER BY data_iso DESC, id DESC'
+
+_DATA_ISO_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+_DATA_BR_RE = re.compile(r'^(\d{2})/(\d{2})/(\d{4}|\d{2})\b')
+
+def normalizar_data(valor):
+    """
+    Converte uma data em 'YYYY-MM-DD', 'DD/MM/YYYY' ou 'DD/MM/YY' para o formato
+    canônico 'YYYY-MM-DD' usado na coluna data_iso. Retorna '' se a data for inválida.
+    """
+    if not valor or not isinstance(valor, str):
+        return ''
+    valor = valor.strip()
+    match = _DATA_ISO_RE.match(valor)
+    if match:
+        ano, mes, dia = match.groups()
+    else:
+        match = _DATA_BR_RE.match(valor)
+        if not match:
+            return ''
+        dia, mes, ano = match.groups()
+        if len(ano) == 2:
+            ano = '20' + ano
+    try:
+        return datetime(int(ano), int(mes), int(dia)).strftime('%Y-%m-%d')
+    except ValueError:
+        return ''
+
 def get_db_connection():
-    """Cria uma conexão com o banco que permite acesso às colunas por nome."""
-    conn = sqlite3.connect('manutencoes.db')
-    conn.row_factory = sqlite3.Row
+    """
+    Obtém uma conexão do pool (ver banco.py) que permite acesso às colunas por nome.
+    conn.close() devolve a conexão ao pool; as que não forem fechadas durante a
+    requisição (ex.: por causa de uma exceção) são devolvidas em close_db_connections().
+    """
+    conn = pool.obter()
+    if has_app_context():
+        g.setdefault('db_conexoes', []).append(conn)
     return conn
 
+@app.teardown_appcontext
+def close_db_connections(exception=None):
+    """Garante que toda conexão obtida durante a requisição volte ao pool, inclusive em erros."""
+    for conn in g.pop('db_conexoes', []):
+        conn.close()
+
 # Rota de teste para verificar conectividade
 @app.route('/api/test', methods=['GET'])
 def test():
@@ -43,10 +134,9 @@ def test():
 
 def init_db():
     try:
-        if not os.path.exists('manutencoes.db'):
-            logger.info("Criando novo banco de dados: manutencoes.db")
+        if not os.path.exists(DB_PATH):
+            logger.info(f"Criando novo banco de dados: {DB_PATH}")
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;') # Habilita o suporte a chaves estrangeiras
         c = conn.cursor()
 
         c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='manutencoes'")
@@ -66,7 +156,10 @@ def init_db():
                           pix TEXT,
                           favorecido TEXT,
                           local TEXT,
-                          defeito TEXT)''')
+                          defeito TEXT,
+                          latitude REAL,
+                          longitude REAL,
+                          data_iso TEXT NOT NULL DEFAULT '')''')
         else:
             # Lógica de migração para remover colunas antigas de anexo
             c.execute("PRAGMA table_info(manutencoes)")
@@ -83,7 +176,24 @@ def init_db():
             if 'longitude' not in columns:
                 logger.info("Adicionando coluna 'longitude' à tabela 'manutencoes'...")
                 c.execute('ALTER TABLE manutencoes ADD COLUMN longitude REAL')
-        
+            if 'data_iso' not in columns:
+                logger.info("Adicionando coluna 'data_iso' à tabela 'manutencoes'...")
+                c.execute("ALTER TABLE manutencoes ADD COLUMN data_iso TEXT NOT NULL DEFAULT ''")
+
+        # Preenche data_iso (formato canônico 'YYYY-MM-DD') das linhas ainda não normalizadas.
+        # Linhas com data inválida permanecem com '' e ficam no fim da ordenação.
+        conn.create_function('normalizar_data', 1, normalizar_data, deterministic=True)
+        c.execute("UPDATE manutencoes SET data_iso = normalizar_data(data) WHERE data_iso = '' AND normalizar_data(data) != ''")
+        if c.rowcount > 0:
+            logger.info(f"Coluna 'data_iso' preenchida em {c.rowcount} registros")
+
+        # Índices para ordenação por data e filtros por placa/motorista dentro de um período
+        c.execute('CREATE INDEX IF NOT EXISTS idx_manutencoes_data_iso_id ON manutencoes (data_iso, id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_manutencoes_placa_data_iso ON manutencoes (placa, data_iso)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_manutencoes_motorista_data_iso ON manutencoes (motorista, data_iso)')
+        # Impressão digital (placa, data, valor, OC) usada para ignorar linhas já importadas (ver duplicatas.py)
+        criar_esquema_duplicatas(c)
+
         # Adiciona a tabela para os locais do mapa, se não existir
         c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='mapa_locais'")
         if not c.fetchone():
@@ -99,7 +209,7 @@ def init_db():
                          estado TEXT,
                          telefone TEXT,
                          observacoes TEXT,
-                         servicos TEXT, -- Armazenado como texto separado por vírgulas
+                         servicos TEXT, -- Legado (texto separado por vírgulas); os serviços ficam em 'mapa_locais_servicos'
                          avaliacao REAL
                         )''')
         else:
@@ -131,10 +241,46 @@ def init_db():
                           manutencao_id INTEGER NOT NULL,
                           nome_arquivo TEXT NOT NULL,
                           tipo_arquivo TEXT NOT NULL,
-                          dados_arquivo TEXT NOT NULL, -- Armazena como Base64
+                          dados_arquivo TEXT, -- Legado (Base64); o conteúdo fica no armazenamento em disco
+                          hash TEXT, -- SHA-256 do conteúdo (ver armazenamento.py)
+                          tamanho INTEGER,
                           FOREIGN KEY (manutencao_id) REFERENCES manutencoes (id) ON DELETE CASCADE
                          )''')
 
+        # Armazenamento dos arquivos em disco, endereçado por hash, com contagem de referências
+        criar_esquema_arquivos(c)
+
+        # Resumos por motorista e por placa usados pelos rankings (ver resumos.py)
+        criar_esquema_resumos(c)
+
+        # Fatos pré-agregados dos relatórios (ver cubo.py)
+        criar_esquema_cubo(c)
+
+        # Índices de busca por texto livre e por telefone/placa parciais (ver busca.py)
+        criar_esquema_busca(c)
+
+        # Serviços dos locais do mapa, normalizados (ver servicos.py)
+        criar_esquema_servicos(c)
+
+        # Índice espacial dos locais do mapa (ver geo.py)
+        criar_esquema_geo(c)
+        # Versão das coordenadas usada pelos agrupamentos do mapa (ver agrupamentos.py)
+        criar_esquema_agrupamentos(c)
+        # Cache das consultas de geocodificação (ver geocodificacao.py)
+        criar_esquema_geocodificacao(c)
+
+        # Versão dos dados usada pelo cache HTTP e pelo reaproveitamento de tarefas (ver cache_respostas.py)
+        criar_esquema_versao(c)
+
+        # Registro de alterações para a sincronização incremental dos clientes (ver alteracoes.py)
+        criar_esquema_alteracoes(c)
+
+        # Versões das partições dos instantâneos Parquet/Arrow (ver colunar.py)
+        criar_esquema_colunar(c)
+
+        # Fila de tarefas em segundo plano (ver tarefas.py)
+        criar_esquema_tarefas(c)
+        recuperar_tarefas_interrompidas(c)
 
         # Verificar registros existentes
         c.execute("SELECT COUNT(*) FROM manutencoes")
@@ -150,17 +296,210 @@ def init_db():
 
 init_db()
 
-def format_date_from_excel(date_val):
-    """Converte datas do Excel (serial ou texto) para YYYY-MM-DD."""
-    if pd.isna(date_val) or date_val == '':
-        return None
+# Colunas da planilha de importação
+IMPORTACAO_COLUNAS_OBRIGATORIAS = ['data', 'placa', 'motorista', 'tipo', 'valor', 'local', 'defeito']
+IMPORTACAO_COLUNAS_OPCIONAIS = ['telefone', 'oc', 'pix', 'favorecido']
+
+# Linhas gravadas por transação na importação: o lock de escrita é liberado entre os lotes
+IMPORTACAO_LOTE = int(os.environ.get('IMPORTACAO_LOTE', 1000))
+# Máximo de linhas rejeitadas detalhadas na resposta da importação (o total é sempre informado)
+IMPORTACAO_MAX_ERROS = 500
+
+def converter_datas_excel(serie):
+    """
+    Converte uma coluna de datas do Excel para strings 'YYYY-MM-DD' de forma vetorizada.
+    Aceita células de data, números seriais do Excel e textos em 'YYYY-MM-DD' ou 'DD/MM/YYYY'.
+    Valores que não puderem ser convertidos resultam em NaN.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime('%Y-%m-%d')
+
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+
+    # Células já reconhecidas como data pelo leitor
+    eh_data = serie.map(lambda v: isinstance(v, (datetime, pd.Timestamp)))
+    if eh_data.any():
+        datas[eh_data] = pd.to_datetime(serie[eh_data], errors='coerce')
+
+    # Números seriais do Excel (dias desde 30/12/1899)
+    numeros = pd.to_numeric(serie.where(~eh_data), errors='coerce')
+    eh_serial = numeros.notna()
+    if eh_serial.any():
+        datas[eh_serial] = pd.to_datetime(numeros[eh_serial], unit='D', origin='1899-12-30', errors='coerce')
+
+    # Textos: formatos explícitos primeiro (rápidos), inferência só para o que sobrar
+    textos = serie.where(~eh_data & ~eh_serial & serie.notna()).astype('string').str.strip()
+    for formato in ('%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y'):
+        pendentes = datas.isna() & textos.notna()
+        if not pendentes.any():
+            break
+        datas[pendentes] = pd.to_datetime(textos[pendentes].str[:10], format=formato, errors='coerce')
+    pendentes = datas.isna() & textos.notna() & (textos != '')
+    if pendentes.any():
+        datas[pendentes] = pd.to_datetime(textos[pendentes], format='mixed', dayfirst=True, errors='coerce')
+
+    return datas.dt.strftime('%Y-%m-%d')
+
+def coluna_texto(df, coluna):
+    """Retorna a coluna como texto (vazio para células em branco), sem o '.0' de números inteiros."""
+    if coluna not in df.columns:
+        return pd.Series('', index=df.index)
+    serie = df[coluna]
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype('Int64')
+    return serie.astype('string').fillna('').str.strip()
+
+def preparar_importacao(df, linha_inicial=2):
+    """
+    Valida e converte um DataFrame da planilha de forma vetorizada.
+    Retorna (registros, rejeitadas): a lista de tuplas prontas para o INSERT e a lista
+    de linhas rejeitadas com o motivo. `linha_inicial` é o número, na planilha, da
+    primeira linha do DataFrame (a linha 1 é o cabeçalho).
+    """
+    df = df.reset_index(drop=True)
+    datas = converter_datas_excel(df['data'])
+    valores = pd.to_numeric(df['valor'], errors='coerce')
+    textos = {col: coluna_texto(df, col) for col in IMPORTACAO_COLUNAS_OBRIGATORIAS + IMPORTACAO_COLUNAS_OPCIONAIS
+              if col not in ('data', 'valor')}
+
+    # Motivo da rejeição de cada linha; a primeira regra violada prevalece
+    motivos = pd.Series(pd.NA, index=df.index, dtype='object')
+    regras = [
+        (datas.isna(), 'Data inválida'),
+        (valores.isna(), 'Valor não é um número válido'),
+        (valores < 0, 'Valor negativo'),
+    ]
+    for col in IMPORTACAO_COLUNAS_OBRIGATORIAS:
+        if col not in ('data', 'valor'):
+            regras.append((textos[col] == '', f"Campo obrigatório '{col}' vazio"))
+    for condicao, motivo in regras:
+        motivos[motivos.isna() & condicao.fillna(False)] = motivo
+
+    validas = motivos.isna()
+    rejeitadas = [{'linha': int(i) + linha_inicial, 'motivo': motivo}
+                  for i, motivo in motivos[~validas].items()]
+
+    colunas = pd.DataFrame({
+        'data': datas,
+        'data_iso': datas,
+        'placa': textos['placa'].str.upper(),
+        'motorista': textos['motorista'],
+        'telefone': textos['telefone'],
+        'tipo': textos['tipo'],
+        'oc': textos['oc'],
+        'valor': valores,
+        'pix': textos['pix'],
+        'favorecido': textos['favorecido'],
+        'local': textos['local'],
+        'defeito': textos['defeito'],
+    })[validas]
+    registros = list(colunas.astype(object).itertuples(index=False, name=None))
+    return registros, rejeitadas
+
+# Só grava a linha se ainda não houver manutenção com a mesma placa (?3), data (?2), valor (?8) e OC (?7):
+# reimportar a mesma planilha (ou repetir uma linha dentro dela) não duplica os dados
+IMPORTACAO_INSERT = f'''INSERT INTO manutencoes (data, data_iso, placa, motorista, telefone, tipo, oc, valor, pix, favorecido, local, defeito)
+                        SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11, ?12
+                        WHERE NOT EXISTS (SELECT 1 FROM manutencoes WHERE {condicao_impressao('?3', '?2', '?8', '?7')})'''
+
+def inserir_manutencoes_em_lotes(conn, registros, tamanho_lote=IMPORTACAO_LOTE):
+    """
+    Insere os registros com executemany, em transações de até `tamanho_lote` linhas, ignorando
+    os que já existem. Os índices de busca das linhas de cada lote são gravados de uma só vez,
+    ao final do lote. Retorna (inseridos, duplicadas).
+    """
+    inseridos = 0
+    c = conn.cursor()
+    for inicio in range(0, len(registros), tamanho_lote):
+        lote = registros[inicio:inicio + tamanho_lote]
+        try:
+            conn.execute('BEGIN IMMEDIATE')  # A verificação e a gravação acontecem sob o mesmo lock de escrita
+            with indexacao_adiada(c):
+                c.executemany(IMPORTACAO_INSERT, lote)
+                inseridos += c.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return inseridos, len(registros) - inseridos
+
+# Colunas gravadas no cadastro/edição, na ordem dos valores de validar_manutencao()
+COLUNAS_MANUTENCAO = ('data', 'placa', 'motorista', 'telefone', 'tipo', 'oc', 'valor', 'pix', 'favorecido',
+                      'local', 'defeito', 'latitude', 'longitude', 'data_iso')
+
+def validar_manutencao(data):
+    """Valida os dados de uma manutenção e retorna os valores de COLUNAS_MANUTENCAO. Lança ValueError."""
+    required_fields = ['data', 'placa', 'motorista', 'tipo', 'valor', 'local', 'defeito']
+    missing_fields = [field for field in required_fields if field not in data or not data[field]]
+    if missing_fields:
+        raise ValueError(f'Campos obrigatórios ausentes: {", ".join(missing_fields)}')
     try:
-        # Converte para objeto datetime do pandas, que lida com muitos formatos
-        dt = pd.to_datetime(date_val)
-        return dt.strftime('%Y-%m-%d')
-    except (ValueError, TypeError):
-        logger.warning(f"Não foi possível converter a data do Excel: {date_val}")
+        valor = float(data['valor'])
+    except (TypeError, ValueError):
+        raise ValueError('Valor deve ser um número válido.')
+    if valor < 0:
+        raise ValueError('Valor deve ser maior ou igual a zero.')
+    data_iso = normalizar_data(data.get('data'))
+    if not data_iso:
+        raise ValueError(f"Não foi possível converter a data fornecida: '{data['data']}'.")
+    return (data['data'], data['placa'].upper(), data['motorista'], data.get('telefone', ''), data['tipo'], data.get('oc', ''),
+            valor, data.get('pix', ''), data.get('favorecido', ''), data['local'], data['defeito'],
+            data.get('latitude'), data.get('longitude'), data_iso)
+
+# Campos de alteração incremental dos anexos (ver aplicar_diff_anexos)
+CAMPOS_DIFF_ANEXOS = ('anexos', 'anexos_manter', 'anexos_remover', 'anexos_novos')
+
+def _ids_anexos(data, campo):
+    ids = data.get(campo)
+    if ids is None:
         return None
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError(f'Campo {campo} deve ser uma lista de ids de anexos.')
+    return ids
+
+def aplicar_diff_anexos(c, manutencao_id, data):
+    """
+    Altera os anexos de uma manutenção sem reenviar nem regravar os que não mudaram:
+    - anexos_manter: ids que continuam (os demais são removidos);
+    - anexos_remover: ids removidos;
+    - anexos_novos: arquivos novos ({nome, tipo, dados em Base64}).
+    No formato antigo, `anexos` traz a lista completa: itens com `id` e sem `dados` são
+    mantidos, os com `dados` são inseridos e os ausentes, removidos. Sem nenhum desses
+    campos, os anexos ficam como estão. Retorna a quantidade de anexos removidos.
+    Lança ValueError se algum id não pertencer à manutenção.
+    """
+    manter = _ids_anexos(data, 'anexos_manter')
+    remover = _ids_anexos(data, 'anexos_remover') or []
+    novos = list(data.get('anexos_novos') or [])
+    if 'anexos' in data:
+        anexos = data.get('anexos') or []
+        manter = (manter or []) + [a['id'] for a in anexos if isinstance(a.get('id'), int) and not a.get('dados')]
+        novos += [a for a in anexos if a.get('dados')]
+
+    removidos = 0
+    if manter is not None or remover:
+        c.execute('SELECT id FROM anexos WHERE manutencao_id = ?', (manutencao_id,))
+        atuais = {row[0] for row in c.fetchall()}
+        desconhecidos = sorted((set(manter or []) | set(remover)) - atuais)
+        if desconhecidos:
+            raise ValueError(f'Anexos não pertencem à manutenção: {", ".join(map(str, desconhecidos))}')
+        excluir = set(remover) | (atuais - set(manter) if manter is not None else set())
+        c.executemany('DELETE FROM anexos WHERE id = ?', [(id,) for id in excluir])
+        removidos = len(excluir)
+    for anexo in novos:
+        inserir_anexo(c, manutencao_id, anexo.get('nome'), anexo.get('tipo'), anexo.get('dados'))
+    return removidos
+
+def gravar_anexos_lote(c, operacao, itens):
+    """Anexos das manutenções criadas/atualizadas em lote (na atualização, como em aplicar_diff_anexos)."""
+    for id, dados in itens:
+        if operacao == 'criar':
+            for anexo in (dados.get('anexos') or []) + (dados.get('anexos_novos') or []):
+                inserir_anexo(c, id, anexo.get('nome'), anexo.get('tipo'), anexo.get('dados'))
+        else:
+            aplicar_diff_anexos(c, id, dados)
+
+LOTE_MANUTENCOES = TabelaLote('manutencoes', COLUNAS_MANUTENCAO, validar_manutencao, gravar_anexos_lote)
 
 @app.route('/')
 def index():
@@ -171,40 +510,27 @@ def index():
 def add_manutencao():
     data = request.json
     try:
-        required_fields = ['data', 'placa', 'motorista', 'tipo', 'valor', 'local', 'defeito']
-        missing_fields = [field for field in required_fields if field not in data or not data[field]]
-        if missing_fields:
-            logger.warning(f"Campos obrigatórios ausentes: {missing_fields}")
-            return jsonify({'error': f'Campos obrigatórios ausentes: {", ".join(missing_fields)}'}), 400
-
-        valor = float(data['valor'])
-        if valor < 0:
-            logger.warning("Valor negativo fornecido na requisição")
-            return jsonify({'error': 'Valor deve ser maior ou igual a zero.'}), 400
-
-        if not data.get('data'):
-            logger.warning(f"Não foi possível converter a data fornecida: '{data['data']}'")
-            return jsonify({'error': f"Não foi possível converter a data fornecida: '{data['data']}'."}), 400
-
+        valores = validar_manutencao(data)
+    except ValueError as e:
+        logger.warning(f"Manutenção inválida: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    try:
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;')
         try:
             conn.execute('BEGIN') # Inicia uma transação
             c = conn.cursor()
-            c.execute('''INSERT INTO manutencoes (data, placa, motorista, telefone, tipo, oc, valor, pix, favorecido, local, defeito, latitude, longitude)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (data['data'], data['placa'].upper(), data['motorista'], data.get('telefone', ''), data['tipo'], data.get('oc', ''),
-                   valor, data.get('pix', ''), data.get('favorecido', ''), data['local'], data['defeito'],
-                   data.get('latitude'), data.get('longitude')))
+            c.execute(LOTE_MANUTENCOES.sql('criar'), valores)
             
             manutencao_id = c.lastrowid
             anexos = data.get('anexos', []) # Espera uma lista de anexos
-            for anexo in anexos:
-                c.execute('''INSERT INTO anexos (manutencao_id, nome_arquivo, tipo_arquivo, dados_arquivo)
-                             VALUES (?, ?, ?, ?)''',
-                          (manutencao_id, anexo.get('nome'), anexo.get('tipo'), anexo.get('dados')))
-
-            conn.commit() # Confirma a transação
+            with ArquivosNovos():  # Em caso de erro, apaga os arquivos gravados antes do rollback
+                for anexo in anexos:
+                    inserir_anexo(c, manutencao_id, anexo.get('nome'), anexo.get('tipo'), anexo.get('dados'))
+                conn.commit() # Confirma a transação
+        except ValueError as e:
+            conn.rollback()
+            logger.warning(f"Anexo inválido: {str(e)}")
+            return jsonify({'error': str(e)}), 400
         except Exception:
             conn.rollback() # Desfaz em caso de erro
             raise
@@ -213,54 +539,222 @@ def add_manutencao():
 
         logger.info("Manutenção adicionada com sucesso")
         return jsonify({'message': 'Manutenção adicionada com sucesso'}), 201
-    except ValueError:
-        logger.warning("Valor fornecido não é um número válido")
-        return jsonify({'error': 'Valor deve ser um número válido.'}), 400
     except Exception as e:
         logger.error(f"Erro ao adicionar manutenção: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao adicionar manutenção: {str(e)}'}), 500
 
-@app.route('/api/manutencoes', methods=['GET'])
-def get_manutencoes():
+def encode_cursor(data, id):
+    """Gera um cursor opaco (base64 de JSON) a partir da chave (data, id) do último item da página."""
+    bruto = json.dumps([data, id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, busca=False):
+    """
+    Decodifica um cursor gerado por encode_cursor. Lança ValueError se for inválido.
+    Na busca por texto a chave é (relevancia, id) em vez de (data, id).
+    """
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        chave, id = json.loads(bruto)
+    except Exception:
+        raise ValueError('Cursor inválido')
+    if busca:
+        chave_valida = isinstance(chave, (int, float)) and not isinstance(chave, bool)
+    else:
+        chave_valida = chave is None or isinstance(chave, str)
+    if not isinstance(id, int) or not chave_valida:
+        raise ValueError('Cursor inválido')
+    return chave, id
+
+def parse_fields(fields_param):
+    """
+    Interpreta o parâmetro `fields=` (lista separada por vírgulas).
+    Retorna None quando não informado; lança ValueError para campos desconhecidos.
+    """
+    if not fields_param:
+        return None
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    invalidos = [f for f in fields if f not in MANUTENCOES_CAMPOS and f != 'anexos']
+    if invalidos:
+        raise ValueError(f'Campos inválidos: {", ".join(invalidos)}')
+    return fields
+
+# Tamanho (em bytes) do arquivo. Para anexos ainda não migrados para o armazenamento em disco
+# (conteúdo em 'dados_arquivo' como data URL Base64), é calculado sem decodificar o Base64.
+ANEXO_TAMANHO_SQL = """
+    COALESCE(tamanho,
+             length(substr(dados_arquivo, instr(dados_arquivo, ',') + 1)) * 3 / 4
+             - CASE WHEN dados_arquivo LIKE '%==' THEN 2 WHEN dados_arquivo LIKE '%=' THEN 1 ELSE 0 END)
+"""
+
+def carregar_anexos(c, manutencao_ids):
+    """
+    Busca os metadados dos anexos de várias manutenções em uma única query e os agrupa
+    por manutencao_id. O conteúdo do arquivo não é incluído: ele é baixado sob demanda
+    em GET /api/anexos/<id>, indicado no campo 'url'.
+    """
+    anexos_map = {}
+    for anexo in metadados_anexos(c, 'manutencao_id', manutencao_ids):
+        anexos_map.setdefault(anexo['manutencao_id'], []).append(anexo)
+    return anexos_map
+
+def metadados_anexos(c, coluna, ids):
+    """Metadados (sem o conteúdo) dos anexos cujo `coluna` ('id' ou 'manutencao_id') está em ids."""
+    if not ids:
+        return []
+    placeholders = ','.join('?' for _ in ids)
+    query_anexos = f"""SELECT id, manutencao_id, nome_arquivo, tipo_arquivo, {ANEXO_TAMANHO_SQL} AS tamanho
+                       FROM anexos WHERE {coluna} IN ({placeholders})"""
+    c.execute(query_anexos, list(ids))
+    anexos = []
+    for anexo in c.fetchall():
+        anexo = dict(anexo)
+        anexo['url'] = f"/api/anexos/{anexo['id']}"
+        anexos.append(anexo)
+    return anexos
+
+# Linhas lidas do cursor por vez nas respostas JSON enviadas em fluxo
+JSON_FLUXO_LOTE = int(os.environ.get('JSON_FLUXO_LOTE', 1000))
+
+def manutencoes_em_fluxo(query, params, descricao):
+    """
+    Executa a consulta e retorna uma resposta com o array de manutenções (e os metadados dos
+    anexos) enviado em lotes de JSON_FLUXO_LOTE linhas, sem montar a lista inteira em memória.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(query, params)
+
+    def lotes():
+        total = 0
+        c_anexos = conn.cursor()
+        try:
+            while True:
+                rows = c.fetchmany(JSON_FLUXO_LOTE)
+                if not rows:
+                    break
+                manutencoes = [dict(row) for row in rows]
+                anexos_map = carregar_anexos(c_anexos, [m['id'] for m in manutencoes])
+                for manutencao in manutencoes:
+                    manutencao['anexos'] = anexos_map.get(manutencao['id'], [])
+                total += len(manutencoes)
+                yield manutencoes
+            logger.info(f"{descricao}: {total} manutenções")
+        finally:
+            # Encerra a leitura pendente antes de devolver a conexão ao pool (ver resposta_exportacao)
+            c.close()
+            c_anexos.close()
+            conn.close()
+
+    return resposta_json_em_fluxo(lotes())
+
+def filtros_listagem():
+    """
+    Condições SQL (e parâmetros) dos filtros da listagem: `telefone` e `placa` parciais,
+    resolvidos pelo índice de trigramas (ver busca.py), e `tipo` exato.
+    """
+    condicoes = []
+    params = []
+    for coluna in ('telefone', 'placa'):
+        valor = request.args.get(coluna, '').strip()
+        if valor:
+            condicao, valores = condicao_parcial(coluna, valor)
+            condicoes.append(condicao)
+            params.extend(valores)
+    tipo = request.args.get('tipo', '').strip()
+    if tipo:
+        condicoes.append('tipo = ?')
+        params.append(tipo)
+    return condicoes, params
+
+def listar_manutencoes_paginadas():
+    """
+    Listagem paginada por cursor (keyset) sobre (data_iso, id), do mais recente para o mais antigo.
+    Parâmetros: `limit`, `cursor` (opaco, vindo de `next_cursor`), `fields` (projeção de colunas)
+    e os filtros de filtros_listagem(). Com `q` (texto livre), os resultados vêm do índice FTS5
+    ordenados por relevância, e o cursor passa a ser sobre (relevancia, id).
+    """
+    try:
+        limit = int(request.args.get('limit', PAGINA_LIMITE_PADRAO))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Parâmetro limit deve ser um inteiro positivo.'}), 400
+    limit = min(limit, PAGINA_LIMITE_MAXIMO)
+
+    q = request.args.get('q', '').strip()
+    try:
+        fields = parse_fields(request.args.get('fields', '').strip())
+        consulta = consulta_texto(q) if q else None
+        cursor = request.args.get('cursor', '').strip()
+        chave_cursor = decode_cursor(cursor, busca=bool(q)) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    incluir_anexos = fields is None or 'anexos' in fields
+    colunas = list(MANUTENCOES_CAMPOS) if fields is None else [f for f in fields if f != 'anexos']
+    # A chave do cursor ('data_iso' ou 'relevancia', e 'id') é sempre lida
+    chave = 'relevancia' if q else 'data_iso'
+    colunas_sql = list(dict.fromkeys(colunas + [chave, 'id']))
+
+    condicoes, params = filtros_listagem()
+    if q:
+        query = f'SELECT {", ".join(colunas_sql)} FROM ({subconsulta_texto()}) JOIN manutencoes ON id = id_busca'
+        params.insert(0, consulta)
+        ordem = 'ORDER BY relevancia, id'
+        comparacao = '(relevancia, id) > (?, ?)'
+    else:
+        query = f'SELECT {", ".join(colunas_sql)} FROM manutencoes'
+        ordem = ORDEM_MANUTENCOES
+        comparacao = '(data_iso, id) < (?, ?)'
+    if chave_cursor:
+        valor_cursor, id_cursor = chave_cursor
+        condicoes.append(comparacao)
+        params.extend([valor_cursor if q else (valor_cursor or ''), id_cursor])
+    if condicoes:
+        query += ' WHERE ' + ' AND '.join(condicoes)
+    query += f' {ordem} LIMIT ?'
+    params.append(limit + 1)  # Um item extra indica se existe próxima página
+
+    conn = get_db_connection()
     try:
-        telefone_filtro = request.args.get('telefone', '').strip()
-        conn = get_db_connection()
         c = conn.cursor()
+        c.execute(query, params)
+        rows = c.fetchall()
+        tem_proxima = len(rows) > limit
+        rows = rows[:limit]
+
+        next_cursor = encode_cursor(rows[-1][chave], rows[-1]['id']) if tem_proxima else None
+        manutencoes = [{col: row[col] for col in colunas} for row in rows]
+
+        if incluir_anexos:
+            anexos_map = carregar_anexos(c, [row['id'] for row in rows])
+            for manutencao, row in zip(manutencoes, rows):
+                manutencao['anexos'] = anexos_map.get(row['id'], [])
+    finally:
+        conn.close()
+
+    logger.info(f"Página de manutenções retornada: {len(manutencoes)} itens")
+    return jsonify({'items': manutencoes, 'next_cursor': next_cursor, 'limit': limit})
 
-        if telefone_filtro:
-            logger.debug(f"Filtrando manutenções por telefone: {telefone_filtro}")
-            c.execute('SELECT * FROM manutencoes WHERE telefone LIKE ? ORDER BY substr(data, 7, 4) DESC, substr(data, 4, 2) DESC, substr(data, 1, 2) DESC, id DESC', (f'%{telefone_filtro}%',))
+@app.route('/api/manutencoes', methods=['GET'])
+@resposta_em_cache
+def get_manutencoes():
+    try:
+        # Com qualquer parâmetro de paginação ou busca por texto a resposta passa a ser paginada
+        if any(param in request.args for param in ('limit', 'cursor', 'fields', 'q')):
+            return listar_manutencoes_paginadas()
+
+        condicoes, params = filtros_listagem()
+        if condicoes:
+            logger.debug("Filtrando manutenções: %s", request.args)
+            query = f'SELECT {MANUTENCOES_COLUNAS_SQL} FROM manutencoes WHERE {" AND ".join(condicoes)} {ORDEM_MANUTENCOES}'
         else:
             logger.debug("Recuperando todas as manutenções")
-            c.execute('SELECT * FROM manutencoes ORDER BY substr(data, 7, 4) DESC, substr(data, 4, 2) DESC, substr(data, 1, 2) DESC, id DESC')
-
-        manutencoes_rows = c.fetchall()
-        manutencoes = [dict(row) for row in manutencoes_rows] # Lista de manutenções já ordenada
-        manutencao_ids = [m['id'] for m in manutencoes]
-
-        # Busca todos os anexos para as manutenções listadas de uma só vez (mais eficiente)
-        if manutencao_ids:
-            placeholders = ','.join('?' for _ in manutencao_ids)
-            query_anexos = f"SELECT id, manutencao_id, nome_arquivo, tipo_arquivo, dados_arquivo FROM anexos WHERE manutencao_id IN ({placeholders})"
-            c.execute(query_anexos, manutencao_ids)
-            anexos_rows = c.fetchall()
-
-            # Mapeia os anexos para cada ID de manutenção
-            anexos_map = {}
-            for anexo in anexos_rows:
-                mid = anexo['manutencao_id']
-                if mid not in anexos_map:
-                    anexos_map[mid] = []
-                anexos_map[mid].append(dict(anexo))
-            
-            # Adiciona a lista de anexos a cada manutenção
-            for manutencao in manutencoes:
-                manutencao['anexos'] = anexos_map.get(manutencao['id'], [])
-
+            query = f'SELECT {MANUTENCOES_COLUNAS_SQL} FROM manutencoes {ORDEM_MANUTENCOES}'
 
-        conn.close()
-        logger.info(f"Manutenções retornadas: {len(manutencoes)}")
-        return jsonify(manutencoes)
+        # Lista completa: enviada em fluxo, com os anexos buscados lote a lote
+        return manutencoes_em_fluxo(query, params, "Manutenções retornadas")
     except Exception as e:
         logger.error(f"Erro ao recuperar manutenções: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao recuperar manutenções: {str(e)}'}), 500
@@ -269,40 +763,29 @@ def get_manutencoes():
 def update_manutencao(id):
     data = request.json
     try:
-        required_fields = ['data', 'placa', 'motorista', 'tipo', 'valor', 'local', 'defeito']
-        missing_fields = [field for field in required_fields if field not in data or not data[field]]
-        if missing_fields:
-            logger.warning(f"Campos obrigatórios ausentes: {missing_fields}")
-            return jsonify({'error': f'Campos obrigatórios ausentes: {", ".join(missing_fields)}'}), 400
-
-        valor = float(data['valor'])
-        if valor < 0:
-            logger.warning("Valor negativo fornecido na requisição")
-            return jsonify({'error': 'Valor deve ser maior ou igual a zero.'}), 400
-
-        if not data.get('data'):
-            logger.warning(f"Não foi possível converter a data fornecida: '{data['data']}'")
-            return jsonify({'error': f"Não foi possível converter a data fornecida: '{data['data']}'."}), 400
-
+        valores = validar_manutencao(data)
+    except ValueError as e:
+        logger.warning(f"Manutenção inválida: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    try:
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;')
         try:
             conn.execute('BEGIN') # Inicia uma transação
             c = conn.cursor()
-            c.execute('''UPDATE manutencoes SET data = ?, placa = ?, motorista = ?, telefone = ?, tipo = ?, oc = ?, valor = ?, pix = ?, favorecido = ?, local = ?, defeito = ?, latitude = ?, longitude = ?
-                         WHERE id = ?''',
-                      (data['data'], data['placa'].upper(), data['motorista'], data.get('telefone', ''), data['tipo'], data.get('oc', ''),
-                       valor, data.get('pix', ''), data.get('favorecido', ''), data['local'], data['defeito'],
-                       data.get('latitude'), data.get('longitude'), id))
-            
-            # Remove anexos antigos e insere os novos
-            c.execute('DELETE FROM anexos WHERE manutencao_id = ?', (id,))
-            anexos = data.get('anexos', [])
-            for anexo in anexos:
-                c.execute('''INSERT INTO anexos (manutencao_id, nome_arquivo, tipo_arquivo, dados_arquivo)
-                             VALUES (?, ?, ?, ?)''',
-                          (id, anexo.get('nome'), anexo.get('tipo'), anexo.get('dados')))
-            conn.commit() # Confirma a transação
+            c.execute(LOTE_MANUTENCOES.sql('atualizar'), (*valores, id))
+            if c.rowcount == 0:
+                conn.rollback()
+                return jsonify({'error': 'Manutenção não encontrada'}), 404
+
+            # Apenas os anexos removidos e os novos são gravados (ver aplicar_diff_anexos)
+            with ArquivosNovos():
+                removidos = aplicar_diff_anexos(c, id, data)
+                conn.commit() # Confirma a transação
+            if removidos:
+                remover_arquivos_orfaos(conn)
+        except ValueError as e:
+            conn.rollback()
+            return jsonify({'error': str(e)}), 400
         except Exception:
             conn.rollback() # Desfaz em caso de erro
             raise
@@ -311,18 +794,68 @@ def update_manutencao(id):
 
         logger.info(f"Manutenção {id} atualizada com sucesso")
         return jsonify({'message': 'Manutenção atualizada com sucesso'})
-    except ValueError:
-        logger.warning("Valor fornecido não é um número válido")
-        return jsonify({'error': 'Valor deve ser um número válido.'}), 400
     except Exception as e:
         logger.error(f"Erro ao atualizar manutenção: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao atualizar manutenção: {str(e)}'}), 500
 
+@app.route('/api/manutencoes/<int:id>', methods=['PATCH'])
+def patch_manutencao(id):
+    """
+    Atualização parcial: altera apenas os campos enviados, gravando só as colunas cujo valor
+    mudou, e aceita as alterações incrementais de anexos de aplicar_diff_anexos.
+    Responde com a lista `campos_alterados`.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Envie um objeto JSON com os campos a alterar.'}), 400
+    editaveis = set(COLUNAS_MANUTENCAO) - {'data_iso'}
+    desconhecidos = sorted(set(data) - editaveis - set(CAMPOS_DIFF_ANEXOS) - {'id', 'data_iso'})
+    if desconhecidos:
+        return jsonify({'error': f'Campos desconhecidos: {", ".join(desconhecidos)}'}), 400
+    try:
+        conn = get_db_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')  # A linha lida não muda até o commit
+            c = conn.cursor()
+            c.execute('SELECT * FROM manutencoes WHERE id = ?', (id,))
+            atual = c.fetchone()
+            if not atual:
+                conn.rollback()
+                return jsonify({'error': 'Manutenção não encontrada'}), 404
+
+            # Valida o registro resultante, não apenas os campos enviados
+            mesclado = dict(atual)
+            mesclado.update((campo, valor) for campo, valor in data.items() if campo in editaveis)
+            valores = dict(zip(COLUNAS_MANUTENCAO, validar_manutencao(mesclado)))
+            alteradas = {coluna: valor for coluna, valor in valores.items() if valor != atual[coluna]}
+            if alteradas:
+                c.execute(f"UPDATE manutencoes SET {', '.join(f'{coluna} = ?' for coluna in alteradas)} WHERE id = ?",
+                          (*alteradas.values(), id))
+            with ArquivosNovos():
+                removidos = aplicar_diff_anexos(c, id, data)
+                conn.commit()
+            if removidos:
+                remover_arquivos_orfaos(conn)
+        except ValueError as e:
+            conn.rollback()
+            logger.warning(f"Alteração inválida da manutenção {id}: {str(e)}")
+            return jsonify({'error': str(e)}), 400
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        logger.info(f"Manutenção {id} alterada: {', '.join(alteradas) or 'nenhum campo'}")
+        return jsonify({'message': 'Manutenção atualizada com sucesso', 'campos_alterados': sorted(alteradas)})
+    except Exception as e:
+        logger.error(f"Erro ao alterar manutenção: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao alterar manutenção: {str(e)}'}), 500
+
 @app.route('/api/manutencoes/<int:id>', methods=['DELETE'])
 def delete_manutencao(id):
     try:
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;') # Garante que o ON DELETE CASCADE funcione
         c = conn.cursor()
         c.execute('DELETE FROM manutencoes WHERE id = ?', (id,))
         if c.rowcount == 0:
@@ -330,6 +863,7 @@ def delete_manutencao(id):
             logger.warning(f"Manutenção com ID {id} não encontrada")
             return jsonify({'error': 'Manutenção não encontrada'}), 404
         conn.commit()
+        remover_arquivos_orfaos(conn)
         conn.close()
         logger.info(f"Manutenção {id} excluída com sucesso")
         return jsonify({'message': 'Manutenção excluída com sucesso'})
@@ -337,44 +871,323 @@ def delete_manutencao(id):
         logger.error(f"Erro ao excluir manutenção: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao excluir manutenção: {str(e)}'}), 500
 
+def ler_lote():
+    """
+    Lê o corpo das rotas de lote: {"modo": "tudo_ou_nada" | "melhor_esforco", "operacoes": [...]}.
+    Retorna (operacoes, modo); lança ValueError se o corpo for inválido.
+    """
+    data = request.get_json(silent=True) or {}
+    operacoes = data.get('operacoes')
+    modo = data.get('modo', 'tudo_ou_nada')
+    if not isinstance(operacoes, list) or not operacoes:
+        raise ValueError('Envie {"operacoes": [...]} com ao menos uma operação.')
+    if len(operacoes) > LOTE_MAXIMO_OPERACOES:
+        raise ValueError(f'Máximo de {LOTE_MAXIMO_OPERACOES} operações por lote.')
+    if modo not in MODOS_LOTE:
+        raise ValueError(f'Modo inválido. Use: {", ".join(MODOS_LOTE)}')
+    return operacoes, modo
+
+def resposta_lote(resultado):
+    """200 se o lote foi aplicado (mesmo com falhas no modo melhor_esforco); 400 se foi desfeito."""
+    return jsonify(resultado), 200 if resultado['aplicado'] else 400
+
+@app.route('/api/manutencoes/lote', methods=['POST'])
+def lote_manutencoes():
+    """
+    Cria, atualiza e exclui várias manutenções em uma transação (ver lote.py). Cada operação:
+    {"op": "criar", "dados": {...}}, {"op": "atualizar", "id": 1, "dados": {...}} ou
+    {"op": "excluir", "id": 1}. Na atualização, os anexos só são substituídos se `anexos`
+    vier nos dados.
+    """
+    try:
+        operacoes, modo = ler_lote()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        resultado = executar_lote(conn, LOTE_MANUTENCOES, operacoes, modo)
+        if resultado['aplicado'] and any(r.get('op') != 'criar' and r['status'] < 400 for r in resultado['resultados']):
+            remover_arquivos_orfaos(conn)
+        conn.close()
+        return resposta_lote(resultado)
+    except Exception as e:
+        logger.error(f"Erro ao executar lote de manutenções: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao executar lote de manutenções: {str(e)}'}), 500
+
+# Grupos de duplicatas retornados por padrão e no máximo
+DUPLICATAS_LIMITE_PADRAO = 100
+DUPLICATAS_LIMITE_MAXIMO = 1000
+
+def parametros_duplicatas():
+    """`similaridade` (0 a 1) e `limit` (grupos retornados) das consultas de duplicatas."""
+    similaridade = _float_param('similaridade', 0, 1, obrigatorio=False)
+    limite = request.args.get('limit', str(DUPLICATAS_LIMITE_PADRAO)).strip()
+    if not limite.isdigit() or int(limite) < 1:
+        raise ValueError('Parâmetro limit deve ser um inteiro positivo.')
+    return (DUPLICATAS_SIMILARIDADE if similaridade is None else similaridade,
+            min(int(limite), DUPLICATAS_LIMITE_MAXIMO))
+
+@app.route('/api/manutencoes/duplicatas', methods=['GET'])
+@resposta_em_cache
+def get_manutencoes_duplicatas():
+    """
+    Grupos de manutenções duplicadas (mesma placa, data, valor e OC) ou quase duplicadas (mesma
+    placa, datas próximas, valores e textos semelhantes), calculados no servidor por blocos
+    (ver duplicatas.py). Parâmetros: `similaridade`, `dias`, `placa`, `data_inicio`, `data_fim` e `limit`.
+    """
+    try:
+        similaridade, limite = parametros_duplicatas()
+        dias = _float_param('dias', 0, 365, obrigatorio=False)
+        condicoes, params = [], []
+        for nome, operador in (('data_inicio', '>='), ('data_fim', '<=')):
+            valor = request.args.get(nome, '').strip()
+            if valor:
+                data_iso = normalizar_data(valor)
+                if not data_iso:
+                    raise ValueError(f'Parâmetro {nome} inválido.')
+                condicoes.append(f'data_iso {operador} ?')
+                params.append(data_iso)
+        placa = request.args.get('placa', '').strip().upper()
+        if placa:
+            condicoes.append('placa = ?')
+            params.append(placa)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        resultado = grupos_manutencoes(conn.cursor(), condicoes, params, similaridade,
+                                       DUPLICATAS_DIAS if dias is None else int(dias), limite)
+        conn.close()
+        logger.info(f"Busca de duplicatas de manutenções: {resultado['total']} grupos")
+        return jsonify(resultado)
+    except Exception as e:
+        logger.error(f"Erro ao buscar duplicatas de manutenções: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao buscar duplicatas: {str(e)}'}), 500
+
+@app.route('/api/anexos/<int:id>', methods=['GET'])
+def get_anexo(id):
+    """
+    Retorna o conteúdo binário de um anexo. Suporta ETag (If-None-Match) e
+    requisições parciais (Range). Use ?download=1 para forçar o download.
+    """
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute('SELECT nome_arquivo, tipo_arquivo, dados_arquivo, hash FROM anexos WHERE id = ?', (id,))
+        anexo = c.fetchone()
+        conn.close()
+        if not anexo:
+            return jsonify({'error': 'Anexo não encontrado'}), 404
+
+        opcoes = {
+            'mimetype': anexo['tipo_arquivo'] or 'application/octet-stream',
+            'as_attachment': request.args.get('download') == '1',
+            'download_name': anexo['nome_arquivo'],
+            'conditional': True,
+            'max_age': 3600
+        }
+        if anexo['hash']:
+            # Conteúdo no armazenamento em disco: o arquivo é enviado em streaming
+            caminho = os.path.abspath(caminho_arquivo(anexo['hash']))
+            if not os.path.exists(caminho):
+                logger.error(f"Arquivo do anexo {id} ausente no armazenamento: {anexo['hash']}")
+                return jsonify({'error': 'Arquivo do anexo não encontrado'}), 404
+            response = send_file(caminho, etag=anexo['hash'], **opcoes)
+        else:
+            # Anexo legado, ainda em Base64 no banco (ver migracao.py)
+            conteudo = decodificar_data_url(anexo['dados_arquivo'])
+            response = send_file(BytesIO(conteudo), etag=hashlib.sha256(conteudo).hexdigest(), **opcoes)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    except Exception as e:
+        logger.error(f"Erro ao recuperar anexo {id}: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao recuperar anexo: {str(e)}'}), 500
+
+# Entradas do registro de alterações lidas por resposta de /api/alteracoes
+ALTERACOES_LIMITE_PADRAO = 500
+ALTERACOES_LIMITE_MAXIMO = 500
+# Fluxo SSE: intervalo entre consultas ao registro, intervalo do comentário de keep-alive e
+# duração máxima de uma conexão (o EventSource reconecta sozinho, com Last-Event-ID)
+ALTERACOES_SSE_INTERVALO = float(os.environ.get('ALTERACOES_SSE_INTERVALO', 1.0))
+ALTERACOES_SSE_KEEPALIVE = 15
+ALTERACOES_SSE_DURACAO = int(os.environ.get('ALTERACOES_SSE_DURACAO', 300))
+
+def carregar_manutencoes_alteradas(c, ids):
+    c.execute(f"SELECT {MANUTENCOES_COLUNAS_SQL} FROM manutencoes WHERE id IN ({','.join('?' for _ in ids)})", ids)
+    return [dict(row) for row in c.fetchall()]
+
+def carregar_mapa_locais_alterados(c, ids):
+    c.execute(f"SELECT * FROM mapa_locais WHERE id IN ({','.join('?' for _ in ids)})", ids)
+    return anexar_servicos(c, [dict(row) for row in c.fetchall()])
+
+# Conteúdo atual dos registros gravados, no mesmo formato das listagens (ver alteracoes.py)
+CARREGADORES_ALTERACOES = {
+    'manutencoes': carregar_manutencoes_alteradas,
+    'anexos': lambda c, ids: metadados_anexos(c, 'id', ids),
+    'mapa_locais': carregar_mapa_locais_alterados,
+}
+
+def _seq_param(valor):
+    valor = (valor or '').strip()
+    if not valor:
+        return None
+    if not valor.isdigit():
+        raise ValueError('Parâmetro desde deve ser um inteiro não negativo (o seq da última sincronização).')
+    return int(valor)
+
+@app.route('/api/alteracoes', methods=['GET'])
+def get_alteracoes():
+    """
+    Alterações em manutenções, anexos e locais do mapa desde `desde` (seq da última
+    sincronização), para o cliente atualizar a cópia local sem baixar tudo de novo.
+    Sem `desde`, retorna apenas o seq atual, a ser guardado antes da carga completa.
+    Responde 410 se o trecho pedido já foi compactado (o cliente deve recarregar tudo).
+    """
+    try:
+        desde = _seq_param(request.args.get('desde'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        limit = int(request.args.get('limit', ALTERACOES_LIMITE_PADRAO))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Parâmetro limit deve ser um inteiro positivo.'}), 400
+    limit = min(limit, ALTERACOES_LIMITE_MAXIMO)
+
+    try:
+        conn = get_db_connection()
+        if desde is None:
+            return jsonify({'desde': None, 'seq': seq_atual(conn.cursor()), 'mais': False})
+        compactar_se_necessario(conn)
+        alteracoes = ler_alteracoes(conn, desde, limit, CARREGADORES_ALTERACOES)
+        logger.debug(f"Alterações desde {desde}: até seq {alteracoes['seq']}")
+        return jsonify(alteracoes)
+    except AlteracoesCompactadas as e:
+        return jsonify({'error': str(e), 'seq_minimo': e.seq_minimo}), 410
+    except Exception as e:
+        logger.error(f"Erro ao consultar alterações: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao consultar alterações: {str(e)}'}), 500
+
+def evento_sse(evento, dados, id=None):
+    linhas = [f'id: {id}'] if id is not None else []
+    linhas += [f'event: {evento}', f"data: {serializar_json(dados).decode('utf-8')}"]
+    return '\n'.join(linhas) + '\n\n'
+
+@app.route('/api/alteracoes/fluxo', methods=['GET'])
+def get_alteracoes_fluxo():
+    """
+    Server-Sent Events com as alterações à medida que são gravadas. Cada evento 'alteracoes'
+    tem o formato de GET /api/alteracoes e o seq como id; na reconexão, o EventSource envia
+    Last-Event-ID e o fluxo continua de onde parou. O evento 'recarregar' indica que o trecho
+    já foi compactado. Sem `desde` (nem Last-Event-ID), começa do seq atual.
+    """
+    try:
+        desde = _seq_param(request.headers.get('Last-Event-ID') or request.args.get('desde'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def eventos(desde):
+        inicio = ultimo_envio = time.monotonic()
+        yield f'retry: {int(ALTERACOES_SSE_INTERVALO * 1000) + 1000}\n\n'
+        while time.monotonic() - inicio < ALTERACOES_SSE_DURACAO:
+            alteracoes = None
+            # Uma conexão do pool por consulta: o fluxo não prende conexões enquanto espera
+            conn = pool.obter()
+            try:
+                if desde is None:
+                    desde = seq_atual(conn.cursor())
+                elif seq_atual(conn.cursor()) > desde:
+                    alteracoes = ler_alteracoes(conn, desde, ALTERACOES_LIMITE_MAXIMO, CARREGADORES_ALTERACOES)
+            except AlteracoesCompactadas as e:
+                yield evento_sse('recarregar', {'seq_minimo': e.seq_minimo})
+                return
+            finally:
+                conn.close()
+
+            if alteracoes:
+                desde = alteracoes['seq']
+                ultimo_envio = time.monotonic()
+                yield evento_sse('alteracoes', alteracoes, id=desde)
+                if alteracoes['mais']:
+                    continue
+            elif time.monotonic() - ultimo_envio >= ALTERACOES_SSE_KEEPALIVE:
+                ultimo_envio = time.monotonic()
+                yield ': keep-alive\n\n'
+            time.sleep(ALTERACOES_SSE_INTERVALO)
+
+    return Response(stream_with_context(eventos(desde)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Quantidade de posições retornadas pelos rankings
+RANKING_LIMITE = 5
+
 @app.route('/api/estatisticas/motoristas', methods=['GET'])
+@resposta_em_cache
 def get_ranking_motoristas():
+    """Ranking de motoristas lido das tabelas de resumo. Aceita ?periodo=AAAA-MM, AAAA ou AAAA-MM:AAAA-MM."""
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute('''SELECT motorista, COUNT(*) as total_manutencoes, SUM(valor) as valor_total
-                     FROM manutencoes
-                     GROUP BY motorista
-                     ORDER BY total_manutencoes DESC, valor_total DESC
-                     LIMIT 5''')
-        motoristas = []
-        motoristas = [dict(row) for row in c.fetchall()]
+        motoristas = consultar_ranking(c, 'motoristas', RANKING_LIMITE, request.args.get('periodo'))
         conn.close()
         logger.info(f"Ranking de motoristas retornado: {len(motoristas)} motoristas")
         return jsonify(motoristas)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Erro ao recuperar ranking de motoristas: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao recuperar ranking de motoristas: {str(e)}'}), 500
 
 @app.route('/api/estatisticas/veiculos', methods=['GET'])
+@resposta_em_cache
 def get_ranking_veiculos():
+    """Ranking de veículos lido das tabelas de resumo. Aceita ?periodo=AAAA-MM, AAAA ou AAAA-MM:AAAA-MM."""
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute('''SELECT placa, COUNT(*) as total_manutencoes, SUM(valor) as valor_total
-                     FROM manutencoes
-                     GROUP BY placa
-                     ORDER BY total_manutencoes DESC, valor_total DESC
-                     LIMIT 5''')
-        veiculos = []
-        veiculos = [dict(row) for row in c.fetchall()]
+        veiculos = consultar_ranking(c, 'veiculos', RANKING_LIMITE, request.args.get('periodo'))
         conn.close()
         logger.info(f"Ranking de veículos retornado: {len(veiculos)} veículos")
         return jsonify(veiculos)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Erro ao recuperar ranking de veículos: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao recuperar ranking de veículos: {str(e)}'}), 500
 
+@app.route('/api/estatisticas/resumo', methods=['GET'])
+def get_resumo_dashboard():
+    """
+    KPIs do dashboard calculados no servidor a partir das tabelas de resumo.
+    Parâmetros: periodo (todos, hoje, semana, mes, trimestre, ano), motorista, placa, tipo,
+    hoje (AAAA-MM-DD; data de referência do cliente, padrão: data do servidor) e
+    opcoes=1 para incluir as listas de motoristas, placas e tipos dos filtros.
+    """
+    try:
+        periodo = request.args.get('periodo', 'todos')
+        if periodo not in PERIODOS_DASHBOARD:
+            return jsonify({'error': f'Período inválido. Use: {", ".join(PERIODOS_DASHBOARD)}'}), 400
+        referencia = date.today()
+        if request.args.get('hoje'):
+            referencia_iso = normalizar_data(request.args['hoje'])
+            if not referencia_iso:
+                return jsonify({'error': 'Data de referência inválida'}), 400
+            referencia = date.fromisoformat(referencia_iso)
+        filtros = {campo: request.args.get(campo, '').strip() for campo in ('motorista', 'placa', 'tipo')}
+
+        conn = get_db_connection()
+        c = conn.cursor()
+        resumo = resumo_dashboard(c, referencia, periodo, filtros)
+        if request.args.get('opcoes') == '1':
+            resumo['opcoes'] = opcoes_filtros(c)
+        conn.close()
+        logger.info(f"Resumo do dashboard retornado (período: {periodo})")
+        return jsonify(resumo)
+    except Exception as e:
+        logger.error(f"Erro ao gerar resumo do dashboard: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao gerar resumo do dashboard: {str(e)}'}), 500
+
 @app.route('/api/relatorios', methods=['POST'])
 def gerar_relatorio():
     try:
@@ -384,10 +1197,7 @@ def gerar_relatorio():
         placa = data.get('placa', '').strip()
         motorista = data.get('motorista', '').strip()
 
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        query = 'SELECT * FROM manutencoes WHERE data BETWEEN ? AND ?'
+        query = f'SELECT {MANUTENCOES_COLUNAS_SQL} FROM manutencoes WHERE data_iso BETWEEN ? AND ?'
         params = [data_inicio, data_fim]
 
         if placa:
@@ -398,99 +1208,240 @@ def gerar_relatorio():
             query += ' AND motorista = ?'
             params.append(motorista)
 
-        query += ' ORDER BY substr(data, 7, 4) DESC, substr(data, 4, 2) DESC, substr(data, 1, 2) DESC, id DESC'
-
-        logger.debug(f"Executando query: {query} com parâmetros: {params}")
-        c.execute(query, params)
-        manutencoes_rows = c.fetchall()
-        manutencoes = [dict(row) for row in manutencoes_rows] # Lista de manutenções já ordenada
-        manutencao_ids = [m['id'] for m in manutencoes]
-
-        # Busca todos os anexos para as manutenções listadas de uma só vez
-        if manutencao_ids:
-            placeholders = ','.join('?' for _ in manutencao_ids)
-            query_anexos = f"SELECT id, manutencao_id, nome_arquivo, tipo_arquivo FROM anexos WHERE manutencao_id IN ({placeholders})"
-            c.execute(query_anexos, manutencao_ids)
-            anexos_rows = c.fetchall()
-
-            # Mapeia os anexos para cada ID de manutenção
-            anexos_map = {}
-            for anexo in anexos_rows:
-                mid = anexo['manutencao_id']
-                if mid not in anexos_map:
-                    anexos_map[mid] = []
-                anexos_map[mid].append(dict(anexo))
-            
-            for manutencao in manutencoes:
-                manutencao['anexos'] = anexos_map.get(manutencao['id'], [])
+        query += f' {ORDEM_MANUTENCOES}'
 
-        conn.close()
-        logger.info(f"Relatório gerado: {len(manutencoes)} manutenções")
-        return jsonify(manutencoes)
+        logger.debug("Executando query: %s com parâmetros: %s", query, params)
+        return manutencoes_em_fluxo(query, params, "Relatório gerado")
     except Exception as e:
         logger.error(f"Erro ao gerar relatório: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao gerar relatório: {str(e)}'}), 500
 
-@app.route('/api/exportar_relatorio_excel', methods=['POST'])
-def exportar_relatorio_excel():
-    try:
-        data = request.json
-        data_inicio = data.get('data_inicio')
-        data_fim = data.get('data_fim')
-        placa = data.get('placa', '').strip()
-        motorista = data.get('motorista', '').strip()
+# Máximo de itens (linhas) retornados pelo cubo dos relatórios
+CUBO_LIMITE_MAXIMO = 10000
 
+@app.route('/api/relatorios/cubo', methods=['GET'])
+@resposta_em_cache
+def get_relatorio_cubo():
+    """
+    Agrupamentos e tabelas dinâmicas sobre os fatos pré-agregados (ver cubo.py). Ex.: custo
+    total por placa e mês, por tipo: ?linhas=placa,mes&colunas=tipo&medida=valor_total.
+    Filtros: data_inicio, data_fim e placa, motorista, tipo e local (repetíveis).
+    """
+    lista = lambda nome: [item.strip() for item in request.args.get(nome, '').split(',') if item.strip()]
+    filtros = {
+        'data_inicio': request.args.get('data_inicio', '').strip(),
+        'data_fim': request.args.get('data_fim', '').strip(),
+        'placa': [placa.strip().upper() for placa in request.args.getlist('placa') if placa.strip()],
+    }
+    for campo in ('motorista', 'tipo', 'local'):
+        filtros[campo] = [valor.strip() for valor in request.args.getlist(campo) if valor.strip()]
+    try:
+        limite = int(request.args.get('limit', CUBO_LIMITE_MAXIMO))
+        if limite < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Parâmetro limit deve ser um inteiro positivo.'}), 400
+    try:
+        for campo in ('data_inicio', 'data_fim'):
+            if filtros[campo] and not _DATA_ISO_RE.match(filtros[campo]):
+                raise ValueError(f'Parâmetro {campo} deve estar no formato AAAA-MM-DD.')
         conn = get_db_connection()
-        c = conn.cursor()
-
-        query = 'SELECT data, placa, motorista, telefone, tipo, oc, valor, pix, favorecido, local, defeito FROM manutencoes WHERE data BETWEEN ? AND ?'
-        params = [data_inicio, data_fim]
+        celulas = copia_cubo.obter(conn)
+        conn.close()
+        resultado = consultar_cubo(celulas, lista('linhas'), lista('colunas'),
+                                   request.args.get('medida', 'valor_total'), filtros,
+                                   request.args.get('ordem', 'chave'), min(limite, CUBO_LIMITE_MAXIMO))
+        return jsonify(resultado)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro ao consultar o cubo dos relatórios: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao consultar o cubo: {str(e)}'}), 500
+
+# Linhas lidas do cursor por vez durante as exportações
+EXPORTACAO_LOTE = int(os.environ.get('EXPORTACAO_LOTE', 2000))
+EXPORTACAO_FORMATOS = ('xlsx', 'csv', 'ndjson') + FORMATOS_COLUNARES
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORTACAO_MIMETYPES = {
+    'xlsx': XLSX_MIMETYPE,
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    **MIMETYPES_COLUNARES
+}
+
+def erro_formato_exportacao(formato):
+    """Mensagem de erro para um formato inválido ou indisponível; None se o formato puder ser usado."""
+    if formato not in EXPORTACAO_FORMATOS:
+        return f'Formato inválido. Use: {", ".join(EXPORTACAO_FORMATOS)}'
+    if formato in FORMATOS_COLUNARES and not PYARROW_DISPONIVEL:
+        return f'O formato {formato} requer o pacote pyarrow no servidor'
+    return None
+
+def formatar_valor_exportacao(coluna, valor):
+    """Formata um valor para exportação: data em DD/MM/YYYY, textos em maiúsculas e nulos como vazio."""
+    if valor is None:
+        return ''
+    if coluna == 'data':
+        return f'{valor[8:10]}/{valor[5:7]}/{valor[0:4]}' if len(valor) >= 10 else valor
+    if isinstance(valor, str):
+        return valor.upper()
+    return valor
+
+def lotes_exportacao(c, primeiro_lote):
+    """Percorre o cursor em lotes de EXPORTACAO_LOTE linhas, sem formatação."""
+    lote = primeiro_lote
+    while lote:
+        yield lote
+        lote = c.fetchmany(EXPORTACAO_LOTE)
+
+def linhas_exportacao(c, colunas, primeiro_lote):
+    """Percorre o cursor em lotes de EXPORTACAO_LOTE linhas, já formatadas para exportação."""
+    for lote in lotes_exportacao(c, primeiro_lote):
+        for row in lote:
+            yield [formatar_valor_exportacao(col, row[col]) for col in colunas]
+
+def consulta_exportacao(escopo, filtros):
+    """
+    Monta a consulta de exportação. Retorna (query, params, nome_base, nome_planilha).
+    - escopo 'geral': todas as manutenções;
+    - escopo 'relatorio': manutenções entre data_inicio e data_fim, opcionalmente
+      filtradas por placa e motorista.
+    """
+    if escopo == 'relatorio':
+        query = 'SELECT data_iso AS data, placa, motorista, telefone, tipo, oc, valor, pix, favorecido, local, defeito FROM manutencoes WHERE data_iso BETWEEN ? AND ?'
+        params = [filtros.get('data_inicio'), filtros.get('data_fim')]
 
+        placa = (filtros.get('placa') or '').strip()
         if placa:
             query += ' AND placa = ?'
             params.append(placa.upper())
-        
+
+        motorista = (filtros.get('motorista') or '').strip()
         if motorista:
             query += ' AND motorista = ?'
             params.append(motorista)
 
-        query += ' ORDER BY substr(data, 7, 4) DESC, substr(data, 4, 2) DESC, substr(data, 1, 2) DESC, id DESC'
+        query += f' {ORDEM_MANUTENCOES}'
+        return query, params, 'relatorio_manutencoes', 'RelatorioManutencoes'
+
+    colunas = ', '.join('data_iso AS data' if col == 'data' else col for col in MANUTENCOES_CAMPOS if col != 'data_iso')
+    return f'SELECT {colunas} FROM manutencoes {ORDEM_MANUTENCOES}', [], 'manutencoes_geral', 'Manutencoes'
+
+def nome_arquivo_exportacao(nome_base, formato):
+    return f'{nome_base}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{formato}'
+
+def gravar_exportacao(arquivo, formato, nome_planilha, colunas, linhas):
+    """Grava as linhas no arquivo binário `arquivo`, no formato pedido, sem mantê-las em memória."""
+    if formato == 'xlsx':
+        workbook = xlsxwriter.Workbook(arquivo, {'constant_memory': True})
+        worksheet = workbook.add_worksheet(nome_planilha)
+        worksheet.write_row(0, 0, colunas)
+        for i, linha in enumerate(linhas, start=1):
+            worksheet.write_row(i, 0, linha)
+        workbook.close()
+        return
 
-        logger.debug(f"Executando query para exportação: {query} com parâmetros: {params}")
-        df = pd.read_sql_query(query, conn, params=params)
+    # utf-8-sig grava o BOM para o Excel reconhecer o UTF-8 do CSV
+    texto = TextIOWrapper(arquivo, encoding='utf-8-sig' if formato == 'csv' else 'utf-8', newline='')
+    try:
+        if formato == 'csv':
+            writer = csv.writer(texto, delimiter=';')
+            writer.writerow(colunas)
+            writer.writerows(linhas)
+        else:
+            for linha in linhas:
+                texto.write(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False) + '\n')
+    finally:
+        texto.detach()  # Descarrega o buffer sem fechar o arquivo de destino
+
+def resposta_exportacao(query, params, formato, nome_base, nome_planilha):
+    """
+    Gera a resposta de exportação lendo o cursor em lotes, sem montar um DataFrame.
+    - xlsx: escrito com o modo de memória constante do XlsxWriter em um arquivo
+      temporário, que é enviado em streaming;
+    - csv / ndjson: gerados e enviados ao cliente à medida que as linhas são lidas;
+    - parquet / arrow: colunas tipadas (ver colunar.py), gravadas em um arquivo temporário
+      como o xlsx; os valores não passam pela formatação das planilhas.
+    Retorna None quando a consulta não traz nenhuma linha.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(query, params)
+    colunas = [d[0] for d in c.description]
+    primeiro_lote = c.fetchmany(EXPORTACAO_LOTE)
+    if not primeiro_lote:
         conn.close()
+        return None
+
+    nome_arquivo = nome_arquivo_exportacao(nome_base, formato)
+    cabecalho_arquivo = {'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+
+    if formato == 'xlsx' or formato in FORMATOS_COLUNARES:
+        # Arquivo temporário anônimo: é apagado automaticamente quando a resposta o fecha
+        arquivo = tempfile.TemporaryFile()
+        try:
+            if formato in FORMATOS_COLUNARES:
+                gravar_colunar(arquivo, formato, colunas, lotes_exportacao(c, primeiro_lote))
+            else:
+                gravar_exportacao(arquivo, formato, nome_planilha, colunas, linhas_exportacao(c, colunas, primeiro_lote))
+            arquivo.seek(0)
+        except Exception:
+            arquivo.close()
+            raise
+        finally:
+            c.close()
+            conn.close()
+        return send_file(arquivo, mimetype=EXPORTACAO_MIMETYPES[formato], as_attachment=True, download_name=nome_arquivo)
+
+    def gerar():
+        try:
+            if formato == 'csv':
+                buffer = StringIO()
+                writer = csv.writer(buffer, delimiter=';')
+                buffer.write('\ufeff')  # BOM para o Excel reconhecer o UTF-8
+                writer.writerow(colunas)
+                for i, linha in enumerate(linhas_exportacao(c, colunas, primeiro_lote), start=1):
+                    writer.writerow(linha)
+                    if i % EXPORTACAO_LOTE == 0:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                partes = []
+                for linha in linhas_exportacao(c, colunas, primeiro_lote):
+                    partes.append(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False))
+                    if len(partes) >= EXPORTACAO_LOTE:
+                        yield '\n'.join(partes) + '\n'
+                        partes = []
+                if partes:
+                    yield '\n'.join(partes) + '\n'
+        finally:
+            # Fechar o cursor encerra a leitura pendente (ex.: cliente desconectou no meio do
+            # download); sem isso a conexão voltaria ao pool presa a um snapshot antigo
+            c.close()
+            conn.close()
+
+    return Response(stream_with_context(gerar()), mimetype=EXPORTACAO_MIMETYPES[formato], headers=cabecalho_arquivo)
 
-        if df.empty:
+@app.route('/api/exportar_relatorio_excel', methods=['POST'])
+def exportar_relatorio_excel():
+    try:
+        data = request.json
+        formato = (data.get('formato') or 'xlsx').lower()
+        erro_formato = erro_formato_exportacao(formato)
+        if erro_formato:
+            return jsonify({'error': erro_formato}), 400
+
+        query, params, nome_base, nome_planilha = consulta_exportacao('relatorio', data)
+        logger.debug("Executando query para exportação: %s com parâmetros: %s", query, params)
+        response = resposta_exportacao(query, params, formato, nome_base, nome_planilha)
+        if response is None:
             logger.warning("Nenhum dado disponível para exportação de relatório filtrado")
             return jsonify({'error': 'Nenhum dado disponível para exportação com os filtros aplicados'}), 400
 
-        if 'data' in df.columns:
-            df['data'] = pd.to_datetime(df['data']).dt.strftime('%d/%m/%Y')
-
-        # Converte todas as colunas de texto para maiúsculas, exceto a data
-        for col in df.select_dtypes(include=['object']).columns:
-            if col.lower() != 'data':
-                # Usar .astype(str) para lidar com valores nulos (NaN) e convertê-los para vazio
-                df[col] = df[col].astype(str).str.upper().replace('NAN', '')
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='RelatorioManutencoes')
-        output.seek(0)
-
-        # Adicionar cabeçalhos explícitos para exportação
-        headers = {
-            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            'Content-Disposition': f'attachment; filename=relatorio_manutencoes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            'Access-Control-Expose-Headers': 'Content-Disposition'
-        }
-        logger.info("Arquivo Excel de relatório filtrado gerado com sucesso")
-        return send_file(
-    output,
-    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    as_attachment=True,
-    download_name=f'relatorio_manutencoes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-)
+        logger.info(f"Exportação de relatório filtrado ({formato}) iniciada")
+        return response
     except Exception as e:
         logger.error(f"Erro ao exportar relatório para Excel: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao exportar relatório para Excel: {str(e)}'}), 500
@@ -498,95 +1449,421 @@ def exportar_relatorio_excel():
 @app.route('/api/exportar_excel', methods=['GET'])
 def exportar_excel():
     try:
-        conn = get_db_connection()
-        query = 'SELECT * FROM manutencoes ORDER BY substr(data, 7, 4) DESC, substr(data, 4, 2) DESC, substr(data, 1, 2) DESC, id DESC'
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-
-        if df.empty:
+        formato = request.args.get('formato', 'xlsx').lower()
+        erro_formato = erro_formato_exportacao(formato)
+        if erro_formato:
+            return jsonify({'error': erro_formato}), 400
+
+        query, params, nome_base, nome_planilha = consulta_exportacao('geral', {})
+        response = resposta_exportacao(query, params, formato, nome_base, nome_planilha)
+        if response is None:
             logger.warning("Nenhum dado disponível para exportação")
             return jsonify({'error': 'Nenhum dado disponível para exportação'}), 400
 
-        if 'data' in df.columns:
-            df['data'] = pd.to_datetime(df['data']).dt.strftime('%d/%m/%Y')
-
-        # Converte todas as colunas de texto para maiúsculas, exceto a data
-        for col in df.select_dtypes(include=['object']).columns:
-            if col.lower() != 'data':
-                # Usar .astype(str) para lidar com valores nulos (NaN) e convertê-los para vazio
-                df[col] = df[col].astype(str).str.upper().replace('NAN', '')
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Manutencoes')
-        output.seek(0)
-        logger.info("Arquivo Excel geral gerado com sucesso")
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'manutencoes_geral_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        )
+        logger.info(f"Exportação geral ({formato}) iniciada")
+        return response
     except Exception as e:
         logger.error(f"Erro ao exportar para Excel: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao exportar para Excel: {str(e)}'}), 500
 
+def ler_lotes_xlsx(caminho, tamanho_lote=IMPORTACAO_LOTE):
+    """
+    Lê uma planilha .xlsx em modo somente leitura (streaming), produzindo tuplas
+    (cabecalho, DataFrame do lote, número na planilha da primeira linha do lote).
+    Apenas um lote fica em memória por vez.
+    """
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        cabecalho = [str(col).strip() if col is not None else '' for col in cabecalho]
+        lote = []
+        linha_inicial = 2
+        for numero, linha in enumerate(linhas, start=2):
+            if all(v is None for v in linha):
+                continue
+            if not lote:
+                linha_inicial = numero
+            lote.append(linha[:len(cabecalho)])
+            if len(lote) >= tamanho_lote:
+                yield cabecalho, pd.DataFrame(lote, columns=cabecalho), linha_inicial
+                lote = []
+        if lote:
+            yield cabecalho, pd.DataFrame(lote, columns=cabecalho), linha_inicial
+    finally:
+        wb.close()
+
+def ler_lotes_csv(caminho, tamanho_lote=IMPORTACAO_LOTE):
+    """Lê um arquivo .csv em blocos, no mesmo formato de ler_lotes_xlsx."""
+    with open(caminho, 'r', encoding='utf-8-sig', newline='') as f:
+        separador = ';' if f.readline().count(';') > 0 else ','
+    linha_inicial = 2
+    for bloco in pd.read_csv(caminho, sep=separador, chunksize=tamanho_lote, dtype=str, encoding='utf-8-sig'):
+        bloco.columns = [str(col).strip() for col in bloco.columns]
+        yield list(bloco.columns), bloco, linha_inicial
+        linha_inicial += len(bloco)
+
+def importar_lotes(lotes, ao_gravar_lote=None):
+    """
+    Valida e grava os lotes produzidos por ler_lotes_xlsx/ler_lotes_csv.
+    Retorna (inseridos, duplicadas, total_rejeitadas, erros, colunas_ausentes), onde
+    `duplicadas` conta as linhas já existentes no banco (ignoradas) e `erros` traz no máximo
+    IMPORTACAO_MAX_ERROS linhas rejeitadas. Se informado, `ao_gravar_lote` é chamado com o
+    total de linhas processadas após cada lote.
+    """
+    inseridos = 0
+    duplicadas = 0
+    total_rejeitadas = 0
+    erros = []
+    conn = get_db_connection()
+    try:
+        for cabecalho, df, linha_inicial in lotes:
+            colunas_ausentes = [col for col in IMPORTACAO_COLUNAS_OBRIGATORIAS if col not in cabecalho]
+            if colunas_ausentes:
+                return inseridos, duplicadas, total_rejeitadas, erros, colunas_ausentes
+            registros, rejeitadas_lote = preparar_importacao(df, linha_inicial)
+            total_rejeitadas += len(rejeitadas_lote)
+            erros.extend(rejeitadas_lote[:IMPORTACAO_MAX_ERROS - len(erros)])
+            inseridos_lote, duplicadas_lote = inserir_manutencoes_em_lotes(conn, registros)
+            inseridos += inseridos_lote
+            duplicadas += duplicadas_lote
+            if ao_gravar_lote:
+                ao_gravar_lote(inseridos + duplicadas + total_rejeitadas)
+    finally:
+        conn.close()
+    return inseridos, duplicadas, total_rejeitadas, erros, []
+
+def mensagem_importacao(inseridos, duplicadas):
+    mensagem = f'{inseridos} manutenções importadas com sucesso'
+    if duplicadas:
+        mensagem += f' ({duplicadas} já existentes foram ignoradas)'
+    return mensagem
+
 @app.route('/api/importar_excel', methods=['POST'])
 def importar_excel():
+    """
+    Importa manutenções de uma planilha. O formato preferido é multipart/form-data com o
+    arquivo no campo 'file' (.xlsx ou .csv): o upload é gravado em um arquivo temporário e
+    lido em lotes, mantendo o uso de memória constante. O corpo JSON com o arquivo em
+    Base64 ('file_data', 'filename') continua aceito por compatibilidade.
+    """
+    caminho_temporario = None
     try:
-        data = request.json
-        file_data = data.get('file_data')
-        filename = data.get('filename')
+        if 'file' in request.files:
+            arquivo = request.files['file']
+            filename = arquivo.filename or ''
+            extensao = os.path.splitext(filename)[1].lower()
+            if extensao not in ('.xlsx', '.csv'):
+                logger.warning(f"Formato de arquivo não suportado na importação: {filename}")
+                return jsonify({'error': 'Formato não suportado. Envie um arquivo .xlsx ou .csv'}), 400
+            fd, caminho_temporario = tempfile.mkstemp(suffix=extensao)
+            os.close(fd)
+            arquivo.save(caminho_temporario)  # Copia o upload em blocos, sem carregá-lo inteiro na memória
+            lotes = ler_lotes_csv(caminho_temporario) if extensao == '.csv' else ler_lotes_xlsx(caminho_temporario)
+        else:
+            data = request.get_json(silent=True) or {}
+            file_data = data.get('file_data')
+            filename = data.get('filename')
 
-        if not file_data or not filename:
-            logger.warning("Dados do arquivo ou nome do arquivo ausentes")
-            return jsonify({'error': 'Dados do arquivo ou nome do arquivo ausentes'}), 400
+            if not file_data or not filename:
+                logger.warning("Dados do arquivo ou nome do arquivo ausentes")
+                return jsonify({'error': 'Dados do arquivo ou nome do arquivo ausentes'}), 400
 
-        file_content = base64.b64decode(file_data)
-        df = pd.read_excel(BytesIO(file_content))
+            df = pd.read_excel(BytesIO(base64.b64decode(file_data)))
+            df.columns = [str(col).strip() for col in df.columns]
+            lotes = [(list(df.columns), df, 2)]
 
-        required_columns = ['data', 'placa', 'motorista', 'tipo', 'valor', 'local', 'defeito']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        inserted, duplicadas, total_rejeitadas, erros, missing_columns = importar_lotes(lotes)
         if missing_columns:
             logger.warning(f"Colunas obrigatórias ausentes no Excel: {missing_columns}")
             return jsonify({'error': f'Colunas obrigatórias ausentes: {", ".join(missing_columns)}'}), 400
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        inserted = 0
+        if total_rejeitadas:
+            logger.warning(f"{total_rejeitadas} linhas rejeitadas na importação")
+        logger.info(mensagem_importacao(inserted, duplicadas))
+        return jsonify({
+            'message': mensagem_importacao(inserted, duplicadas),
+            'importadas': inserted,
+            'duplicadas': duplicadas,
+            'rejeitadas': total_rejeitadas,
+            'erros': erros
+        })
+    except Exception as e:
+        logger.error(f"Erro ao importar Excel: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao importar Excel: {str(e)}'}), 500
+    finally:
+        if caminho_temporario and os.path.exists(caminho_temporario):
+            os.remove(caminho_temporario)
+
+@registrar_tarefa('exportar')
+def tarefa_exportar(contexto, parametros):
+    """Gera o arquivo de exportação em segundo plano, registrando o progresso a cada lote."""
+    formato = parametros['formato']
+    query, params, nome_base, nome_planilha = consulta_exportacao(parametros['escopo'], parametros.get('filtros', {}))
+    caminho = contexto.caminho_arquivo(f'.{formato}')
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f'SELECT COUNT(*) FROM ({query})', params)
+        total = c.fetchone()[0]
+        if not total:
+            raise ValueError('Nenhum dado disponível para exportação')
+        contexto.atualizar(0, total, forcar=True)
 
-        for _, row in df.iterrows():
-            try:
-                # Converter a data do Excel para YYYY-MM-DD
-                data_formatada = format_date_from_excel(row['data'])
-                if not data_formatada:
-                    logger.warning(f"Data inválida na linha {row.name}: {row['data']}")
-                    continue
+        c.execute(query, params)
+        colunas = [d[0] for d in c.description]
+
+        def com_progresso(linhas):
+            for i, linha in enumerate(linhas, start=1):
+                if i % EXPORTACAO_LOTE == 0:
+                    contexto.atualizar(i, total)
+                yield linha
+
+        def lotes_com_progresso(lotes):
+            lidas = 0
+            for lote in lotes:
+                yield lote
+                lidas += len(lote)
+                contexto.atualizar(lidas, total)
+
+        with open(caminho, 'wb') as arquivo:
+            if formato in FORMATOS_COLUNARES:
+                lotes = lotes_exportacao(c, c.fetchmany(EXPORTACAO_LOTE))
+                gravar_colunar(arquivo, formato, colunas, lotes_com_progresso(lotes))
+            else:
+                linhas = linhas_exportacao(c, colunas, c.fetchmany(EXPORTACAO_LOTE))
+                gravar_exportacao(arquivo, formato, nome_planilha, colunas, com_progresso(linhas))
+    except Exception:
+        # Inclui TarefaCancelada: o arquivo parcial não deve ficar em disco
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        raise
+    finally:
+        c.close()
+        conn.close()
 
-                valor = float(row['valor'])
-                if valor < 0:
-                    logger.warning(f"Valor negativo na linha {row.name}: {row['valor']}")
-                    continue
+    return {
+        'arquivo': caminho,
+        'nome_arquivo': nome_arquivo_exportacao(nome_base, formato),
+        'mimetype': EXPORTACAO_MIMETYPES[formato],
+        'linhas_processadas': total
+    }
 
-                c.execute('''INSERT INTO manutencoes (data, placa, motorista, telefone, tipo, oc, valor, pix, favorecido, local, defeito)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (data_formatada, str(row['placa']).upper(), str(row['motorista']), str(row.get('telefone', '')),
-                           str(row['tipo']), str(row.get('oc', '')), valor, str(row.get('pix', '')),
-                           str(row.get('favorecido', '')), str(row['local']), str(row['defeito'])))
-                inserted += 1
-            except Exception as e:
-                logger.warning(f"Erro ao processar linha {row.name}: {str(e)}")
-                continue
+@registrar_tarefa('importar')
+def tarefa_importar(contexto, parametros):
+    """
+    Importa em segundo plano o arquivo enviado para /api/tarefas. Ao cancelar, os lotes
+    já gravados são mantidos; o arquivo enviado é sempre removido no final.
+    """
+    caminho = parametros['arquivo']
+    try:
+        if parametros['extensao'] == '.csv':
+            with open(caminho, 'rb') as f:
+                total = max(sum(1 for _ in f) - 1, 0)  # Estimativa: desconsidera quebras de linha dentro de campos
+            lotes = ler_lotes_csv(caminho)
+        else:
+            wb = load_workbook(caminho, read_only=True)
+            total = max((wb.active.max_row or 1) - 1, 0)
+            wb.close()
+            lotes = ler_lotes_xlsx(caminho)
+        contexto.atualizar(0, total or None, forcar=True)
+
+        inseridos, duplicadas, total_rejeitadas, erros, colunas_ausentes = importar_lotes(
+            lotes, ao_gravar_lote=lambda linhas: contexto.atualizar(linhas, total or None))
+        if colunas_ausentes:
+            raise ValueError(f'Colunas obrigatórias ausentes: {", ".join(colunas_ausentes)}')
+    finally:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    logger.info(f"{mensagem_importacao(inseridos, duplicadas)} (tarefa {contexto.tarefa_id})")
+    return {
+        'message': mensagem_importacao(inseridos, duplicadas),
+        'importadas': inseridos,
+        'duplicadas': duplicadas,
+        'rejeitadas': total_rejeitadas,
+        'erros': erros,
+        'linhas_processadas': inseridos + duplicadas + total_rejeitadas
+    }
 
-        conn.commit()
+@registrar_tarefa('geocodificar')
+def tarefa_geocodificar(contexto, parametros):
+    """
+    Preenche em segundo plano as coordenadas das manutenções sem latitude/longitude, uma
+    consulta por local distinto. Ao cancelar, os lotes já gravados são mantidos.
+    """
+    conn = get_db_connection()
+    try:
+        contexto.atualizar(0, None, forcar=True)
+        resumo = preencher_coordenadas_manutencoes(conn, ao_progredir=contexto.atualizar)
+    finally:
+        conn.close()
+
+    logger.info(f"{resumo['manutencoes']} manutenções georreferenciadas (tarefa {contexto.tarefa_id})")
+    return dict(resumo, linhas_processadas=resumo['locais'])
+
+@registrar_tarefa('instantaneo')
+def tarefa_instantaneo(contexto, parametros):
+    """Atualiza em segundo plano o instantâneo Parquet/Arrow das tabelas (só as partições alteradas)."""
+    conn = get_db_connection()
+    try:
+        contexto.atualizar(0, None, forcar=True)
+        resumo = gerar_instantaneo(conn, ao_progredir=contexto.atualizar)
+    finally:
         conn.close()
-        logger.info(f"{inserted} manutenções importadas com sucesso")
-        return jsonify({'message': f'{inserted} manutenções importadas com sucesso'})
+    return dict(resumo, linhas_processadas=resumo['linhas'])
+
+def tarefa_publica(tarefa):
+    """Remove da tarefa os caminhos internos de arquivos e inclui a URL de download, se houver."""
+    tarefa['parametros'].pop('arquivo', None)
+    resultado = tarefa['resultado'] or {}
+    if resultado.pop('arquivo', None) and tarefa['status'] == 'concluida':
+        tarefa['url_arquivo'] = f"/api/tarefas/{tarefa['id']}/arquivo"
+    return tarefa
+
+@app.route('/api/tarefas', methods=['POST'])
+def criar_tarefa():
+    """
+    Agenda uma exportação ou importação em segundo plano e responde 202 com o id da tarefa.
+    - exportar: JSON {"tipo": "exportar", "parametros": {"escopo": "geral" | "relatorio",
+      "formato": "xlsx" | "csv" | "ndjson" | "parquet" | "arrow", "data_inicio", "data_fim", "placa", "motorista"}}.
+      Uma exportação idêntica concluída há pouco tempo sobre os mesmos dados (ou em andamento)
+      é reaproveitada;
+    - importar: multipart/form-data com tipo=importar e o arquivo (.xlsx ou .csv) no campo 'file';
+    - geocodificar: JSON {"tipo": "geocodificar"}; preenche latitude/longitude das manutenções
+      sem coordenadas a partir do local (ver geocodificacao.py);
+    - instantaneo: JSON {"tipo": "instantaneo"}; atualiza os arquivos Parquet/Arrow de
+      INSTANTANEOS_DIR (ver colunar.py).
+    """
+    try:
+        if 'file' in request.files:
+            arquivo = request.files['file']
+            filename = arquivo.filename or ''
+            extensao = os.path.splitext(filename)[1].lower()
+            if extensao not in ('.xlsx', '.csv'):
+                logger.warning(f"Formato de arquivo não suportado na importação: {filename}")
+                return jsonify({'error': 'Formato não suportado. Envie um arquivo .xlsx ou .csv'}), 400
+            os.makedirs(TAREFAS_DIR, exist_ok=True)
+            fd, caminho = tempfile.mkstemp(dir=TAREFAS_DIR, prefix='upload_', suffix=extensao)
+            os.close(fd)
+            arquivo.save(caminho)
+            parametros = {'arquivo': caminho, 'extensao': extensao, 'nome_original': filename}
+            try:
+                tarefa_id, reutilizada = enviar_tarefa('importar', parametros, reutilizavel=False)
+            except Exception:
+                os.remove(caminho)
+                raise
+        else:
+            data = request.get_json(silent=True) or {}
+            tipo = data.get('tipo')
+            if tipo == 'geocodificar':
+                # Reaproveitada enquanto estiver em andamento ou os dados não tiverem mudado
+                tarefa_id, reutilizada = enviar_tarefa('geocodificar', {}, versao=versao_dados()[0])
+            elif tipo == 'instantaneo':
+                if not PYARROW_DISPONIVEL:
+                    return jsonify({'error': 'Os instantâneos requerem o pacote pyarrow no servidor'}), 400
+                tarefa_id, reutilizada = enviar_tarefa('instantaneo', {}, versao=versao_dados()[0])
+            elif tipo != 'exportar':
+                return jsonify({'error': "Tipo de tarefa inválido. Use 'exportar', 'geocodificar' ou 'instantaneo' (JSON) ou envie o arquivo para importar"}), 400
+            else:
+                entrada = data.get('parametros') or {}
+                escopo = entrada.get('escopo', 'geral')
+                formato = (entrada.get('formato') or 'xlsx').lower()
+                if escopo not in ('geral', 'relatorio'):
+                    return jsonify({'error': "Escopo inválido. Use 'geral' ou 'relatorio'"}), 400
+                erro_formato = erro_formato_exportacao(formato)
+                if erro_formato:
+                    return jsonify({'error': erro_formato}), 400
+
+                filtros = {}
+                if escopo == 'relatorio':
+                    data_inicio = normalizar_data(entrada.get('data_inicio'))
+                    data_fim = normalizar_data(entrada.get('data_fim'))
+                    if not data_inicio or not data_fim:
+                        return jsonify({'error': 'Data de início e data de fim são obrigatórias'}), 400
+                    # Filtros normalizados: pedidos equivalentes reaproveitam o mesmo resultado
+                    filtros = {
+                        'data_inicio': data_inicio,
+                        'data_fim': data_fim,
+                        'placa': (entrada.get('placa') or '').strip().upper(),
+                        'motorista': (entrada.get('motorista') or '').strip()
+                    }
+                parametros = {'escopo': escopo, 'formato': formato, 'filtros': filtros}
+                tarefa_id, reutilizada = enviar_tarefa('exportar', parametros, versao=versao_dados()[0])
+
+        tarefa = obter_tarefa(tarefa_id)
+        logger.info(f"Tarefa {tarefa['tipo']} {tarefa_id} {'reaproveitada' if reutilizada else 'agendada'}")
+        return jsonify({
+            'id': tarefa_id,
+            'status': tarefa['status'],
+            'reutilizada': reutilizada,
+            'url': f'/api/tarefas/{tarefa_id}'
+        }), 202
     except Exception as e:
-        logger.error(f"Erro ao importar Excel: {str(e)}", exc_info=True)
-        return jsonify({'error': f'Erro ao importar Excel: {str(e)}'}), 500
+        logger.error(f"Erro ao agendar tarefa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao agendar tarefa: {str(e)}'}), 500
+
+@app.route('/api/tarefas/<tarefa_id>', methods=['GET'])
+def consultar_tarefa(tarefa_id):
+    """Retorna o status, o progresso (linhas processadas / total) e o resultado da tarefa."""
+    try:
+        tarefa = obter_tarefa(tarefa_id)
+        if not tarefa:
+            return jsonify({'error': 'Tarefa não encontrada'}), 404
+        return jsonify(tarefa_publica(tarefa))
+    except Exception as e:
+        logger.error(f"Erro ao consultar tarefa {tarefa_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao consultar tarefa: {str(e)}'}), 500
+
+@app.route('/api/tarefas/<tarefa_id>/cancelar', methods=['POST'])
+def cancelar_tarefa_route(tarefa_id):
+    try:
+        if not obter_tarefa(tarefa_id):
+            return jsonify({'error': 'Tarefa não encontrada'}), 404
+        if not cancelar_tarefa(tarefa_id):
+            return jsonify({'error': 'A tarefa já foi finalizada'}), 409
+        logger.info(f"Cancelamento solicitado para a tarefa {tarefa_id}")
+        return jsonify({'message': 'Cancelamento solicitado', 'status': obter_tarefa(tarefa_id)['status']}), 202
+    except Exception as e:
+        logger.error(f"Erro ao cancelar tarefa {tarefa_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao cancelar tarefa: {str(e)}'}), 500
+
+@app.route('/api/tarefas/<tarefa_id>/arquivo', methods=['GET'])
+def baixar_arquivo_tarefa(tarefa_id):
+    """Envia o arquivo gerado por uma tarefa de exportação concluída."""
+    try:
+        tarefa = obter_tarefa(tarefa_id)
+        if not tarefa:
+            return jsonify({'error': 'Tarefa não encontrada'}), 404
+        resultado = tarefa['resultado'] or {}
+        if tarefa['status'] != 'concluida' or not resultado.get('arquivo'):
+            return jsonify({'error': 'A tarefa não possui arquivo disponível', 'status': tarefa['status']}), 409
+        caminho = os.path.abspath(resultado['arquivo'])
+        if not os.path.exists(caminho):
+            return jsonify({'error': 'O arquivo da tarefa expirou'}), 410
+        return send_file(caminho, mimetype=resultado.get('mimetype'), as_attachment=True,
+                         download_name=resultado.get('nome_arquivo'), conditional=True)
+    except Exception as e:
+        logger.error(f"Erro ao baixar arquivo da tarefa {tarefa_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao baixar arquivo da tarefa: {str(e)}'}), 500
+
+@app.route('/api/instantaneos', methods=['GET'])
+def get_instantaneos():
+    """Manifesto do último instantâneo Parquet/Arrow: formato, data de geração e, por tabela, as partições
+    com versão, arquivo (relativo a INSTANTANEOS_DIR) e quantidade de linhas."""
+    try:
+        manifesto = ler_manifesto()
+        if manifesto is None:
+            return jsonify({'error': 'Nenhum instantâneo gerado', 'pyarrow': PYARROW_DISPONIVEL}), 404
+        return jsonify(dict(manifesto, pyarrow=PYARROW_DISPONIVEL))
+    except Exception as e:
+        logger.error(f"Erro ao consultar os instantâneos: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao consultar os instantâneos: {str(e)}'}), 500
 
 @app.route('/api/locais', methods=['GET'])
+@resposta_em_cache
 def get_locais_mapa():
     """
     Endpoint otimizado para o mapa. Retorna locais únicos com coordenadas,
@@ -620,33 +1897,49 @@ def get_locais_mapa():
 
 # --- NOVOS ENDPOINTS PARA GERENCIAR LOCAIS DO MAPA (BASES/PRESTADORES) ---
 
+# Colunas gravadas no cadastro/edição, na ordem dos valores de validar_mapa_local()
+COLUNAS_MAPA_LOCAL = ('nome', 'tipo', 'latitude', 'longitude', 'endereco', 'cidade', 'estado',
+                      'telefone', 'observacoes', 'avaliacao')
+
+def validar_mapa_local(data):
+    """Valida os dados de um local do mapa e retorna os valores de COLUNAS_MAPA_LOCAL. Lança ValueError."""
+    required_fields = ['nome', 'tipo', 'latitude', 'longitude', 'cidade', 'estado']
+    if not all(field in data and data[field] for field in required_fields):
+        raise ValueError('Campos obrigatórios (nome, tipo, latitude, longitude, cidade, estado) ausentes')
+    try:
+        latitude, longitude = float(data['latitude']), float(data['longitude'])
+    except (TypeError, ValueError):
+        raise ValueError('Latitude e longitude devem ser números válidos.')
+    return (data['nome'], data['tipo'], latitude, longitude,
+            data.get('endereco', ''), data.get('cidade', ''), data.get('estado', ''),
+            data.get('telefone', ''), data.get('observacoes', ''),
+            data.get('avaliacao'))
+
+def gravar_servicos_mapa_lote(c, operacao, itens):
+    """Serviços dos locais criados/atualizados em lote. Na atualização, só substitui se 'servicos' vier nos dados."""
+    gravar_servicos_lote(c, {id: dados.get('servicos') or [] for id, dados in itens
+                             if operacao == 'criar' or 'servicos' in dados})
+
+LOTE_MAPA_LOCAIS = TabelaLote('mapa_locais', COLUNAS_MAPA_LOCAL, validar_mapa_local, gravar_servicos_mapa_lote)
+
 @app.route('/api/mapa/locais', methods=['POST'])
 def add_mapa_local():
     """Adiciona um novo local (base ou prestador) no banco de dados."""
     data = request.json
-    logger.debug(f"Recebido para adicionar local no mapa: {data}")
+    logger.debug("Recebido para adicionar local no mapa: %s", data)
+    try:
+        valores = validar_mapa_local(data)
+    except ValueError as e:
+        logger.warning("Local do mapa inválido: %s", e)
+        return jsonify({'error': str(e)}), 400
     try:
-        required_fields = ['nome', 'tipo', 'latitude', 'longitude', 'cidade', 'estado']
-        if not all(field in data and data[field] for field in required_fields):
-            logger.warning(f"Campos obrigatórios ausentes no cadastro do mapa: {data}")
-            return jsonify({'error': 'Campos obrigatórios (nome, tipo, latitude, longitude, cidade, estado) ausentes'}), 400
-
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;')
         c = conn.cursor()
-        c.execute('''INSERT INTO mapa_locais (
-                        nome, tipo, latitude, longitude, endereco, cidade, estado, 
-                        telefone, observacoes, servicos, avaliacao
-                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (data['nome'], data['tipo'], data['latitude'], data['longitude'],
-                   data.get('endereco', ''), data.get('cidade', ''), data.get('estado', ''),
-                   data.get('telefone', ''), data.get('observacoes', ''),
-                   # Converte a lista de serviços em uma string
-                   ','.join(data.get('servicos', [])),
-                   data.get('avaliacao')
-                  ))
-        conn.commit()
+        c.execute(LOTE_MAPA_LOCAIS.sql('criar'), valores)
         new_id = c.lastrowid
+        # Serviços gravados nas tabelas normalizadas, na mesma transação
+        data['servicos'] = gravar_servicos(c, new_id, data.get('servicos', []))
+        conn.commit()
         data['id'] = new_id
         conn.close()
         logger.info(f"Novo local de mapa adicionado: {data['nome']} (ID: {new_id})")
@@ -656,13 +1949,22 @@ def add_mapa_local():
         return jsonify({'error': f'Erro ao adicionar local: {str(e)}'}), 500
 
 @app.route('/api/mapa/locais', methods=['GET'])
+@resposta_em_cache
 def get_all_mapa_locais():
-    """Retorna todas as bases e prestadores salvos no banco de dados."""
+    """
+    Retorna as bases e prestadores salvos no banco de dados, com `servicos` como lista.
+    Filtros opcionais: `tipo`, `categoria`, `estado`, `cidade` e `servicos` (ver filtros_mapa).
+    """
+    try:
+        filtros = filtros_mapa()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute('SELECT * FROM mapa_locais')
-        locais = [dict(row) for row in c.fetchall()]
+        condicoes, params = condicoes_filtros(filtros)
+        c.execute(f"SELECT m.* FROM mapa_locais m {'WHERE ' + ' AND '.join(condicoes) if condicoes else ''}", params)
+        locais = anexar_servicos(c, [dict(row) for row in c.fetchall()])
         conn.close()
         logger.info(f"Retornando {len(locais)} locais personalizados do mapa.")
         return jsonify(locais)
@@ -670,31 +1972,296 @@ def get_all_mapa_locais():
         logger.error(f"Erro ao buscar locais do mapa: {str(e)}", exc_info=True)
         return jsonify({'error': f'Erro ao buscar locais: {str(e)}'}), 500
 
+@app.route('/api/mapa/locais/duplicatas', methods=['GET'])
+@resposta_em_cache
+def get_mapa_locais_duplicatas():
+    """
+    Grupos de locais do mapa duplicados (mesmo nome na mesma cidade) ou quase duplicados (nome
+    semelhante, próximos ou com o mesmo telefone), comparados só dentro do mesmo bloco
+    (unidade/prestador, estado e cidade). Parâmetros: `similaridade`, `raio_m`, `limit` e os
+    filtros de filtros_mapa().
+    """
+    try:
+        similaridade, limite = parametros_duplicatas()
+        raio_m = _float_param('raio_m', 1, 100000, obrigatorio=False)
+        filtros = filtros_mapa()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        condicoes, params = condicoes_filtros(filtros)
+        resultado = grupos_locais(c, condicoes, params, similaridade,
+                                  DUPLICATAS_RAIO_M if raio_m is None else raio_m, limite)
+        conn.close()
+        logger.info(f"Busca de duplicatas de locais do mapa: {resultado['total']} grupos")
+        return jsonify(resultado)
+    except Exception as e:
+        logger.error(f"Erro ao buscar duplicatas de locais do mapa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao buscar duplicatas: {str(e)}'}), 500
+
+@app.route('/api/mapa/servicos', methods=['GET'])
+@resposta_em_cache
+def get_mapa_servicos():
+    """Serviços oferecidos pelos locais do mapa, com a quantidade de locais de cada um."""
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        servicos = listar_servicos(c)
+        conn.close()
+        return jsonify(servicos)
+    except Exception as e:
+        logger.error(f"Erro ao listar serviços do mapa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao listar serviços: {str(e)}'}), 500
+
+# Quantidade padrão e máxima de locais retornados pelas consultas geográficas
+GEO_LIMITE_PADRAO = 50
+GEO_LIMITE_MAXIMO = 1000
+
+def _float_param(nome, minimo, maximo, obrigatorio=True):
+    valor = request.args.get(nome, '').strip()
+    if not valor:
+        if obrigatorio:
+            raise ValueError(f'Parâmetro {nome} é obrigatório.')
+        return None
+    try:
+        numero = float(valor)
+    except ValueError:
+        raise ValueError(f'Parâmetro {nome} deve ser um número.')
+    if not minimo <= numero <= maximo:  # Também rejeita NaN
+        raise ValueError(f'Parâmetro {nome} deve estar entre {minimo} e {maximo}.')
+    return numero
+
+def filtros_mapa():
+    """
+    Filtros dos locais do mapa: `tipo` e `servicos` (listas separadas por vírgula), `categoria`,
+    `estado`, `cidade` e `servicos_modo` ('todos', padrão, ou 'algum' dos serviços).
+    """
+    categoria = request.args.get('categoria', '').strip() or None
+    if categoria and categoria not in CATEGORIAS:
+        raise ValueError(f'Categoria inválida. Use: {", ".join(CATEGORIAS)}')
+    servicos_modo = request.args.get('servicos_modo', 'todos').strip()
+    if servicos_modo not in MODOS_FILTRO:
+        raise ValueError(f'Parâmetro servicos_modo inválido. Use: {", ".join(MODOS_FILTRO)}')
+    return {
+        'tipos': [t.strip() for t in request.args.get('tipo', '').split(',') if t.strip()],
+        'servicos': [s.strip() for s in request.args.get('servicos', '').split(',') if s.strip()],
+        'servicos_modo': servicos_modo,
+        'categoria': categoria,
+        'estado': request.args.get('estado', '').strip(),
+        'cidade': request.args.get('cidade', '').strip(),
+    }
+
+def filtros_geo():
+    """Filtros comuns das consultas geográficas: os de filtros_mapa() e `limit`."""
+    filtros = filtros_mapa()
+    limite = request.args.get('limit', str(GEO_LIMITE_PADRAO)).strip()
+    if not limite.isdigit() or int(limite) < 1:
+        raise ValueError('Parâmetro limit deve ser um inteiro positivo.')
+    return filtros, min(int(limite), GEO_LIMITE_MAXIMO)
+
+@app.route('/api/mapa/locais/proximos', methods=['GET'])
+@resposta_em_cache
+def get_mapa_locais_proximos():
+    """
+    Locais próximos de um ponto (lat, lng), do mais próximo para o mais distante, com o campo
+    `distancia_km`. Com `raio_km`, retorna os locais dentro do raio (até `limit`); sem ele,
+    os `limit` locais mais próximos. Filtros: `tipo`, `servicos` (todos exigidos, ou algum
+    com servicos_modo=algum), `categoria` ('unidade' ou 'prestador'), `estado` e `cidade`.
+    """
+    try:
+        lat = _float_param('lat', -90, 90)
+        lng = _float_param('lng', -180, 180)
+        raio_km = _float_param('raio_km', 0, 20040, obrigatorio=False)
+        filtros, limite = filtros_geo()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        if raio_km is not None:
+            locais = locais_no_raio(c, lat, lng, raio_km, filtros, limite)
+        else:
+            locais = locais_mais_proximos(c, lat, lng, limite, filtros)
+        conn.close()
+        logger.info(f"Consulta por proximidade retornou {len(locais)} locais")
+        return jsonify(locais)
+    except Exception as e:
+        logger.error(f"Erro na consulta de locais próximos: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao buscar locais próximos: {str(e)}'}), 500
+
+@app.route('/api/mapa/locais/bbox', methods=['GET'])
+@resposta_em_cache
+def get_mapa_locais_bbox():
+    """
+    Locais dentro do retângulo (min_lat, min_lng, max_lat, max_lng), ordenados pela distância
+    ao centro do retângulo, ou ao ponto (lat, lng) se informado. Aceita os mesmos filtros de
+    /api/mapa/locais/proximos.
+    """
+    try:
+        min_lat = _float_param('min_lat', -90, 90)
+        max_lat = _float_param('max_lat', -90, 90)
+        min_lng = _float_param('min_lng', -180, 180)
+        max_lng = _float_param('max_lng', -180, 180)
+        if min_lat > max_lat or min_lng > max_lng:
+            raise ValueError('Retângulo inválido: min_lat/min_lng devem ser menores que max_lat/max_lng.')
+        lat = _float_param('lat', -90, 90, obrigatorio=False)
+        lng = _float_param('lng', -180, 180, obrigatorio=False)
+        filtros, limite = filtros_geo()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        centro = (lat, lng) if lat is not None and lng is not None else None
+        locais = locais_no_retangulo(c, min_lat, min_lng, max_lat, max_lng, filtros, limite, centro)
+        conn.close()
+        logger.info(f"Consulta por retângulo retornou {len(locais)} locais")
+        return jsonify(locais)
+    except Exception as e:
+        logger.error(f"Erro na consulta de locais por retângulo: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao buscar locais: {str(e)}'}), 500
+
+@app.route('/api/mapa/agrupamentos', methods=['GET'])
+@resposta_em_cache
+def get_mapa_agrupamentos():
+    """
+    Pontos do retângulo visível (min_lat, min_lng, max_lat, max_lng) já agrupados para o
+    `zoom` informado. `fonte`: 'mapa' (bases e prestadores, padrão) ou 'manutencoes'
+    (locais das manutenções). Ver agrupamentos.py.
+    """
+    try:
+        fonte = request.args.get('fonte', 'mapa')
+        if fonte not in FONTES:
+            raise ValueError(f'Fonte inválida. Use: {", ".join(FONTES)}')
+        zoom = request.args.get('zoom', '').strip()
+        if not zoom.isdigit() or int(zoom) > ZOOM_MAXIMO:
+            raise ValueError(f'Parâmetro zoom deve ser um inteiro entre 0 e {ZOOM_MAXIMO}.')
+        min_lat = _float_param('min_lat', -90, 90)
+        max_lat = _float_param('max_lat', -90, 90)
+        min_lng = _float_param('min_lng', -180, 180)
+        max_lng = _float_param('max_lng', -180, 180)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        itens = agrupamentos_viewport(c, fonte, int(zoom), min_lat, min_lng, max_lat, max_lng)
+        conn.close()
+        logger.info(f"Agrupamentos do mapa retornados: {len(itens)} itens (fonte={fonte}, zoom={zoom})")
+        return jsonify(itens)
+    except Exception as e:
+        logger.error(f"Erro ao agrupar locais do mapa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao agrupar locais do mapa: {str(e)}'}), 500
+
+# Limite de endereços por requisição em POST /api/geocodificacao/lote
+GEOCODIFICACAO_LOTE_MAXIMO = 1000
+
+@app.route('/api/geocodificacao', methods=['GET'])
+def get_geocodificacao():
+    """Coordenadas de um endereço (`endereco`), via cache e backends de geocodificacao.py."""
+    endereco = (request.args.get('endereco') or '').strip()
+    if not endereco:
+        return jsonify({'error': 'Parâmetro endereco é obrigatório.'}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        resultado = geocodificar(c, endereco)
+        conn.commit()
+        conn.close()
+        if resultado is None:
+            return jsonify({'error': 'Endereço não encontrado'}), 404
+        return jsonify(resultado)
+    except Exception as e:
+        logger.error(f"Erro ao geocodificar endereço: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao geocodificar endereço: {str(e)}'}), 500
+
+@app.route('/api/geocodificacao/reversa', methods=['GET'])
+def get_geocodificacao_reversa():
+    """Endereço mais próximo das coordenadas `lat` e `lng`."""
+    try:
+        lat = _float_param('lat', -90, 90)
+        lng = _float_param('lng', -180, 180)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        resultado = geocodificar_reverso(c, lat, lng)
+        conn.commit()
+        conn.close()
+        if resultado is None:
+            return jsonify({'error': 'Endereço não encontrado'}), 404
+        return jsonify(resultado)
+    except Exception as e:
+        logger.error(f"Erro na geocodificação reversa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro na geocodificação reversa: {str(e)}'}), 500
+
+@app.route('/api/geocodificacao/lote', methods=['POST'])
+def geocodificar_enderecos():
+    """
+    Geocodifica vários endereços de uma vez: JSON {"enderecos": [...]}. Responde um objeto
+    endereço -> resultado (ou null, se não encontrado); endereços repetidos ou equivalentes
+    são consultados uma única vez.
+    """
+    data = request.get_json(silent=True) or {}
+    enderecos = data.get('enderecos')
+    if not isinstance(enderecos, list) or not all(isinstance(e, str) for e in enderecos):
+        return jsonify({'error': 'Envie {"enderecos": [...]} com uma lista de textos.'}), 400
+    if len(enderecos) > GEOCODIFICACAO_LOTE_MAXIMO:
+        return jsonify({'error': f'Máximo de {GEOCODIFICACAO_LOTE_MAXIMO} endereços por requisição. '
+                                 "Para preencher as manutenções, use a tarefa 'geocodificar'."}), 400
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        resultados = geocodificar_lote(c, enderecos)
+        conn.commit()
+        conn.close()
+        encontrados = sum(1 for r in resultados.values() if r)
+        logger.info(f"Geocodificação em lote: {encontrados} de {len(resultados)} endereços encontrados")
+        return jsonify(resultados)
+    except Exception as e:
+        logger.error(f"Erro na geocodificação em lote: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro na geocodificação em lote: {str(e)}'}), 500
+
+@app.route('/api/mapa/locais/lote', methods=['POST'])
+def lote_mapa_locais():
+    """
+    Cria, atualiza e exclui vários locais do mapa em uma transação, no mesmo formato de
+    /api/manutencoes/lote. Na atualização, os serviços só são substituídos se `servicos`
+    vier nos dados.
+    """
+    try:
+        operacoes, modo = ler_lote()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        resultado = executar_lote(conn, LOTE_MAPA_LOCAIS, operacoes, modo)
+        conn.close()
+        return resposta_lote(resultado)
+    except Exception as e:
+        logger.error(f"Erro ao executar lote de locais do mapa: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Erro ao executar lote de locais do mapa: {str(e)}'}), 500
+
 @app.route('/api/mapa/locais/<int:id>', methods=['PUT'])
 def update_mapa_local(id):
     """Atualiza um local existente no mapa."""
     data = request.json
-    logger.debug(f"Recebido para ATUALIZAR local no mapa (ID: {id}): {data}")
+    logger.debug("Recebido para ATUALIZAR local no mapa (ID: %s): %s", id, data)
+    try:
+        valores = validar_mapa_local(data)
+    except ValueError as e:
+        logger.warning("Alteração inválida do local do mapa %s: %s", id, e)
+        return jsonify({'error': str(e)}), 400
     try:
-        required_fields = ['nome', 'tipo', 'latitude', 'longitude', 'cidade', 'estado']
-        if not all(field in data and data[field] for field in required_fields):
-            logger.warning(f"Campos obrigatórios ausentes na atualização do mapa: {data}")
-            return jsonify({'error': 'Campos obrigatórios (nome, tipo, latitude, longitude, cidade, estado) ausentes'}), 400
-
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;')
         c = conn.cursor()
-        c.execute('''UPDATE mapa_locais SET
-                        nome = ?, tipo = ?, latitude = ?, longitude = ?, endereco = ?, cidade = ?, 
-                        estado = ?, telefone = ?, observacoes = ?, servicos = ?, avaliacao = ?
-                     WHERE id = ?''',
-                  (data['nome'], data['tipo'], data['latitude'], data['longitude'],
-                   data.get('endereco', ''), data.get('cidade', ''), data.get('estado', ''),
-                   data.get('telefone', ''), data.get('observacoes', ''),
-                   ','.join(data.get('servicos', [])),
-                   data.get('avaliacao'),
-                   id
-                  ))
+        c.execute(LOTE_MAPA_LOCAIS.sql('atualizar'), (*valores, id))
+        if c.rowcount == 0:
+            conn.close()
+            return jsonify({'error': 'Local não encontrado'}), 404
+        gravar_servicos(c, id, data.get('servicos', []))
         conn.commit()
         conn.close()
         logger.info(f"Local de mapa com ID {id} atualizado.")
@@ -708,7 +2275,6 @@ def delete_mapa_local(id):
     """Exclui um local personalizado do mapa."""
     try:
         conn = get_db_connection()
-        conn.execute('PRAGMA foreign_keys = ON;')
         c = conn.cursor()
         c.execute('DELETE FROM mapa_locais WHERE id = ?', (id,))
         if c.rowcount == 0:
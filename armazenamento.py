@@ -0,0 +1,198 @@
+"""
+Armazenamento dos arquivos anexados, endereçado por conteúdo.
+
+Os bytes de cada anexo ficam em disco, em ANEXOS_DIR/<hh>/<sha256>, onde <sha256> é o
+hash do conteúdo. Arquivos idênticos são gravados uma única vez: a tabela 'arquivos'
+guarda quantos anexos apontam para cada hash e é mantida por triggers na tabela
+'anexos', dentro da mesma transação de cada INSERT/UPDATE/DELETE (inclusive ON DELETE
+CASCADE). Arquivos sem referências são apagados por remover_arquivos_orfaos().
+
+Os arquivos são gravados antes do commit. Os que foram criados dentro de um bloco
+ArquivosNovos são apagados se a transação (ou o savepoint) for desfeita, pois nenhuma
+linha de 'arquivos' chega a apontar para eles.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+ANEXOS_DIR = os.environ.get('ANEXOS_DIR', 'anexos_arquivos')
+
+
+def criar_esquema_arquivos(c):
+    """Cria (se necessário) as colunas, a tabela de referências e os triggers do armazenamento."""
+    c.execute("PRAGMA table_info(anexos)")
+    columns = [column[1] for column in c.fetchall()]
+    if 'hash' not in columns:
+        logger.info("Adicionando coluna 'hash' à tabela 'anexos'...")
+        c.execute('ALTER TABLE anexos ADD COLUMN hash TEXT')
+    if 'tamanho' not in columns:
+        logger.info("Adicionando coluna 'tamanho' à tabela 'anexos'...")
+        c.execute('ALTER TABLE anexos ADD COLUMN tamanho INTEGER')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS arquivos
+                 (hash TEXT PRIMARY KEY,
+                  tamanho INTEGER NOT NULL,
+                  referencias INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_anexos_manutencao_id ON anexos (manutencao_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_arquivos_orfaos ON arquivos (referencias) WHERE referencias <= 0')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS anexos_arquivos_ai AFTER INSERT ON anexos
+                 WHEN NEW.hash IS NOT NULL
+                 BEGIN
+                     INSERT INTO arquivos (hash, tamanho, referencias) VALUES (NEW.hash, NEW.tamanho, 1)
+                     ON CONFLICT(hash) DO UPDATE SET referencias = referencias + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS anexos_arquivos_ad AFTER DELETE ON anexos
+                 WHEN OLD.hash IS NOT NULL
+                 BEGIN
+                     UPDATE arquivos SET referencias = referencias - 1 WHERE hash = OLD.hash;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS anexos_arquivos_au AFTER UPDATE OF hash ON anexos
+                 WHEN OLD.hash IS NOT NEW.hash
+                 BEGIN
+                     UPDATE arquivos SET referencias = referencias - 1 WHERE hash = OLD.hash;
+                     INSERT INTO arquivos (hash, tamanho, referencias) VALUES (NEW.hash, NEW.tamanho, 1)
+                     ON CONFLICT(hash) DO UPDATE SET referencias = referencias + 1;
+                 END''')
+
+
+# Blocos ArquivosNovos abertos na thread, do mais externo ao mais interno
+_abertos = threading.local()
+
+
+def _blocos_abertos():
+    if not hasattr(_abertos, 'pilha'):
+        _abertos.pilha = []
+    return _abertos.pilha
+
+
+class ArquivosNovos:
+    """
+    Registra os arquivos criados no armazenamento durante o bloco (with), para apagá-los se
+    a transação for desfeita. Se o bloco terminar com exceção, os arquivos são apagados na
+    saída; em um rollback sem exceção, chame descartar(). Nos dois casos isso deve acontecer
+    antes do ROLLBACK, ainda com o lock de escrita: nenhuma outra transação pode ter passado
+    a usar o arquivo. Um bloco aninhado que termina sem erro repassa seus arquivos ao bloco
+    externo (como um savepoint liberado).
+    """
+
+    def __init__(self):
+        self.caminhos = []
+
+    def __enter__(self):
+        _blocos_abertos().append(self)
+        return self
+
+    def __exit__(self, tipo, valor, rastro):
+        pilha = _blocos_abertos()
+        pilha.pop()
+        if tipo is not None:
+            self.descartar()
+        elif pilha:
+            pilha[-1].caminhos.extend(self.caminhos)
+        return False
+
+    def descartar(self):
+        """Apaga os arquivos criados no bloco até aqui."""
+        for caminho in self.caminhos:
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+        if self.caminhos:
+            logger.info(f"{len(self.caminhos)} arquivo(s) de transação desfeita removido(s) do armazenamento")
+        self.caminhos = []
+
+
+def caminho_arquivo(hash_arquivo):
+    """Caminho em disco do arquivo com o hash informado."""
+    return os.path.join(ANEXOS_DIR, hash_arquivo[:2], hash_arquivo)
+
+
+def decodificar_data_url(dados):
+    """
+    Converte uma data URL ("data:<mime>;base64,<dados>") ou Base64 puro em bytes. Lança
+    ValueError se o Base64 for inválido ou o conteúdo estiver vazio.
+    """
+    dados = dados or ''
+    if dados.startswith('data:') and ',' in dados:
+        dados = dados.split(',', 1)[1]
+    try:
+        conteudo = base64.b64decode(dados, validate=True)
+    except binascii.Error:
+        raise ValueError('Conteúdo do anexo não é um Base64 válido.')
+    if not conteudo:
+        raise ValueError('Conteúdo do anexo vazio.')
+    return conteudo
+
+
+def gravar_arquivo(conteudo):
+    """
+    Grava o conteúdo no armazenamento (se ainda não existir) e retorna (hash, tamanho).
+    A escrita é atômica: o arquivo é gerado em um temporário e renomeado no final.
+    """
+    hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+    caminho = caminho_arquivo(hash_arquivo)
+    if not os.path.exists(caminho):
+        diretorio = os.path.dirname(caminho)
+        os.makedirs(diretorio, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(conteudo)
+            os.replace(temporario, caminho)
+        except Exception:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        pilha = _blocos_abertos()
+        if pilha:
+            pilha[-1].caminhos.append(caminho)
+    return hash_arquivo, len(conteudo)
+
+
+def inserir_anexo(c, manutencao_id, nome_arquivo, tipo_arquivo, dados):
+    """
+    Insere um anexo recebido em Base64, gravando os bytes no armazenamento.
+    Deve ser chamado dentro da transação do registro: o INSERT obtém o lock de escrita
+    antes da gravação em disco, o que impede que remover_arquivos_orfaos() apague o
+    arquivo entre a gravação e o commit. Para não deixar arquivos sem referência se a
+    transação for desfeita, chame-o dentro de um bloco ArquivosNovos.
+    """
+    conteudo = decodificar_data_url(dados)
+    hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+    c.execute('''INSERT INTO anexos (manutencao_id, nome_arquivo, tipo_arquivo, dados_arquivo, hash, tamanho)
+                 VALUES (?, ?, ?, '', ?, ?)''',
+              (manutencao_id, nome_arquivo, tipo_arquivo, hash_arquivo, len(conteudo)))
+    gravar_arquivo(conteudo)
+    return c.lastrowid
+
+
+def remover_arquivos_orfaos(conn):
+    """Apaga do disco e da tabela 'arquivos' os conteúdos que não têm mais anexos apontando para eles."""
+    removidos = 0
+    try:
+        conn.execute('BEGIN IMMEDIATE')  # Bloqueia novas gravações enquanto os arquivos são apagados
+        c = conn.cursor()
+        c.execute('SELECT hash FROM arquivos WHERE referencias <= 0')
+        orfaos = [row[0] for row in c.fetchall()]
+        for hash_arquivo in orfaos:
+            try:
+                os.remove(caminho_arquivo(hash_arquivo))
+            except FileNotFoundError:
+                pass
+        c.executemany('DELETE FROM arquivos WHERE hash = ? AND referencias <= 0', [(h,) for h in orfaos])
+        conn.commit()
+        removidos = len(orfaos)
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao remover arquivos órfãos: {str(e)}", exc_info=True)
+    if removidos:
+        logger.info(f"{removidos} arquivo(s) sem referência removido(s) do armazenamento")
+    return removidos
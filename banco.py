@@ -0,0 +1,190 @@
+"""
+Pool de conexões SQLite por processo (worker do gunicorn).
+
+As conexões são abertas uma única vez, configuradas com os PRAGMAs abaixo e
+reaproveitadas entre requisições. Chamar conn.close() devolve a conexão ao pool
+(desfazendo qualquer transação pendente) em vez de fechá-la de fato.
+
+Configuração por variáveis de ambiente:
+    DB_PATH                 caminho do banco (padrão: manutencoes.db)
+    SQLITE_POOL_SIZE        conexões mantidas abertas por processo (padrão: 5)
+    SQLITE_JOURNAL_MODE     modo de journal (padrão: WAL)
+    SQLITE_SYNCHRONOUS      nível de sincronização (padrão: NORMAL)
+    SQLITE_CACHE_SIZE_KB    cache de páginas por conexão, em KiB (padrão: 20000)
+    SQLITE_MMAP_SIZE        bytes mapeados em memória para leitura (padrão: 268435456)
+    SQLITE_BUSY_TIMEOUT_MS  espera máxima por um lock antes de falhar (padrão: 5000)
+
+definir_observador(funcao) instala uma função chamada após cada execute/executemany
+e cada fetch* dos cursores do pool com (sql, duração em segundos, linhas lidas,
+nova_consulta); é assim que metricas.py mede as consultas sem depender do Flask aqui.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('DB_PATH', 'manutencoes.db')
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 5))
+JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000))
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+_MODOS_JOURNAL = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_NIVEIS_SYNCHRONOUS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+_observador = None
+
+
+def definir_observador(funcao):
+    """Instala (ou remove, com None) o observador das consultas feitas pelas conexões do pool."""
+    global _observador
+    _observador = funcao
+
+
+class CursorPool(sqlite3.Cursor):
+    """Cursor que informa ao observador a duração de cada consulta e as linhas lidas nos fetch*."""
+
+    _sql = ''
+
+    def execute(self, sql, parametros=()):
+        observador = _observador
+        if observador is None:
+            return super().execute(sql, parametros)
+        self._sql = sql
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            observador(sql, time.perf_counter() - inicio, 0, True)
+
+    def executemany(self, sql, parametros):
+        observador = _observador
+        if observador is None:
+            return super().executemany(sql, parametros)
+        self._sql = sql
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            observador(sql, time.perf_counter() - inicio, 0, True)
+
+    def _ler(self, leitura, *args):
+        observador = _observador
+        if observador is None:
+            return leitura(*args)
+        inicio = time.perf_counter()
+        linhas = leitura(*args)
+        lidas = len(linhas) if isinstance(linhas, list) else int(linhas is not None)
+        observador(self._sql, time.perf_counter() - inicio, lidas, False)
+        return linhas
+
+    def fetchone(self):
+        return self._ler(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._ler(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._ler(super().fetchall)
+
+
+class ConexaoPool(sqlite3.Connection):
+    """Conexão que volta para o pool ao ser fechada."""
+
+    _pool = None
+    _emprestada = False
+
+    def cursor(self, factory=CursorPool):
+        return super().cursor(factory)
+
+    # Connection.execute/executemany nativos criam um sqlite3.Cursor comum, que não seria medido
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def close(self):
+        if self._pool is not None and self._emprestada:
+            self._emprestada = False
+            self._pool.devolver(self)
+
+    def fechar(self):
+        """Fecha a conexão de fato."""
+        super().close()
+
+
+class PoolConexoes:
+    """Pool de conexões SQLite. Se todas estiverem em uso, abre conexões extras, que são fechadas ao serem devolvidas."""
+
+    def __init__(self, caminho=DB_PATH, tamanho=POOL_SIZE):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self._livres = queue.LifoQueue(maxsize=tamanho)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(self.caminho, timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=ConexaoPool)
+        if JOURNAL_MODE in _MODOS_JOURNAL:
+            conn.execute(f'PRAGMA journal_mode = {JOURNAL_MODE}')
+        if SYNCHRONOUS in _NIVEIS_SYNCHRONOUS:
+            conn.execute(f'PRAGMA synchronous = {SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {-CACHE_SIZE_KB}')  # Valor negativo = tamanho em KiB
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn._pool = self
+        return conn
+
+    def _verificar_processo(self):
+        # Conexões SQLite não podem ser compartilhadas entre processos: após um fork
+        # (ex.: gunicorn com --preload) o worker descarta as herdadas e abre as suas.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._livres = queue.LifoQueue(maxsize=self.tamanho)
+                    self._pid = os.getpid()
+
+    def obter(self):
+        self._verificar_processo()
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            conn = self._nova_conexao()
+        conn.row_factory = sqlite3.Row
+        conn._emprestada = True
+        return conn
+
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.fechar()
+            return
+        if conn._pool is not self or self._pid != os.getpid():
+            conn.fechar()
+            return
+        try:
+            self._livres.put_nowait(conn)
+        except queue.Full:
+            conn.fechar()
+
+    def fechar_todas(self):
+        while True:
+            try:
+                self._livres.get_nowait().fechar()
+            except queue.Empty:
+                break
+
+
+pool = PoolConexoes()
@@ -0,0 +1,121 @@
+"""
+Compara a serialização das respostas JSON: jsonify padrão do Flask x respostas.py.
+
+Gera uma tabela sintética de manutenções (padrão: 100 mil linhas, no formato de
+GET /api/manutencoes) e mede, para cada caminho, o tempo de serialização, o tamanho do corpo
+e o tamanho/tempo de cada compressão disponível.
+
+Uso:
+    python benchmark_json.py
+    python benchmark_json.py --linhas 20000 --repeticoes 5
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import respostas
+from respostas import ProvedorJSON, json_em_fluxo, comprimir, CODIFICACOES
+
+TIPOS = ('Pneu', 'Elétrica', 'Mecânica', 'Lona', 'Funilaria', 'Suspensão')
+LOCAIS = ('São Paulo - SP', 'Ribeirão Preto - SP', 'Belo Horizonte - MG', 'Curitiba - PR', 'Goiânia - GO')
+DEFEITOS = ('Troca de pneu dianteiro', 'Revisão elétrica completa', 'Vazamento de óleo no motor',
+            'Lona rasgada na lateral', 'Amortecedor traseiro com folga', 'Farol queimado')
+
+
+def tabela_sintetica(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    inicio = date(2022, 1, 1)
+    manutencoes = []
+    for i in range(1, linhas + 1):
+        dia = inicio + timedelta(days=aleatorio.randint(0, 1400))
+        manutencoes.append({
+            'id': i,
+            'data': dia.isoformat(),
+            'placa': f'{"".join(aleatorio.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=3))}{aleatorio.randint(0, 9)}'
+                     f'{aleatorio.choice("ABCDEFGHIJ0123456789")}{aleatorio.randint(10, 99)}',
+            'motorista': f'Motorista {aleatorio.randint(1, 400)}',
+            'telefone': f'(11) 9{aleatorio.randint(1000, 9999)}-{aleatorio.randint(1000, 9999)}',
+            'tipo': aleatorio.choice(TIPOS),
+            'oc': str(aleatorio.randint(10000, 99999)),
+            'valor': round(aleatorio.uniform(50, 5000), 2),
+            'pix': '',
+            'favorecido': f'Oficina {aleatorio.randint(1, 150)}',
+            'local': aleatorio.choice(LOCAIS),
+            'defeito': aleatorio.choice(DEFEITOS),
+            'latitude': round(aleatorio.uniform(-25, -15), 6),
+            'longitude': round(aleatorio.uniform(-52, -43), 6),
+            'data_iso': dia.isoformat(),
+            'anexos': [],
+        })
+    return manutencoes
+
+
+def medir(funcao, repeticoes):
+    """Menor tempo (segundos) entre as repetições e o último resultado."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=100_000)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+
+    manutencoes = tabela_sintetica(args.linhas)
+    lotes = [manutencoes[i:i + 1000] for i in range(0, len(manutencoes), 1000)]
+
+    app_padrao = Flask('padrao')
+    app_padrao.json = DefaultJSONProvider(app_padrao)
+    app_novo = Flask('novo')
+    app_novo.json = ProvedorJSON(app_novo)
+
+    def jsonify_padrao():
+        with app_padrao.app_context():
+            return app_padrao.json.response(manutencoes).get_data()
+
+    def jsonify_novo():
+        with app_novo.app_context():
+            return app_novo.json.response(manutencoes).get_data()
+
+    def em_fluxo():
+        # Tempo total para produzir todos os blocos; o maior bloco indica a memória de pico
+        blocos = list(json_em_fluxo(lotes))
+        return blocos
+
+    caminhos = [
+        ('jsonify (Flask padrão)', jsonify_padrao),
+        (f"jsonify ({'orjson' if respostas.orjson is not None else 'json'})", jsonify_novo),
+        ('array em fluxo (lotes de 1000)', em_fluxo),
+    ]
+
+    print(f"{args.linhas} linhas, melhor de {args.repeticoes} execuções\n")
+    print(f"{'caminho':<34}{'tempo (ms)':>12}{'tamanho (KiB)':>16}{'maior bloco (KiB)':>20}")
+    corpo_novo = None
+    for nome, funcao in caminhos:
+        duracao, resultado = medir(funcao, args.repeticoes)
+        blocos = resultado if isinstance(resultado, list) else [resultado]
+        corpo = b''.join(blocos)
+        corpo_novo = corpo  # A compressão é medida sobre o corpo do último caminho (o novo)
+        print(f"{nome:<34}{duracao * 1000:>12.1f}{len(corpo) / 1024:>16.1f}{max(map(len, blocos)) / 1024:>20.1f}")
+
+    print(f"\n{'compressão':<34}{'tempo (ms)':>12}{'tamanho (KiB)':>16}{'razão':>20}")
+    for codificacao in CODIFICACOES:
+        duracao, comprimido = medir(lambda: comprimir(corpo_novo, codificacao), args.repeticoes)
+        razao = len(corpo_novo) / len(comprimido)
+        print(f"{codificacao:<34}{duracao * 1000:>12.1f}{len(comprimido) / 1024:>16.1f}{razao:>19.1f}x")
+    if 'br' not in CODIFICACOES:
+        print("(brotli não instalado: pip install brotli)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Índices de busca sobre a tabela 'manutencoes' usados por GET /api/manutencoes.
+
+- Texto livre (`q=`): índice FTS5 sobre defeito, local, motorista, placa e favorecido, com
+  tokenizador unicode61 sem acentos ("freio" encontra "FREIO" e "manutenção" encontra
+  "manutencao"). Os resultados são ordenados por relevância (bm25).
+- Telefone e placa parciais (`telefone=`, `placa=`): índice FTS5 de trigramas sobre o
+  telefone e a placa sem separadores (espaços, hífens, pontos, barras etc.; a placa em
+  maiúsculas). Trechos de 3 ou mais caracteres,
+  em qualquer posição (inclusive o final do número), são resolvidos pelo índice em vez de
+  um `LIKE '%x%'` que percorre a tabela inteira.
+
+Os dois índices são mantidos por triggers na tabela 'manutencoes', dentro da mesma transação
+de cada INSERT, UPDATE e DELETE. Na importação em lote, a indexação linha a linha dos INSERTs é
+adiada (indexacao_adiada) e as linhas novas de cada lote são indexadas de uma só vez ao final.
+
+Verificação de consistência (reconstrói os índices se houver divergências):
+    python busca.py
+    python busca.py --reconstruir   # reconstrói sempre
+"""
+import logging
+import re
+from contextlib import contextmanager
+import sqlite3
+import string
+import sys
+
+logger = logging.getLogger(__name__)
+
+TABELA_TEXTO = 'manutencoes_fts'
+TABELA_TRIGRAMAS = 'manutencoes_trigramas'
+# Linha única com o indicador 'adiada': quando 1, o trigger de INSERT não indexa a linha
+TABELA_ESTADO = 'busca_estado'
+
+# Colunas indexadas para texto livre e o peso de cada uma na relevância (bm25)
+COLUNAS_TEXTO = ('defeito', 'local', 'motorista', 'placa', 'favorecido')
+PESOS_TEXTO = (1.0, 1.0, 2.0, 3.0, 1.0)
+
+# Separadores removidos do telefone e da placa, tanto pelos triggers (SQL) quanto na busca
+# (Python): as duas normalizações precisam produzir exatamente o mesmo texto. Inclui '_' e '%',
+# de modo que o trecho normalizado não tem curingas do LIKE.
+_SEPARADORES = ' -./()+_%,:;#*'
+_SEM_SEPARADORES = str.maketrans('', '', _SEPARADORES)
+# UPPER do SQLite só converte letras ASCII
+_PLACA = str.maketrans(string.ascii_lowercase, string.ascii_uppercase, _SEPARADORES)
+
+_TERMO_RE = re.compile(r'\w+')
+
+
+def normalizar_telefone(valor):
+    """Telefone sem os separadores (_SEPARADORES)."""
+    return (valor or '').translate(_SEM_SEPARADORES)
+
+
+def normalizar_placa(valor):
+    """Placa em maiúsculas, sem os separadores (_SEPARADORES)."""
+    return (valor or '').translate(_PLACA)
+
+
+def _sql_sem_separadores(expressao):
+    for separador in _SEPARADORES:
+        expressao = f"REPLACE({expressao}, '{separador}', '')"
+    return expressao
+
+
+def _valores_trigramas(prefixo):
+    """Expressões SQL equivalentes a normalizar_telefone e normalizar_placa."""
+    return f"{_sql_sem_separadores(prefixo + 'telefone')}, UPPER({_sql_sem_separadores(prefixo + 'placa')})"
+
+
+def criar_esquema_busca(c):
+    """Cria (se necessário) os índices de busca e os triggers. Popula os índices recém-criados."""
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+              (TABELA_TEXTO, TABELA_TRIGRAMAS))
+    existentes = c.fetchone()[0]
+
+    colunas = ', '.join(COLUNAS_TEXTO)
+    novos = ', '.join(f'NEW.{col}' for col in COLUNAS_TEXTO)
+    antigos = ', '.join(f'OLD.{col}' for col in COLUNAS_TEXTO)
+
+    # Tabela de conteúdo externo: o texto fica apenas em 'manutencoes'
+    c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_TEXTO} USING fts5
+                  ({colunas}, content='manutencoes', content_rowid='id',
+                   tokenize="unicode61 remove_diacritics 2")''')
+    c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_TRIGRAMAS} USING fts5
+                  (telefone, placa, tokenize='trigram')''')
+
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {TABELA_ESTADO}
+                  (id INTEGER PRIMARY KEY CHECK (id = 1), adiada INTEGER NOT NULL)''')
+    c.execute(f'INSERT OR IGNORE INTO {TABELA_ESTADO} (id, adiada) VALUES (1, 0)')
+
+    # Triggers criados com outra normalização são recriados, e o índice de trigramas reconstruído;
+    # o trigger de INSERT anterior à indexação adiada é apenas recriado
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'manutencoes_busca_ai'")
+    trigger = c.fetchone()
+    if trigger is not None and _valores_trigramas('NEW.') not in trigger[0]:
+        c.execute('DROP TRIGGER manutencoes_busca_ai')
+        c.execute('DROP TRIGGER IF EXISTS manutencoes_busca_trigramas_au')
+        existentes = 0
+    elif trigger is not None and TABELA_ESTADO not in trigger[0]:
+        c.execute('DROP TRIGGER manutencoes_busca_ai')
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_busca_ai AFTER INSERT ON manutencoes
+                  WHEN (SELECT adiada FROM {TABELA_ESTADO}) = 0
+                  BEGIN
+                      INSERT INTO {TABELA_TEXTO} (rowid, {colunas}) VALUES (NEW.id, {novos});
+                      INSERT INTO {TABELA_TRIGRAMAS} (rowid, telefone, placa) VALUES (NEW.id, {_valores_trigramas('NEW.')});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_busca_ad AFTER DELETE ON manutencoes
+                  BEGIN
+                      INSERT INTO {TABELA_TEXTO} ({TABELA_TEXTO}, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+                      DELETE FROM {TABELA_TRIGRAMAS} WHERE rowid = OLD.id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_busca_texto_au AFTER UPDATE OF {colunas} ON manutencoes
+                  BEGIN
+                      INSERT INTO {TABELA_TEXTO} ({TABELA_TEXTO}, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+                      INSERT INTO {TABELA_TEXTO} (rowid, {colunas}) VALUES (NEW.id, {novos});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_busca_trigramas_au AFTER UPDATE OF telefone, placa ON manutencoes
+                  WHEN OLD.telefone IS NOT NEW.telefone OR OLD.placa IS NOT NEW.placa
+                  BEGIN
+                      DELETE FROM {TABELA_TRIGRAMAS} WHERE rowid = OLD.id;
+                      INSERT INTO {TABELA_TRIGRAMAS} (rowid, telefone, placa) VALUES (NEW.id, {_valores_trigramas('NEW.')});
+                  END''')
+
+    if existentes < 2:
+        reconstruir_busca(c)
+
+
+def reconstruir_busca(c):
+    """Recria o conteúdo dos índices de busca a partir da tabela 'manutencoes'."""
+    logger.info("Reconstruindo índices de busca das manutenções...")
+    c.execute(f"INSERT INTO {TABELA_TEXTO} ({TABELA_TEXTO}) VALUES ('rebuild')")
+    c.execute(f'DELETE FROM {TABELA_TRIGRAMAS}')
+    c.execute(f'''INSERT INTO {TABELA_TRIGRAMAS} (rowid, telefone, placa)
+                  SELECT id, {_valores_trigramas('')} FROM manutencoes''')
+
+
+def _indexar_a_partir_de(c, ultimo_id):
+    """Indexa as manutenções com id maior que `ultimo_id`, em um único INSERT ... SELECT por índice."""
+    c.execute(f'''INSERT INTO {TABELA_TEXTO} (rowid, {', '.join(COLUNAS_TEXTO)})
+                  SELECT id, {', '.join(COLUNAS_TEXTO)} FROM manutencoes WHERE id > ?''', (ultimo_id,))
+    c.execute(f'''INSERT INTO {TABELA_TRIGRAMAS} (rowid, telefone, placa)
+                  SELECT id, {_valores_trigramas('')} FROM manutencoes WHERE id > ?''', (ultimo_id,))
+
+
+@contextmanager
+def indexacao_adiada(c):
+    """
+    Adia a indexação das manutenções inseridas no bloco e as indexa de uma só vez ao final,
+    em vez de linha a linha pelo trigger (a importação fica bem mais rápida). Deve ser usado
+    dentro de uma transação de escrita já aberta: o indicador só existe nela, de modo que
+    outras conexões continuam indexando normalmente e um rollback o desfaz. Só os INSERTs são
+    adiados; UPDATEs e DELETEs no bloco continuam indexados pelos triggers.
+    """
+    c.execute('SELECT COALESCE(MAX(id), 0) FROM manutencoes')
+    ultimo_id = c.fetchone()[0]  # 'id' é AUTOINCREMENT: as linhas novas terão id maior
+    c.execute(f'UPDATE {TABELA_ESTADO} SET adiada = 1')
+    try:
+        yield
+        _indexar_a_partir_de(c, ultimo_id)
+    finally:
+        c.execute(f'UPDATE {TABELA_ESTADO} SET adiada = 0')
+
+
+def verificar_busca(c):
+    """Compara os índices com a tabela 'manutencoes'. Retorna {índice: consistente}."""
+    try:
+        c.execute(f"INSERT INTO {TABELA_TEXTO} ({TABELA_TEXTO}, rank) VALUES ('integrity-check', 1)")
+        texto_ok = True
+    except sqlite3.DatabaseError:
+        texto_ok = False
+    c.execute(f'''SELECT COUNT(*) FROM (
+                      SELECT id, {_valores_trigramas('')} FROM manutencoes
+                      EXCEPT SELECT rowid, telefone, placa FROM {TABELA_TRIGRAMAS}
+                      UNION ALL
+                      SELECT rowid, telefone, placa FROM {TABELA_TRIGRAMAS}
+                      EXCEPT SELECT id, {_valores_trigramas('')} FROM manutencoes)''')
+    return {TABELA_TEXTO: texto_ok, TABELA_TRIGRAMAS: c.fetchone()[0] == 0}
+
+
+def consulta_texto(q):
+    """
+    Converte o texto digitado em uma expressão FTS5: cada palavra vira um prefixo e todas
+    precisam aparecer ("freio dian" encontra "Freio dianteiro"). Lança ValueError se não
+    houver palavras.
+    """
+    termos = _TERMO_RE.findall(q or '')
+    if not termos:
+        raise ValueError('Parâmetro q deve conter ao menos uma palavra.')
+    return ' '.join(f'"{termo}"*' for termo in termos)
+
+
+def subconsulta_texto():
+    """SQL (id, relevancia) das manutenções que atendem à expressão de consulta_texto; menor relevância primeiro."""
+    pesos = ', '.join(str(peso) for peso in PESOS_TEXTO)
+    return (f'SELECT rowid AS id_busca, bm25({TABELA_TEXTO}, {pesos}) AS relevancia '
+            f'FROM {TABELA_TEXTO} WHERE {TABELA_TEXTO} MATCH ?')
+
+
+def condicao_parcial(coluna, valor):
+    """
+    Condição SQL (e parâmetros) para `telefone` ou `placa` contendo o trecho informado,
+    resolvida pelo índice de trigramas. Se nada restar após a normalização (ex.: telefone sem
+    dígitos), compara o texto original diretamente na tabela.
+    """
+    normalizado = normalizar_telefone(valor) if coluna == 'telefone' else normalizar_placa(valor)
+    if not normalizado:
+        return f'{coluna} LIKE ?', [f'%{valor}%']
+    # Após a normalização restam apenas letras e dígitos: nada a escapar no LIKE
+    return f'id IN (SELECT rowid FROM {TABELA_TRIGRAMAS} WHERE {coluna} LIKE ?)', [f'%{normalizado}%']
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        criar_esquema_busca(c)
+        if '--reconstruir' in sys.argv:
+            reconstruir_busca(c)
+        else:
+            resultado = verificar_busca(c)
+            for indice, consistente in resultado.items():
+                logger.info(f"{indice}: {'consistente' if consistente else 'divergente'}")
+            if not all(resultado.values()):
+                logger.warning("Índices de busca inconsistentes; reconstruindo...")
+                reconstruir_busca(c)
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,161 @@
+"""
+Cache HTTP das rotas de leitura (listagens, locais do mapa e rankings).
+
+Uma versão dos dados, guardada na tabela 'versao_dados', é incrementada por triggers a cada
+INSERT, UPDATE e DELETE em 'manutencoes', 'anexos', 'mapa_locais' e 'mapa_locais_servicos', na
+mesma transação da gravação; isso cobre o cadastro, a edição, a exclusão, a importação e o
+CRUD dos locais do mapa, em qualquer worker do gunicorn.
+
+Rotas decoradas com @resposta_em_cache:
+- respondem com ETag (a versão) e Last-Modified (momento da última gravação) e devolvem 304
+  quando o cliente já tem a versão atual (If-None-Match / If-Modified-Since), sem consultar
+  o banco além da leitura da versão;
+- guardam o corpo serializado em um LRU por processo, com chave na rota e nos parâmetros da
+  query string, junto com as versões comprimidas já calculadas (ver respostas.py). O LRU é
+  esvaziado quando a versão muda. Respostas em fluxo recebem os cabeçalhos, mas não ficam
+  em cache.
+
+Configuração por variáveis de ambiente:
+    CACHE_RESPOSTAS_ITENS   respostas mantidas por processo (padrão: 256; 0 desativa o LRU)
+    CACHE_RESPOSTAS_MB      tamanho máximo somado dos corpos em cache, em MiB (padrão: 64)
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response, current_app
+
+from banco import pool
+from respostas import comprimir_resposta
+
+logger = logging.getLogger(__name__)
+
+CACHE_RESPOSTAS_ITENS = int(os.environ.get('CACHE_RESPOSTAS_ITENS', 256))
+CACHE_RESPOSTAS_BYTES = int(os.environ.get('CACHE_RESPOSTAS_MB', 64)) * 1024 * 1024
+
+# Tabelas cujas gravações alteram as respostas das rotas em cache
+TABELAS_VERSIONADAS = ('manutencoes', 'anexos', 'mapa_locais', 'mapa_locais_servicos')
+
+
+def criar_esquema_versao(c):
+    """Cria (se necessário) a tabela 'versao_dados' e os triggers que a incrementam."""
+    c.execute('''CREATE TABLE IF NOT EXISTS versao_dados
+                 (id INTEGER PRIMARY KEY CHECK (id = 1),
+                  versao INTEGER NOT NULL,
+                  alterado_em INTEGER NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO versao_dados (id, versao, alterado_em) VALUES (1, 1, CAST(strftime('%s', 'now') AS INTEGER))")
+    for tabela in TABELAS_VERSIONADAS:
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {tabela}_versao_{evento.lower()} AFTER {evento} ON {tabela}
+                          BEGIN
+                              UPDATE versao_dados SET versao = versao + 1,
+                                     alterado_em = CAST(strftime('%s', 'now') AS INTEGER)
+                              WHERE id = 1;
+                          END''')
+
+
+def versao_dados():
+    """Retorna (versao, alterado_em) dos dados; alterado_em em segundos desde a época (UTC)."""
+    conn = pool.obter()
+    try:
+        row = conn.execute('SELECT versao, alterado_em FROM versao_dados WHERE id = 1').fetchone()
+    finally:
+        conn.close()
+    return row[0], row[1]
+
+
+class CacheRespostas:
+    """LRU de corpos de resposta já serializados, válido para uma única versão dos dados."""
+
+    def __init__(self, max_itens=CACHE_RESPOSTAS_ITENS, max_bytes=CACHE_RESPOSTAS_BYTES):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._versao = None
+        self._lock = threading.Lock()
+
+    def _sincronizar(self, versao):
+        # Qualquer gravação (em qualquer processo) muda a versão e invalida tudo
+        if versao != self._versao:
+            self._itens.clear()
+            self._bytes = 0
+            self._versao = versao
+
+    def obter(self, chave, versao):
+        """Retorna (corpo, mimetype, variantes comprimidas) da chave na versão informada, ou None."""
+        with self._lock:
+            self._sincronizar(versao)
+            item = self._itens.get(chave)
+            if item is not None:
+                self._itens.move_to_end(chave)
+            return item
+
+    def guardar(self, chave, versao, corpo, mimetype):
+        """Guarda o corpo e retorna o dicionário (inicialmente vazio) de variantes comprimidas."""
+        variantes = {}
+        with self._lock:
+            self._sincronizar(versao)
+            if self.max_itens <= 0 or len(corpo) > self.max_bytes:
+                return variantes
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[0])
+            # Apenas o corpo original entra na conta: as variantes comprimidas são bem menores
+            self._itens[chave] = (corpo, mimetype, variantes)
+            self._bytes += len(corpo)
+            while len(self._itens) > self.max_itens or self._bytes > self.max_bytes:
+                _, (removido, _, _) = self._itens.popitem(last=False)
+                self._bytes -= len(removido)
+        return variantes
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+            self._versao = None
+
+
+cache = CacheRespostas()
+
+
+def _validadores(resposta, versao, alterado_em):
+    resposta.set_etag(str(versao))
+    resposta.last_modified = alterado_em
+    # O navegador pode guardar a resposta, mas deve revalidá-la (If-None-Match) a cada uso
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+def resposta_em_cache(view):
+    """
+    Decorador para rotas GET cujo resultado depende apenas da query string e das tabelas em
+    TABELAS_VERSIONADAS. Apenas respostas 200 são guardadas.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        versao, alterado_em = versao_dados()
+
+        # Cliente já tem a versão atual: 304 sem executar a rota
+        nao_modificada = _validadores(make_response('', 200), versao, alterado_em)
+        nao_modificada.make_conditional(request)
+        if nao_modificada.status_code == 304:
+            return nao_modificada
+
+        chave = (request.path, tuple(sorted(request.args.items(multi=True))))
+        item = cache.obter(chave, versao)
+        if item is not None:
+            corpo, mimetype, variantes = item
+            resposta = current_app.response_class(corpo, mimetype=mimetype)
+        else:
+            resposta = make_response(view(*args, **kwargs))
+            if resposta.status_code != 200:
+                return resposta
+            if resposta.is_streamed:
+                return _validadores(resposta, versao, alterado_em)
+            variantes = cache.guardar(chave, versao, resposta.get_data(), resposta.mimetype)
+        return comprimir_resposta(_validadores(resposta, versao, alterado_em), variantes)
+
+    return wrapper
@@ -0,0 +1,414 @@
+"""
+Exportação colunar (Parquet e Arrow IPC) e instantâneos das tabelas para análises locais.
+
+Tipos: as colunas são gravadas com tipos próprios, e não como texto:
+- data: date32 (datas vazias ou inválidas ficam nulas);
+- valor, latitude, longitude e avaliacao: float64;
+- tipo, local, cidade e estado: dictionary<int32, string> (categorias);
+- servicos (locais do mapa): list<string>;
+- id: int64; as demais colunas: string.
+
+Instantâneos (gerar_instantaneo): cópia de 'manutencoes', particionada por mês da data
+(manutencoes/mes=AAAA-MM/), e de 'mapa_locais' em INSTANTANEOS_DIR. Triggers incrementam em
+'colunar_versoes', na mesma transação de cada gravação, a versão da partição alterada; o
+manifesto (manifesto.json) guarda a versão de cada partição gravada, e uma nova geração só
+regrava as partições cuja versão mudou e remove as que ficaram vazias. Os arquivos são
+gravados em arquivos temporários e renomeados; o manifesto é gravado por último.
+
+Leitura (carregar_instantaneo): no formato 'arrow' (IPC sem compressão, o padrão), os
+arquivos são abertos com memory map e as colunas apontam direto para as páginas do arquivo,
+sem cópia. No formato 'parquet', os arquivos são menores, mas a leitura precisa decodificar
+as páginas.
+
+Requer o pacote pyarrow (opcional: sem ele, os formatos colunares ficam indisponíveis).
+
+Configuração por variáveis de ambiente:
+    INSTANTANEOS_DIR       diretório dos instantâneos (padrão: instantaneos)
+    INSTANTANEOS_FORMATO   arrow ou parquet (padrão: arrow)
+
+Geração manual (ou periódica, via cron): python colunar.py --instantaneo
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from servicos import anexar_servicos
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - dependência opcional
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+INSTANTANEOS_DIR = os.environ.get('INSTANTANEOS_DIR', 'instantaneos')
+INSTANTANEOS_FORMATO = os.environ.get('INSTANTANEOS_FORMATO', 'arrow').lower()
+
+FORMATOS_COLUNARES = ('parquet', 'arrow')
+MIMETYPES_COLUNARES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+PYARROW_DISPONIVEL = pa is not None
+
+# Tipo de cada coluna pelo nome; as que não aparecem aqui são gravadas como texto
+COLUNAS_INTEIRAS = ('id',)
+COLUNAS_DATA = ('data',)
+COLUNAS_REAIS = ('valor', 'latitude', 'longitude', 'avaliacao')
+COLUNAS_CATEGORIAS = ('tipo', 'local', 'cidade', 'estado')
+COLUNAS_LISTAS = ('servicos',)
+
+# Colunas e consultas dos instantâneos. Partição de 'manutencoes': mês (AAAA-MM) da data;
+# 'mapa_locais' tem uma única partição ('')
+COLUNAS_INSTANTANEO = {
+    'manutencoes': ('id', 'data', 'placa', 'motorista', 'telefone', 'tipo', 'oc', 'valor', 'pix',
+                    'favorecido', 'local', 'defeito', 'latitude', 'longitude'),
+    'mapa_locais': ('id', 'nome', 'tipo', 'latitude', 'longitude', 'endereco', 'cidade', 'estado',
+                    'telefone', 'observacoes', 'servicos', 'avaliacao'),
+}
+TABELAS_INSTANTANEO = tuple(COLUNAS_INSTANTANEO)
+# Nome usado pelo Hive/Spark para a partição de valor nulo
+PARTICAO_SEM_DATA = '__HIVE_DEFAULT_PARTITION__'
+MANIFESTO = 'manifesto.json'
+# Linhas lidas do banco e convertidas por vez
+_LOTE = 5000
+
+
+def criar_esquema_colunar(c):
+    """Cria (se necessário) as tabelas de versões das partições e os triggers que as mantêm."""
+    c.execute('''CREATE TABLE IF NOT EXISTS colunar_versoes
+                 (tabela TEXT NOT NULL,
+                  particao TEXT NOT NULL, -- Mês (AAAA-MM) das manutenções; '' para mapa_locais
+                  versao INTEGER NOT NULL,
+                  PRIMARY KEY (tabela, particao)) WITHOUT ROWID''')
+    # Identifica o banco: um manifesto de outro banco (ou de um banco recriado) é descartado
+    c.execute('''CREATE TABLE IF NOT EXISTS colunar_estado
+                 (id INTEGER PRIMARY KEY CHECK (id = 1),
+                  geracao TEXT NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO colunar_estado (id, geracao) VALUES (1, lower(hex(randomblob(8))))")
+
+    def incrementar(tabela, particao):
+        return f'''INSERT INTO colunar_versoes (tabela, particao, versao) VALUES ('{tabela}', {particao}, 1)
+                   ON CONFLICT (tabela, particao) DO UPDATE SET versao = versao + 1;'''
+
+    mes_novo, mes_antigo = 'substr(NEW.data_iso, 1, 7)', 'substr(OLD.data_iso, 1, 7)'
+    for evento, comandos in (('INSERT', incrementar('manutencoes', mes_novo)),
+                             ('DELETE', incrementar('manutencoes', mes_antigo)),
+                             ('UPDATE', incrementar('manutencoes', mes_novo) + incrementar('manutencoes', mes_antigo))):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS colunar_manutencoes_{evento.lower()} AFTER {evento} ON manutencoes
+                      BEGIN
+                          {comandos}
+                      END''')
+    for tabela in ('mapa_locais', 'mapa_locais_servicos'):
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS colunar_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+                          BEGIN
+                              {incrementar('mapa_locais', "''")}
+                          END''')
+    # Partições com dados gravados antes dos triggers
+    c.execute('''INSERT OR IGNORE INTO colunar_versoes (tabela, particao, versao)
+                 SELECT DISTINCT 'manutencoes', substr(data_iso, 1, 7), 1 FROM manutencoes''')
+    c.execute("INSERT OR IGNORE INTO colunar_versoes (tabela, particao, versao) VALUES ('mapa_locais', '', 1)")
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _categorias(textos, dicionario):
+    """
+    Codifica os textos com o dicionário acumulado da coluna (valor -> índice), acrescentando os
+    valores novos ao final: cada lote traz o dicionário anterior como prefixo, o que permite
+    gravá-lo no arquivo IPC como um delta do dicionário do lote anterior.
+    """
+    indices = [None if texto is None else dicionario.setdefault(texto, len(dicionario)) for texto in textos]
+    return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                          pa.array(list(dicionario), type=pa.string()))
+
+
+def _coluna_arrow(coluna, valores, dicionarios=None):
+    """
+    Converte os valores (lidos do SQLite) de uma coluna para o tipo Arrow correspondente.
+    Com `dicionarios` (coluna -> dicionário acumulado), as categorias usam o dicionário
+    compartilhado entre os lotes em vez de um dicionário próprio.
+    """
+    if coluna in COLUNAS_INTEIRAS:
+        return pa.array(valores, type=pa.int64())
+    if coluna in COLUNAS_REAIS:
+        # Textos não numéricos (dados legados) ficam nulos
+        return pa.array(pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce'),
+                        type=pa.float64(), from_pandas=True)
+    if coluna in COLUNAS_LISTAS:
+        return pa.array(valores, type=pa.list_(pa.string()))
+    if coluna in COLUNAS_CATEGORIAS and dicionarios is not None:
+        return _categorias([_texto(valor) for valor in valores], dicionarios.setdefault(coluna, {}))
+    texto = pa.array([_texto(valor) for valor in valores], type=pa.string())
+    if coluna in COLUNAS_DATA:
+        # 'AAAA-MM-DD' (data_iso); vazio ou inválido vira nulo
+        return pc.cast(pc.strptime(texto, format='%Y-%m-%d', unit='s', error_is_null=True), pa.date32())
+    if coluna in COLUNAS_CATEGORIAS:
+        return texto.dictionary_encode()
+    return texto
+
+
+def tabela_arrow(colunas, linhas, dicionarios=None):
+    """Tabela Arrow tipada a partir de uma lista de linhas (tuplas ou sqlite3.Row) com as colunas informadas."""
+    return pa.table({coluna: _coluna_arrow(coluna, [linha[i] for linha in linhas], dicionarios)
+                     for i, coluna in enumerate(colunas)})
+
+
+def gravar_colunar(arquivo, formato, colunas, lotes):
+    """
+    Grava os lotes de linhas em `arquivo` (caminho ou arquivo binário) no formato 'parquet' ou
+    'arrow'. Retorna o total de linhas gravadas.
+    Cada lote é gravado assim que convertido, sem manter os anteriores em memória:
+    - parquet: cada lote vira um row group;
+    - arrow: cada lote vira um record batch. O formato de arquivo IPC não permite trocar o
+      dicionário de uma coluna entre lotes, apenas estendê-lo: as categorias usam um dicionário
+      acumulado, e cada lote grava só os valores novos (delta). Só os valores distintos das
+      categorias ficam em memória.
+    """
+    total = 0
+    if formato == 'parquet':
+        writer = None
+        try:
+            for linhas in lotes:
+                tabela = tabela_arrow(colunas, linhas)
+                if writer is None:
+                    writer = pq.ParquetWriter(arquivo, tabela.schema)
+                writer.write_table(tabela)
+                total += len(linhas)
+            if writer is None:
+                writer = pq.ParquetWriter(arquivo, tabela_arrow(colunas, []).schema)
+        finally:
+            if writer is not None:
+                writer.close()
+        return total
+
+    dicionarios = {}
+    opcoes = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    writer = None
+    try:
+        for linhas in lotes:
+            tabela = tabela_arrow(colunas, linhas, dicionarios)
+            if writer is None:
+                writer = pa.ipc.new_file(arquivo, tabela.schema, options=opcoes)
+            writer.write_table(tabela)
+            total += len(linhas)
+        if writer is None:
+            writer = pa.ipc.new_file(arquivo, tabela_arrow(colunas, [], dicionarios).schema, options=opcoes)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
+def _lotes(c):
+    while True:
+        linhas = c.fetchmany(_LOTE)
+        if not linhas:
+            return
+        yield linhas
+
+
+def _lotes_particao(conn, c, tabela, particao):
+    """Lotes de linhas de uma partição, na ordem das colunas de COLUNAS_INSTANTANEO."""
+    if tabela == 'mapa_locais':
+        colunas = [col for col in COLUNAS_INSTANTANEO['mapa_locais'] if col != 'servicos']
+        c.execute(f"SELECT {', '.join(colunas)} FROM mapa_locais ORDER BY id")
+        for linhas in _lotes(c):
+            locais = anexar_servicos(conn.cursor(), [dict(zip(colunas, linha)) for linha in linhas])
+            yield [tuple(local[col] for col in COLUNAS_INSTANTANEO['mapa_locais']) for local in locais]
+        return
+
+    colunas = ', '.join('data_iso AS data' if col == 'data' else col for col in COLUNAS_INSTANTANEO['manutencoes'])
+    if particao:
+        # O intervalo usa o índice de data_iso; substr descarta datas fora do formato (ex.: '2024-1')
+        c.execute(f'''SELECT {colunas} FROM manutencoes
+                      WHERE data_iso >= ? AND data_iso < ? AND substr(data_iso, 1, 7) = ?
+                      ORDER BY data_iso, id''', (particao, particao + '~', particao))
+    else:
+        c.execute(f"SELECT {colunas} FROM manutencoes WHERE data_iso = '' ORDER BY id")
+    yield from _lotes(c)
+
+
+def _caminho_particao(tabela, particao, formato):
+    """Caminho do arquivo da partição, relativo ao diretório dos instantâneos."""
+    if tabela == 'mapa_locais':
+        return os.path.join(tabela, f'dados.{formato}')
+    return os.path.join(tabela, f'mes={particao or PARTICAO_SEM_DATA}', f'dados.{formato}')
+
+
+def ler_manifesto(diretorio=INSTANTANEOS_DIR):
+    """Manifesto do último instantâneo gerado em `diretorio` (None se não houver)."""
+    try:
+        with open(os.path.join(diretorio, MANIFESTO), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return None
+
+
+def _gravar_atomico(caminho, gravar):
+    """Grava em um arquivo temporário ao lado de `caminho` e o renomeia ao final."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f'{caminho}.tmp'
+    try:
+        resultado = gravar(temporario)
+        os.replace(temporario, caminho)
+        return resultado
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _gravar_manifesto(diretorio, manifesto):
+    def gravar(destino):
+        with open(destino, 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo, ensure_ascii=False, indent=2, sort_keys=True)
+
+    _gravar_atomico(os.path.join(diretorio, MANIFESTO), gravar)
+
+
+def _remover_particao(diretorio, arquivo):
+    caminho = os.path.join(diretorio, arquivo)
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    pasta = os.path.dirname(caminho)
+    # A pasta mes=AAAA-MM sai junto; a pasta da tabela fica
+    if os.path.basename(pasta).startswith('mes=') and not os.listdir(pasta):
+        os.rmdir(pasta)
+
+
+def gerar_instantaneo(conn, diretorio=INSTANTANEOS_DIR, formato=INSTANTANEOS_FORMATO, ao_progredir=None):
+    """
+    Atualiza o instantâneo em `diretorio`, regravando só as partições alteradas desde o último.
+    `ao_progredir(partições processadas, total)` é chamado após cada partição regravada.
+    Retorna {'formato', 'gravadas', 'removidas', 'inalteradas', 'linhas'}.
+    """
+    if pa is None:
+        raise RuntimeError('Os instantâneos requerem o pacote pyarrow (pip install pyarrow)')
+    if formato not in FORMATOS_COLUNARES:
+        raise ValueError(f'Formato inválido. Use: {", ".join(FORMATOS_COLUNARES)}')
+
+    os.makedirs(diretorio, exist_ok=True)
+    # Uma geração por vez: entre as threads do processo e entre processos (workers, cron)
+    with open(os.path.join(diretorio, '.trava'), 'w') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        c = conn.cursor()
+        # Versões e dados lidos na mesma transação: cada arquivo corresponde à versão anotada
+        conn.execute('BEGIN')
+        try:
+            c.execute('SELECT geracao FROM colunar_estado WHERE id = 1')
+            geracao = c.fetchone()[0]
+            c.execute('SELECT tabela, particao, versao FROM colunar_versoes')
+            versoes = {(tabela, particao): versao for tabela, particao, versao in c.fetchall()}
+
+            anterior = ler_manifesto(diretorio)
+            if anterior and (anterior.get('geracao') != geracao or anterior.get('formato') != formato):
+                logger.info("Instantâneo anterior é de outro banco ou formato; regravando todas as partições")
+                for tabela in anterior.get('tabelas', {}):
+                    shutil.rmtree(os.path.join(diretorio, tabela), ignore_errors=True)
+                anterior = None
+            particoes = {tabela: dict(info) for tabela, info in (anterior or {}).get('tabelas', {}).items()}
+            for tabela in TABELAS_INSTANTANEO:
+                particoes.setdefault(tabela, {})
+
+            pendentes = [(tabela, particao, versao) for (tabela, particao), versao in sorted(versoes.items())
+                         if particoes[tabela].get(particao, {}).get('versao') != versao]
+            gravadas = removidas = linhas = 0
+            try:
+                for i, (tabela, particao, versao) in enumerate(pendentes, start=1):
+                    arquivo = _caminho_particao(tabela, particao, formato)
+                    colunas = COLUNAS_INSTANTANEO[tabela]
+                    total = _gravar_atomico(os.path.join(diretorio, arquivo),
+                                            lambda destino: gravar_colunar(destino, formato, colunas,
+                                                                           _lotes_particao(conn, c, tabela, particao)))
+                    if total or tabela == 'mapa_locais':
+                        particoes[tabela][particao] = {'versao': versao, 'arquivo': arquivo, 'linhas': total}
+                        gravadas += 1
+                        linhas += total
+                    else:
+                        # Mês sem manutenções: a versão fica anotada para o mês não ser relido a cada geração
+                        _remover_particao(diretorio, arquivo)
+                        if particoes[tabela].get(particao, {}).get('arquivo'):
+                            removidas += 1
+                        particoes[tabela][particao] = {'versao': versao, 'arquivo': None, 'linhas': 0}
+                    if ao_progredir:
+                        ao_progredir(i, len(pendentes))
+            finally:
+                # Também em caso de erro ou cancelamento: as partições já gravadas não são refeitas
+                _gravar_manifesto(diretorio, {
+                    'geracao': geracao,
+                    'formato': formato,
+                    'gerado_em': datetime.now().isoformat(timespec='seconds'),
+                    'tabelas': particoes,
+                })
+        finally:
+            conn.rollback()
+            c.close()
+
+    logger.info(f"Instantâneo ({formato}) atualizado em '{diretorio}': {gravadas} partições gravadas "
+                f"({linhas} linhas), {removidas} removidas, {len(versoes) - len(pendentes)} inalteradas")
+    return {
+        'formato': formato,
+        'gravadas': gravadas,
+        'removidas': removidas,
+        'inalteradas': len(versoes) - len(pendentes),
+        'linhas': linhas,
+    }
+
+
+def carregar_instantaneo(tabela, meses=None, diretorio=INSTANTANEOS_DIR):
+    """
+    Tabela Arrow com o conteúdo do instantâneo de `tabela` ('manutencoes' ou 'mapa_locais').
+    `meses` (lista de 'AAAA-MM'; '' para as manutenções sem data) limita as partições lidas.
+    No formato arrow os arquivos são mapeados em memória, sem cópia; para um DataFrame:
+    carregar_instantaneo('manutencoes').to_pandas().
+    """
+    if pa is None:
+        raise RuntimeError('Os instantâneos requerem o pacote pyarrow (pip install pyarrow)')
+    if tabela not in COLUNAS_INSTANTANEO:
+        raise ValueError(f'Tabela inválida. Use: {", ".join(TABELAS_INSTANTANEO)}')
+    manifesto = ler_manifesto(diretorio)
+    if manifesto is None:
+        raise FileNotFoundError(f"Nenhum instantâneo gerado em '{diretorio}'")
+
+    partes = []
+    for particao, info in sorted(manifesto['tabelas'].get(tabela, {}).items()):
+        if not info.get('arquivo') or (meses is not None and particao not in meses):
+            continue
+        caminho = os.path.join(diretorio, info['arquivo'])
+        if manifesto['formato'] == 'arrow':
+            partes.append(pa.ipc.open_file(pa.memory_map(caminho)).read_all())
+        else:
+            partes.append(pq.read_table(caminho, memory_map=True))
+    if not partes:
+        return tabela_arrow(COLUNAS_INSTANTANEO[tabela], [])
+    # Sem unificar as categorias: cada partição mantém o próprio dicionário (um chunk por partição)
+    return pa.concat_tables(partes)
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if '--instantaneo' not in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+    conn = pool.obter()
+    try:
+        criar_esquema_colunar(conn.cursor())
+        conn.commit()
+        gerar_instantaneo(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,328 @@
+"""
+Cubo analítico dos relatórios, usado por GET /api/relatorios/cubo.
+
+Fatos pré-agregados: a tabela 'cubo_fatos' guarda, para cada combinação de dia, placa,
+motorista, tipo e local, a quantidade de manutenções e o valor total. Ela é mantida por
+triggers em 'manutencoes', na mesma transação de cada gravação (como os resumos em
+resumos.py). Cada célula alterada recebe a versão corrente de 'cubo_estado'. Células que
+ficam sem manutenções permanecem com quantidade 0, para que as cópias em memória percebam
+a remoção.
+
+Cada processo mantém uma cópia colunar das células (DataFrame com as dimensões como
+categorias). Ela é atualizada de forma incremental: só as células com versão maior que a da
+cópia são lidas do banco. A reconstrução da tabela muda a 'geracao' e força a releitura
+completa. Os agrupamentos e tabelas dinâmicas (pivot) são calculados com pandas/NumPy sobre
+essa cópia.
+
+Dimensões: dia, mes e ano (derivados do dia), placa, motorista, tipo e local.
+Medidas: quantidade, valor_total e ticket_medio (valor_total / quantidade).
+
+Verificação de consistência (reconstrói a tabela se houver divergências):
+    python cubo.py
+    python cubo.py --reconstruir   # reconstrói sempre
+"""
+import logging
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+logger = logging.getLogger(__name__)
+
+# Dimensões gravadas na tabela de fatos (texto; nulos como '')
+DIMENSOES_FATOS = ('dia', 'placa', 'motorista', 'tipo', 'local')
+# Dimensões derivadas do dia: nome -> quantidade de caracteres de 'AAAA-MM-DD' mantidos
+DIMENSOES_TEMPO = {'mes': 7, 'ano': 4}
+DIMENSOES_CUBO = ('dia', 'mes', 'ano', 'placa', 'motorista', 'tipo', 'local')
+MEDIDAS_CUBO = ('quantidade', 'valor_total', 'ticket_medio')
+ORDENS_CUBO = ('chave', 'medida')
+
+_COLUNAS_MANUTENCAO = {'dia': 'data_iso', 'placa': 'placa', 'motorista': 'motorista', 'tipo': 'tipo', 'local': 'local'}
+
+
+def criar_esquema_cubo(c):
+    """Cria (se necessário) as tabelas, o índice e os triggers. Popula a tabela recém-criada."""
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cubo_fatos'")
+    existia = c.fetchone() is not None
+    c.execute(f'''CREATE TABLE IF NOT EXISTS cubo_fatos
+                  (id INTEGER PRIMARY KEY,
+                   {', '.join(f'{dimensao} TEXT NOT NULL' for dimensao in DIMENSOES_FATOS)},
+                   quantidade INTEGER NOT NULL,
+                   valor_total REAL NOT NULL,
+                   versao INTEGER NOT NULL, -- Versão de 'cubo_estado' na última alteração da célula
+                   UNIQUE ({', '.join(DIMENSOES_FATOS)}))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cubo_fatos_versao ON cubo_fatos (versao)')
+    c.execute('''CREATE TABLE IF NOT EXISTS cubo_estado
+                 (id INTEGER PRIMARY KEY CHECK (id = 1),
+                  geracao INTEGER NOT NULL, -- Muda a cada reconstrução: as cópias em memória são relidas
+                  versao INTEGER NOT NULL)''')
+    c.execute('INSERT OR IGNORE INTO cubo_estado (id, geracao, versao) VALUES (1, 1, 0)')
+
+    incrementar = 'UPDATE cubo_estado SET versao = versao + 1 WHERE id = 1;'
+    versao = '(SELECT versao FROM cubo_estado WHERE id = 1)'
+    chave_new = ', '.join(f"COALESCE(NEW.{coluna}, '')" for coluna in _COLUNAS_MANUTENCAO.values())
+    adicionar = f'''INSERT INTO cubo_fatos ({', '.join(DIMENSOES_FATOS)}, quantidade, valor_total, versao)
+                    VALUES ({chave_new}, 1, COALESCE(NEW.valor, 0), {versao})
+                    ON CONFLICT ({', '.join(DIMENSOES_FATOS)}) DO UPDATE SET
+                        quantidade = quantidade + 1,
+                        valor_total = valor_total + excluded.valor_total,
+                        versao = excluded.versao;'''
+    chave_old = ' AND '.join(f"{dimensao} = COALESCE(OLD.{coluna}, '')" for dimensao, coluna in _COLUNAS_MANUTENCAO.items())
+    remover = f'''UPDATE cubo_fatos SET
+                      quantidade = quantidade - 1,
+                      valor_total = valor_total - COALESCE(OLD.valor, 0),
+                      versao = {versao}
+                  WHERE {chave_old};'''
+    colunas = ', '.join([*_COLUNAS_MANUTENCAO.values(), 'valor'])
+    mudou = ' OR '.join(f'OLD.{coluna} IS NOT NEW.{coluna}' for coluna in [*_COLUNAS_MANUTENCAO.values(), 'valor'])
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_cubo_ai AFTER INSERT ON manutencoes
+                  BEGIN
+                      {incrementar}
+                      {adicionar}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_cubo_ad AFTER DELETE ON manutencoes
+                  BEGIN
+                      {incrementar}
+                      {remover}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_cubo_au AFTER UPDATE OF {colunas} ON manutencoes
+                  WHEN {mudou}
+                  BEGIN
+                      {incrementar}
+                      {remover}
+                      {adicionar}
+                  END''')
+
+    if not existia:
+        reconstruir_cubo(c)
+
+
+def _consulta_fatos():
+    """Recalcula as células (dimensões, quantidade, valor_total) a partir de 'manutencoes'."""
+    chave = ', '.join(f"COALESCE({coluna}, '')" for coluna in _COLUNAS_MANUTENCAO.values())
+    return f'SELECT {chave}, COUNT(*), COALESCE(SUM(valor), 0) FROM manutencoes GROUP BY {chave}'
+
+
+def reconstruir_cubo(c):
+    """Recalcula 'cubo_fatos' a partir de 'manutencoes' (na transação corrente)."""
+    c.execute('DELETE FROM cubo_fatos')
+    c.execute(f'''INSERT INTO cubo_fatos ({', '.join(DIMENSOES_FATOS)}, quantidade, valor_total, versao)
+                  SELECT *, (SELECT versao FROM cubo_estado WHERE id = 1) FROM ({_consulta_fatos()})''')
+    c.execute('UPDATE cubo_estado SET geracao = geracao + 1 WHERE id = 1')
+    logger.info("Cubo dos relatórios reconstruído")
+
+
+def verificar_cubo(c):
+    """Compara 'cubo_fatos' com um agrupamento completo. Retorna a quantidade de células divergentes."""
+    nomes = [*DIMENSOES_FATOS, 'quantidade', 'valor']
+    colunas = ', '.join(nomes[:-1] + ['ROUND(valor, 2)'])
+    c.execute(f'''WITH esperado({', '.join(nomes)}) AS ({_consulta_fatos()}),
+                       atual({', '.join(nomes)}) AS (SELECT {', '.join(DIMENSOES_FATOS)}, quantidade, valor_total
+                                                     FROM cubo_fatos WHERE quantidade > 0)
+                  SELECT (SELECT COUNT(*) FROM (SELECT {colunas} FROM esperado EXCEPT SELECT {colunas} FROM atual)) +
+                         (SELECT COUNT(*) FROM (SELECT {colunas} FROM atual EXCEPT SELECT {colunas} FROM esperado))''')
+    return c.fetchone()[0]
+
+
+def _ler_celulas(c, desde_versao=None):
+    consulta = f"SELECT id, {', '.join(DIMENSOES_FATOS)}, quantidade, valor_total FROM cubo_fatos"
+    if desde_versao is None:
+        c.execute(f'{consulta} WHERE quantidade > 0')
+    else:
+        c.execute(f'{consulta} WHERE versao > ?', (desde_versao,))
+    rows = c.fetchall()
+    colunas = list(zip(*rows)) if rows else [()] * (len(DIMENSOES_FATOS) + 3)
+    dados = {'id': np.array(colunas[0], dtype=np.int64)}
+    for i, dimensao in enumerate(DIMENSOES_FATOS, start=1):
+        dados[dimensao] = pd.Categorical(colunas[i])
+    dados['quantidade'] = np.array(colunas[-2], dtype=np.int64)
+    dados['valor_total'] = np.array(colunas[-1], dtype=float)
+    return pd.DataFrame(dados)
+
+
+def _juntar(atual, alteradas):
+    """Substitui em `atual` as células de `alteradas` (pelo id) e remove as que ficaram vazias."""
+    mantidas = atual[~np.isin(atual['id'].to_numpy(), alteradas['id'].to_numpy())]
+    alteradas = alteradas[alteradas['quantidade'] > 0]
+    dados = {'id': np.concatenate([mantidas['id'].to_numpy(), alteradas['id'].to_numpy()])}
+    for dimensao in DIMENSOES_FATOS:
+        # Categorias unidas sem recalcular os códigos das células mantidas
+        dados[dimensao] = union_categoricals([mantidas[dimensao], alteradas[dimensao]], ignore_order=True)
+    for medida in ('quantidade', 'valor_total'):
+        dados[medida] = np.concatenate([mantidas[medida].to_numpy(), alteradas[medida].to_numpy()])
+    return pd.DataFrame(dados)
+
+
+class CopiaCubo:
+    """Cópia colunar, por processo, das células com manutenções, atualizada pela versão de 'cubo_estado'."""
+
+    def __init__(self):
+        self._celulas = None
+        self._geracao = None
+        self._versao = None
+        self._lock = threading.Lock()
+
+    def obter(self, conn):
+        """DataFrame das células atual. Não deve ser alterado: é compartilhado entre as requisições."""
+        estado = tuple(conn.execute('SELECT geracao, versao FROM cubo_estado WHERE id = 1').fetchone())
+        if self._celulas is not None and estado == (self._geracao, self._versao):
+            return self._celulas
+        with self._lock:
+            c = conn.cursor()
+            # Estado e células lidos na mesma transação, para que a versão corresponda às células
+            conn.execute('BEGIN')
+            try:
+                geracao, versao = c.execute('SELECT geracao, versao FROM cubo_estado WHERE id = 1').fetchone()
+                if self._celulas is None or geracao != self._geracao:
+                    self._celulas = _ler_celulas(c)
+                    logger.debug(f"Cópia do cubo carregada: {len(self._celulas)} células")
+                elif versao != self._versao:
+                    alteradas = _ler_celulas(c, self._versao)
+                    self._celulas = _juntar(self._celulas, alteradas)
+                    logger.debug(f"Cópia do cubo atualizada: {len(alteradas)} células alteradas")
+                self._geracao, self._versao = geracao, versao
+            finally:
+                conn.rollback()
+                c.close()
+            return self._celulas
+
+
+copia = CopiaCubo()
+
+
+def _coluna(celulas, dimensao):
+    """Série da dimensão; mes e ano são derivados das categorias do dia, sem percorrer as células."""
+    if dimensao not in DIMENSOES_TEMPO:
+        return celulas[dimensao]
+    dia = celulas['dia'].cat
+    prefixos = dia.categories.str[:DIMENSOES_TEMPO[dimensao]]
+    categorias, posicoes = np.unique(np.asarray(prefixos, dtype=object), return_inverse=True)
+    codigos = np.where(dia.codes >= 0, posicoes[dia.codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=celulas.index)
+
+
+def _filtrar(celulas, filtros):
+    mascara = np.ones(len(celulas), dtype=bool)
+    inicio, fim = filtros.get('data_inicio'), filtros.get('data_fim')
+    if inicio or fim:
+        # Comparação feita nas categorias (dias distintos) e levada às células pelos códigos
+        dias = np.asarray(celulas['dia'].cat.categories, dtype=object)
+        no_intervalo = (dias != '') & (dias >= (inicio or '')) & (dias <= (fim or '9999-12-31'))
+        codigos = celulas['dia'].cat.codes.to_numpy()
+        mascara &= (codigos >= 0) & no_intervalo[np.maximum(codigos, 0)]
+    for dimensao in ('placa', 'motorista', 'tipo', 'local'):
+        valores = filtros.get(dimensao)
+        if valores:
+            mascara &= celulas[dimensao].isin(valores).to_numpy()
+    return celulas[mascara]
+
+
+def _medida(quantidade, valor, medida):
+    if medida == 'quantidade':
+        return quantidade
+    if medida == 'valor_total':
+        return np.round(valor, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.round(np.where(quantidade > 0, valor / np.maximum(quantidade, 1), 0.0), 2)
+
+
+def _totais(quantidade, valor):
+    quantidade, valor = int(quantidade), float(valor)
+    return {'quantidade': quantidade, 'valor_total': round(valor, 2),
+            'ticket_medio': round(valor / quantidade, 2) if quantidade else 0.0}
+
+
+def consultar_cubo(celulas, linhas, colunas=(), medida='valor_total', filtros=None, ordem='chave', limite=None):
+    """
+    Agrupa as células por `linhas` (lista de dimensões). Sem `colunas`, retorna
+    {'linhas', 'itens': [{<dimensões>, quantidade, valor_total, ticket_medio}], 'total'}.
+    Com `colunas`, retorna a tabela dinâmica da `medida`: {'linhas', 'colunas', 'medida',
+    'cabecalho': [chaves das colunas], 'itens': [{'chave', 'valores', 'total'}], 'totais', 'total'}.
+    `filtros`: data_inicio, data_fim ('AAAA-MM-DD') e listas de placa, motorista, tipo e local.
+    `ordem`: 'chave' (padrão) ou 'medida' (maior primeiro). `limite` corta os itens, não os totais.
+    Lança ValueError para parâmetros inválidos.
+    """
+    linhas, colunas = list(linhas), list(colunas)
+    if not linhas:
+        raise ValueError('Informe ao menos uma dimensão em linhas.')
+    invalidas = [d for d in linhas + colunas if d not in DIMENSOES_CUBO]
+    if invalidas:
+        raise ValueError(f'Dimensões inválidas: {", ".join(invalidas)}. Use: {", ".join(DIMENSOES_CUBO)}')
+    if len(set(linhas + colunas)) != len(linhas + colunas):
+        raise ValueError('Uma dimensão não pode aparecer mais de uma vez em linhas e colunas.')
+    if medida not in MEDIDAS_CUBO:
+        raise ValueError(f'Medida inválida. Use: {", ".join(MEDIDAS_CUBO)}')
+    if ordem not in ORDENS_CUBO:
+        raise ValueError(f'Ordem inválida. Use: {", ".join(ORDENS_CUBO)}')
+
+    selecionadas = _filtrar(celulas, filtros or {})
+    dimensoes = linhas + colunas
+    quadro = pd.DataFrame({d: _coluna(selecionadas, d) for d in dimensoes})
+    quadro['quantidade'] = selecionadas['quantidade'].to_numpy()
+    quadro['valor_total'] = selecionadas['valor_total'].to_numpy()
+    agrupado = quadro.groupby(dimensoes, observed=True, sort=False)[['quantidade', 'valor_total']].sum().reset_index()
+    for d in dimensoes:
+        agrupado[d] = agrupado[d].astype(object)  # Ordenação alfabética, não pela ordem das categorias
+    total = _totais(agrupado['quantidade'].sum(), agrupado['valor_total'].sum())
+
+    if colunas and agrupado.empty:
+        return {'linhas': linhas, 'colunas': colunas, 'medida': medida, 'cabecalho': [], 'itens': [],
+                'totais': [], 'total': total[medida]}
+    if not colunas:
+        agrupado['ticket_medio'] = _medida(agrupado['quantidade'].to_numpy(), agrupado['valor_total'].to_numpy(),
+                                           'ticket_medio')
+        agrupado['valor_total'] = agrupado['valor_total'].round(2)
+        agrupado = agrupado.sort_values(linhas, kind='stable')
+        if ordem == 'medida':
+            agrupado = agrupado.sort_values(medida, ascending=False, kind='stable')
+        if limite:
+            agrupado = agrupado.head(limite)
+        return {'linhas': linhas, 'itens': agrupado.to_dict('records'), 'total': total}
+
+    tabela = agrupado.pivot_table(index=linhas, columns=colunas, values=['quantidade', 'valor_total'],
+                                  aggfunc='sum', fill_value=0, sort=True)
+    quantidade = tabela['quantidade'].to_numpy()
+    valor = tabela['valor_total'].to_numpy()
+    valores = _medida(quantidade, valor, medida)
+    totais_linhas = _medida(quantidade.sum(axis=1), valor.sum(axis=1), medida)
+    totais_colunas = _medida(quantidade.sum(axis=0), valor.sum(axis=0), medida)
+    ordenacao = np.argsort(-totais_linhas, kind='stable') if ordem == 'medida' else np.arange(len(tabela))
+    if limite:
+        ordenacao = ordenacao[:limite]
+    chaves_linhas = tabela.index.tolist()
+    chaves_colunas = tabela['quantidade'].columns.tolist()
+    como_lista = lambda chave: list(chave) if isinstance(chave, tuple) else [chave]
+    return {
+        'linhas': linhas,
+        'colunas': colunas,
+        'medida': medida,
+        'cabecalho': [como_lista(chave) for chave in chaves_colunas],
+        'itens': [{'chave': como_lista(chaves_linhas[i]), 'valores': valores[i].tolist(), 'total': totais_linhas[i].item()}
+                  for i in ordenacao],
+        'totais': totais_colunas.tolist(),
+        'total': total[medida],
+    }
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        criar_esquema_cubo(c)
+        if '--reconstruir' in sys.argv:
+            reconstruir_cubo(c)
+        else:
+            divergentes = verificar_cubo(c)
+            if divergentes:
+                logger.warning(f"{divergentes} célula(s) do cubo divergente(s); reconstruindo...")
+                reconstruir_cubo(c)
+            else:
+                logger.info("Cubo consistente")
+        conn.commit()
+    finally:
+        conn.close()
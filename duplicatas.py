@@ -0,0 +1,314 @@
+"""
+Detecção de duplicatas em manutenções e locais do mapa.
+
+Duplicatas exatas (manutenções): a impressão digital de uma manutenção é a combinação de
+placa, data, valor em centavos e OC (sem espaços nas pontas e sem diferenciar maiúsculas).
+O índice idx_manutencoes_impressao cobre exatamente essas expressões; a importação só grava
+as linhas cuja impressão ainda não existe (ver condicao_impressao), o que torna a importação
+idempotente: reimportar a mesma planilha não duplica os dados. O índice não é UNIQUE porque
+bancos existentes podem já ter duplicatas e os cadastros manuais continuam livres; essas
+duplicatas aparecem nos grupos abaixo, com 'exata': true.
+
+Duplicatas aproximadas: os registros são divididos em blocos e só registros do mesmo bloco
+são comparados, em vez de todos contra todos:
+- manutenções: bloco por placa (sem separadores); dentro dele, em ordem de data, cada
+  manutenção é comparada apenas com as seguintes até DUPLICATAS_DIAS dias depois. A
+  pontuação combina valor, proximidade das datas e semelhança de tipo, local e defeito; OCs
+  preenchidas e diferentes indicam manutenções distintas;
+- locais do mapa: bloco por categoria (unidade ou prestador), estado e cidade normalizados. A
+  pontuação combina semelhança do nome, distância (até DUPLICATAS_RAIO_M metros) e telefone.
+  São exatos ('exata': true) os locais com o mesmo nome e o mesmo telefone ou coordenadas a
+  até DUPLICATAS_RAIO_M metros; só o nome igual não basta.
+Pares com pontuação a partir da similaridade pedida são unidos em grupos (componentes
+conexos); cada grupo traz os registros, a maior pontuação entre eles e se é exato.
+
+Configuração por variáveis de ambiente:
+    DUPLICATAS_SIMILARIDADE   pontuação mínima, de 0 a 1 (padrão: 0.85)
+    DUPLICATAS_DIAS           distância máxima entre as datas das manutenções (padrão: 3)
+    DUPLICATAS_RAIO_M         distância considerada na comparação dos locais (padrão: 300)
+"""
+import logging
+import math
+import os
+from datetime import date
+from difflib import SequenceMatcher
+
+from busca import normalizar_placa, normalizar_telefone
+from geo import distancias_km
+from geocodificacao import normalizar_endereco
+
+logger = logging.getLogger(__name__)
+
+DUPLICATAS_SIMILARIDADE = float(os.environ.get('DUPLICATAS_SIMILARIDADE', 0.85))
+DUPLICATAS_DIAS = int(os.environ.get('DUPLICATAS_DIAS', 3))
+DUPLICATAS_RAIO_M = float(os.environ.get('DUPLICATAS_RAIO_M', 300))
+
+# Expressões da impressão digital, na ordem do índice; cada uma é comparada com o parâmetro
+# correspondente normalizado da mesma forma
+_IMPRESSAO = (
+    ('placa', '{}'),
+    ('data_iso', '{}'),
+    ('CAST(round(valor * 100) AS INTEGER)', 'CAST(round({} * 100) AS INTEGER)'),
+    ("upper(trim(coalesce(oc, '')))", "upper(trim(coalesce({}, '')))"),
+)
+CAMPOS_MANUTENCAO = ('id', 'data_iso', 'placa', 'motorista', 'tipo', 'oc', 'valor', 'local', 'defeito')
+CAMPOS_LOCAL = ('id', 'nome', 'tipo', 'endereco', 'cidade', 'estado', 'telefone', 'latitude', 'longitude')
+# Quilômetros em um grau de latitude
+KM_POR_GRAU = 111.32
+# Diferença relativa de valor a partir da qual o valor não contribui para a pontuação
+_TOLERANCIA_VALOR = 0.05
+
+
+def criar_esquema_duplicatas(c):
+    """Cria (se necessário) o índice da impressão digital das manutenções."""
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_manutencoes_impressao
+                  ON manutencoes ({', '.join(expressao for expressao, _ in _IMPRESSAO)})''')
+
+
+def condicao_impressao(placa, data_iso, valor, oc):
+    """
+    Condição SQL que encontra as manutenções com a mesma impressão digital. Os argumentos são
+    os marcadores dos parâmetros (ex.: '?3'). Uso na importação:
+        INSERT INTO manutencoes (...) SELECT ?1, ?2, ... WHERE NOT EXISTS
+            (SELECT 1 FROM manutencoes WHERE <condicao_impressao(...)>)
+    """
+    return ' AND '.join(f'{expressao} = {parametro.format(marcador)}'
+                        for (expressao, parametro), marcador in zip(_IMPRESSAO, (placa, data_iso, valor, oc)))
+
+
+def _centavos(valor):
+    """Valor em centavos, arredondado como o round() do SQLite (metade para longe do zero)."""
+    centavos = math.floor(abs(valor) * 100 + 0.5)
+    return -centavos if valor < 0 else centavos
+
+
+def _impressao(registro):
+    valor = registro['valor']
+    return (registro['placa'], registro['data_iso'], _centavos(valor) if isinstance(valor, (int, float)) else valor,
+            (registro['oc'] or '').strip().upper())
+
+
+def _similaridade_texto(a, b, minimo=0.0):
+    """Razão de semelhança (0 a 1) entre dois textos normalizados; 0 se não puder atingir `minimo`."""
+    if a == b:
+        return 1.0
+    comparador = SequenceMatcher(None, a, b, autojunk=False)
+    # Limites superiores baratos antes do cálculo completo
+    if comparador.real_quick_ratio() < minimo or comparador.quick_ratio() < minimo:
+        return 0.0
+    return comparador.ratio()
+
+
+class _Grupos:
+    """União de conjuntos (union-find) dos pares semelhantes, com a maior pontuação de cada grupo."""
+
+    def __init__(self):
+        self.pai = {}
+        self.pontuacao = {}
+        self.exato = {}
+
+    def raiz(self, item):
+        self.pai.setdefault(item, item)
+        while self.pai[item] != item:
+            self.pai[item] = self.pai[self.pai[item]]
+            item = self.pai[item]
+        return item
+
+    def unir(self, a, b, pontuacao, exato):
+        raiz_a, raiz_b = self.raiz(a), self.raiz(b)
+        if raiz_b != raiz_a:
+            self.pai[raiz_b] = raiz_a
+            pontuacao = max(pontuacao, self.pontuacao.pop(raiz_b, 0))
+            exato = exato and self.exato.pop(raiz_b, True)
+        self.pontuacao[raiz_a] = max(pontuacao, self.pontuacao.get(raiz_a, 0))
+        # O grupo só é exato se todas as ligações forem exatas
+        self.exato[raiz_a] = exato and self.exato.get(raiz_a, True)
+
+    def resultado(self, registros, limite):
+        """Grupos com os registros (na ordem de `registros`), dos mais prováveis aos menos prováveis."""
+        membros = {}
+        for registro in registros:
+            if registro['id'] in self.pai:
+                membros.setdefault(self.raiz(registro['id']), []).append(registro)
+        grupos = [{
+            'ids': [registro['id'] for registro in itens],
+            'pontuacao': round(self.pontuacao[raiz], 3),
+            'exata': self.exato[raiz],
+            'registros': itens,
+        } for raiz, itens in membros.items()]
+        grupos.sort(key=lambda grupo: (-grupo['exata'], -grupo['pontuacao'], -len(grupo['ids']), grupo['ids'][0]))
+        return {'grupos': grupos[:limite], 'total': len(grupos)}
+
+
+def _pontuacao_manutencoes(a, b, dias, minimo):
+    """Pontuação (0 a 1) e se o par é exato; None se as manutenções forem claramente distintas."""
+    if a['impressao'] == b['impressao']:
+        return 1.0, True
+    oc_a, oc_b = a['impressao'][3], b['impressao'][3]
+    if oc_a and oc_b and oc_a != oc_b:
+        return None
+    if a['valor_num'] is None or b['valor_num'] is None:
+        return None
+    diferenca = abs(a['valor_num'] - b['valor_num']) / max(abs(a['valor_num']), abs(b['valor_num']), 1.0)
+    s_valor = max(0.0, 1 - diferenca / _TOLERANCIA_VALOR)
+    s_data = 1 - abs(b['dia'] - a['dia']) / (dias + 1)
+    # Mesma OC preenchida nas duas: forte indício de que é o mesmo serviço (pontuação 0.5 + metade)
+    mesma_oc = bool(oc_a) and oc_a == oc_b
+    alvo = 2 * minimo - 1 if mesma_oc else minimo
+    # Maior pontuação possível com texto idêntico: se não alcançar o mínimo, o texto nem é comparado
+    if 0.35 * s_valor + 0.25 * s_data + 0.4 < alvo:
+        return None
+    s_texto = _similaridade_texto(a['texto'], b['texto'], (alvo - 0.35 * s_valor - 0.25 * s_data) / 0.4)
+    pontuacao = 0.35 * s_valor + 0.25 * s_data + 0.4 * s_texto
+    if mesma_oc:
+        pontuacao = 0.5 + 0.5 * pontuacao
+    return pontuacao, False
+
+
+def grupos_manutencoes(c, condicoes=(), params=(), similaridade=DUPLICATAS_SIMILARIDADE, dias=DUPLICATAS_DIAS,
+                       limite=500):
+    """
+    Grupos de manutenções duplicadas ou quase duplicadas. `condicoes`/`params` restringem as
+    manutenções analisadas (ex.: período, placa). Retorna {'grupos': [...], 'total'}.
+    """
+    onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    c.execute(f"SELECT {', '.join(CAMPOS_MANUTENCAO)} FROM manutencoes {onde} ORDER BY data_iso, id", list(params))
+    registros = [dict(zip(CAMPOS_MANUTENCAO, row)) for row in c.fetchall()]
+
+    blocos = {}
+    # Placas e textos se repetem muito: cada valor distinto é normalizado uma única vez
+    placas, textos = {}, {}
+    for registro in registros:
+        try:
+            dia = date.fromisoformat(registro['data_iso']).toordinal()
+        except (TypeError, ValueError):
+            continue  # Sem data válida não há como comparar as datas
+        valor = registro['valor']
+        placa = placas.get(registro['placa'])
+        if placa is None:
+            placa = placas[registro['placa']] = normalizar_placa(registro['placa'])
+        texto = ' '.join(str(registro[campo] or '') for campo in ('tipo', 'local', 'defeito'))
+        if texto not in textos:
+            textos[texto] = normalizar_endereco(texto)
+        blocos.setdefault(placa, []).append({
+            'id': registro['id'],
+            'dia': dia,
+            'valor_num': float(valor) if isinstance(valor, (int, float)) else None,
+            'impressao': _impressao(registro),
+            'texto': textos[texto],
+        })
+
+    grupos = _Grupos()
+    comparacoes = 0
+    for placa, itens in blocos.items():
+        if not placa:
+            continue
+        # Vizinhança ordenada: cada item só é comparado com os seguintes dentro da janela de dias
+        for i, a in enumerate(itens):
+            for b in itens[i + 1:]:
+                if b['dia'] - a['dia'] > dias:
+                    break
+                comparacoes += 1
+                resultado = _pontuacao_manutencoes(a, b, dias, similaridade)
+                if resultado and resultado[0] >= similaridade:
+                    grupos.unir(a['id'], b['id'], *resultado)
+
+    for registro in registros:
+        registro['data'] = registro.pop('data_iso')
+    resultado = grupos.resultado(registros, limite)
+    logger.debug(f"Duplicatas de manutenções: {len(registros)} registros em {len(blocos)} blocos, "
+                 f"{comparacoes} comparações, {resultado['total']} grupos")
+    return resultado
+
+
+def _pontuacao_locais(a, b, raio_km, minimo):
+    mesmo_telefone = bool(a['telefone']) and a['telefone'] == b['telefone']
+    distancia = None
+    if a['coordenadas'] and b['coordenadas']:
+        distancia = float(distancias_km(*a['coordenadas'], b['coordenadas'][0], b['coordenadas'][1]))
+    # Exata: mesmo nome e, além dele, mesmo telefone ou coordenadas dentro do raio. Só o nome
+    # igual (redes, nomes genéricos como "Auto Center") segue a pontuação ponderada abaixo
+    if a['nome'] and a['nome'] == b['nome'] and (mesmo_telefone or (distancia is not None and distancia <= raio_km)):
+        return 1.0, True
+    s_distancia = max(0.0, 1 - distancia / raio_km) if distancia is not None else 0.0
+    s_telefone = 1.0 if mesmo_telefone else 0.0
+    # Mesmo telefone no mesmo ponto: é o mesmo estabelecimento, ainda que com outro nome
+    piso = 0.9 + 0.1 * s_distancia if mesmo_telefone and s_distancia > 0 else 0.0
+    if max(0.6 + 0.25 * s_distancia + 0.15 * s_telefone, piso) < minimo:
+        return None
+    s_nome = _similaridade_texto(a['nome'], b['nome'], (minimo - 0.25 * s_distancia - 0.15 * s_telefone) / 0.6)
+    return max(0.6 * s_nome + 0.25 * s_distancia + 0.15 * s_telefone, piso), False
+
+
+def _pares_locais(itens, raio_km, todos):
+    """
+    Pares (i, j) de itens do bloco a comparar. Sem telefone igual ou distância menor que o
+    raio, a pontuação não passa de 0.6 (só o nome, mesmo que igual): acima disso, bastam os
+    pares que compartilham o telefone e os de células vizinhas de uma grade com o tamanho do raio.
+    """
+    if todos:
+        return ((i, j) for i in range(len(itens)) for j in range(i + 1, len(itens)))
+    pares = set()
+    por_telefone = {}
+    for i, item in enumerate(itens):
+        if item['telefone']:
+            por_telefone.setdefault(item['telefone'], []).append(i)
+    for indices in por_telefone.values():
+        pares.update((a, b) for k, a in enumerate(indices) for b in indices[k + 1:])
+
+    passo = raio_km / KM_POR_GRAU
+    celulas = {}
+    for i, item in enumerate(itens):
+        if item['coordenadas']:
+            latitude, longitude = item['coordenadas']
+            celulas.setdefault((math.floor(latitude / passo), math.floor(longitude / passo)), []).append(i)
+    for (x, y), indices in celulas.items():
+        # Um grau de longitude encolhe com a latitude: mais células vizinhas no sentido leste-oeste
+        cosseno = math.cos(math.radians(min(abs(x * passo) + passo, 89.9)))
+        alcance = math.ceil(1 / cosseno)
+        for dx in (-1, 0, 1):
+            for dy in range(-alcance, alcance + 1):
+                for a in indices:
+                    for b in celulas.get((x + dx, y + dy), ()):
+                        if a < b:
+                            pares.add((a, b))
+    return sorted(pares)
+
+
+def grupos_locais(c, condicoes=(), params=(), similaridade=DUPLICATAS_SIMILARIDADE, raio_m=DUPLICATAS_RAIO_M,
+                  limite=500):
+    """
+    Grupos de locais do mapa duplicados ou quase duplicados, comparados dentro do mesmo bloco
+    (unidade/prestador, estado e cidade). Retorna {'grupos': [...], 'total'}.
+    """
+    onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    colunas = ', '.join(f'm.{campo}' for campo in CAMPOS_LOCAL)
+    c.execute(f'SELECT {colunas} FROM mapa_locais m {onde} ORDER BY m.id', list(params))
+    registros = [dict(zip(CAMPOS_LOCAL, row)) for row in c.fetchall()]
+
+    blocos = {}
+    for registro in registros:
+        categoria = 'unidade' if registro['tipo'] == 'unidade' else 'prestador'
+        chave = (categoria, normalizar_endereco(registro['estado']), normalizar_endereco(registro['cidade']))
+        latitude, longitude = registro['latitude'], registro['longitude']
+        blocos.setdefault(chave, []).append({
+            'id': registro['id'],
+            'nome': normalizar_endereco(registro['nome']),
+            'telefone': normalizar_telefone(registro['telefone']),
+            'coordenadas': (latitude, longitude) if latitude is not None and longitude is not None else None,
+        })
+
+    grupos = _Grupos()
+    comparacoes = 0
+    raio_km = max(raio_m, 1.0) / 1000
+    for itens in blocos.values():
+        for i, j in _pares_locais(itens, raio_km, similaridade <= 0.6):
+            comparacoes += 1
+            resultado = _pontuacao_locais(itens[i], itens[j], raio_km, similaridade)
+            if resultado and resultado[0] >= similaridade:
+                grupos.unir(itens[i]['id'], itens[j]['id'], *resultado)
+
+    resultado = grupos.resultado(registros, limite)
+    logger.debug(f"Duplicatas de locais: {len(registros)} registros em {len(blocos)} blocos, "
+                 f"{comparacoes} comparações, {resultado['total']} grupos")
+    return resultado
@@ -0,0 +1,171 @@
+"""
+Consultas geográficas sobre 'mapa_locais' (bases e prestadores) usadas pelo mapa.
+
+Os pontos ficam em um índice R*Tree ('mapa_locais_rtree'), mantido por triggers na tabela
+'mapa_locais'. Cada consulta lê do índice apenas os candidatos de um retângulo (o que
+envolve o raio pedido, ou o bbox), aplica os filtros (tipo, estado, cidade e serviços) na
+mesma query e calcula as distâncias reais (haversine) com NumPy, de uma vez para todos os
+candidatos. Os serviços (ver servicos.py) são lidos apenas para os locais retornados.
+
+- raio: locais a até `raio_km` de um ponto, do mais próximo para o mais distante;
+- mais próximos: os `k` locais mais próximos de um ponto; o retângulo de busca começa
+  pequeno e dobra até conter `k` locais dentro do raio correspondente;
+- bbox: locais dentro de um retângulo, ordenados pela distância ao centro dele.
+"""
+import logging
+import math
+
+import numpy as np
+
+from servicos import condicao_servicos, anexar_servicos
+
+logger = logging.getLogger(__name__)
+
+TABELA_RTREE = 'mapa_locais_rtree'
+RAIO_TERRA_KM = 6371.0
+# Metade da circunferência da Terra: nenhum ponto está mais longe do que isso
+DISTANCIA_MAXIMA_KM = math.pi * RAIO_TERRA_KM
+# Raio inicial da busca dos mais próximos
+RAIO_INICIAL_KM = 25.0
+
+TIPO_UNIDADE = 'unidade'
+# categoria -> condição sobre o tipo do local
+CATEGORIAS = {
+    'unidade': 'm.tipo = ?',
+    'prestador': 'm.tipo != ?',
+}
+
+
+def criar_esquema_geo(c):
+    """Cria (se necessário) o índice R*Tree dos locais e os triggers. Popula o índice recém-criado."""
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABELA_RTREE,))
+    existia = c.fetchone() is not None
+
+    c.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_RTREE} USING rtree(id, min_lat, max_lat, min_lng, max_lng)')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS mapa_locais_rtree_ai AFTER INSERT ON mapa_locais
+                  BEGIN
+                      INSERT INTO {TABELA_RTREE} VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS mapa_locais_rtree_ad AFTER DELETE ON mapa_locais
+                  BEGIN
+                      DELETE FROM {TABELA_RTREE} WHERE id = OLD.id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS mapa_locais_rtree_au AFTER UPDATE OF latitude, longitude ON mapa_locais
+                  BEGIN
+                      UPDATE {TABELA_RTREE} SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+                                                min_lng = NEW.longitude, max_lng = NEW.longitude
+                      WHERE id = NEW.id;
+                  END''')
+
+    if not existia:
+        logger.info("Criando índice espacial dos locais do mapa...")
+        c.execute(f'''INSERT INTO {TABELA_RTREE}
+                      SELECT id, latitude, latitude, longitude, longitude FROM mapa_locais''')
+
+
+def distancias_km(lat, lng, lats, lngs):
+    """Distâncias (haversine, em km) de um ponto a vários pontos, calculadas de forma vetorizada."""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def retangulo_raio(lat, lng, raio_km):
+    """(min_lat, max_lat, min_lng, max_lng) que contém o círculo de raio `raio_km` em torno do ponto."""
+    delta_lat = math.degrees(raio_km / RAIO_TERRA_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # O círculo contém um dos polos: todas as longitudes
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    delta_lng = math.degrees(math.asin(min(1.0, math.sin(raio_km / RAIO_TERRA_KM) / math.cos(math.radians(lat)))))
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    if min_lng < -180 or max_lng > 180:
+        # Atravessa o antimeridiano: simplificado para todas as longitudes
+        min_lng, max_lng = -180.0, 180.0
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def condicoes_filtros(filtros):
+    """
+    Condições SQL (sobre 'mapa_locais m') e parâmetros dos filtros: `tipos`, `categoria`,
+    `estado`, `cidade` e `servicos` (todos ou algum, conforme `servicos_modo`).
+    """
+    condicoes, params = [], []
+    if filtros.get('tipos'):
+        condicoes.append(f"m.tipo IN ({','.join('?' for _ in filtros['tipos'])})")
+        params.extend(filtros['tipos'])
+    if filtros.get('categoria'):
+        condicoes.append(CATEGORIAS[filtros['categoria']])
+        params.append(TIPO_UNIDADE)
+    if filtros.get('estado'):
+        condicoes.append('m.estado = ? COLLATE NOCASE')
+        params.append(filtros['estado'])
+    if filtros.get('cidade'):
+        condicoes.append('m.cidade = ? COLLATE NOCASE')
+        params.append(filtros['cidade'])
+    if filtros.get('servicos'):
+        condicao, nomes = condicao_servicos(filtros['servicos'], filtros.get('servicos_modo') or 'todos')
+        condicoes.append(condicao)
+        params.extend(nomes)
+    return condicoes, params
+
+
+def _candidatos(c, retangulo, filtros):
+    """Locais do retângulo (via R*Tree) que atendem aos filtros, como lista de dicionários."""
+    min_lat, max_lat, min_lng, max_lng = retangulo
+    condicoes, params = condicoes_filtros(filtros)
+    c.execute(f'''SELECT m.* FROM {TABELA_RTREE} r JOIN mapa_locais m ON m.id = r.id
+                  WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+                  {''.join(f' AND {condicao}' for condicao in condicoes)}''',
+              [min_lat, max_lat, min_lng, max_lng, *params])
+    return [dict(row) for row in c.fetchall()]
+
+
+def _ordenar_por_distancia(locais, lat, lng, raio_km=None, limite=None):
+    """Calcula a distância de cada local ao ponto, descarta os além do raio e ordena."""
+    if not locais:
+        return []
+    lats = np.fromiter((l['latitude'] for l in locais), dtype=float, count=len(locais))
+    lngs = np.fromiter((l['longitude'] for l in locais), dtype=float, count=len(locais))
+    distancias = distancias_km(lat, lng, lats, lngs)
+    indices = np.argsort(distancias, kind='stable')
+    if raio_km is not None:
+        indices = indices[distancias[indices] <= raio_km]
+    if limite is not None:
+        indices = indices[:limite]
+    resultado = []
+    for i in indices:
+        local = locais[i]
+        local['distancia_km'] = round(float(distancias[i]), 3)
+        resultado.append(local)
+    return resultado
+
+
+def _locais_no_raio(c, lat, lng, raio_km, filtros, limite=None):
+    candidatos = _candidatos(c, retangulo_raio(lat, lng, raio_km), filtros)
+    return _ordenar_por_distancia(candidatos, lat, lng, raio_km, limite)
+
+
+def locais_no_raio(c, lat, lng, raio_km, filtros, limite=None):
+    """Locais a até `raio_km` do ponto, do mais próximo para o mais distante."""
+    return anexar_servicos(c, _locais_no_raio(c, lat, lng, raio_km, filtros, limite))
+
+
+def locais_mais_proximos(c, lat, lng, k, filtros, raio_maximo_km=None):
+    """Os `k` locais mais próximos do ponto (opcionalmente limitados a `raio_maximo_km`)."""
+    raio_maximo = min(raio_maximo_km or DISTANCIA_MAXIMA_KM, DISTANCIA_MAXIMA_KM)
+    raio = min(RAIO_INICIAL_KM, raio_maximo)
+    while True:
+        # Todo local a até `raio` está no retângulo; com k deles, os k mais próximos são conhecidos
+        encontrados = _locais_no_raio(c, lat, lng, raio, filtros)
+        if len(encontrados) >= k or raio >= raio_maximo:
+            return anexar_servicos(c, encontrados[:k])
+        raio = min(raio * 2, raio_maximo)
+
+
+def locais_no_retangulo(c, min_lat, min_lng, max_lat, max_lng, filtros, limite=None, centro=None):
+    """Locais dentro do retângulo, ordenados pela distância ao centro (ou ao ponto informado)."""
+    candidatos = _candidatos(c, (min_lat, max_lat, min_lng, max_lng), filtros)
+    lat, lng = centro or ((min_lat + max_lat) / 2, (min_lng + max_lng) / 2)
+    return anexar_servicos(c, _ordenar_por_distancia(candidatos, lat, lng, limite=limite))
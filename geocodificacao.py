@@ -0,0 +1,365 @@
+"""
+Geocodificação no servidor (endereço -> coordenadas e coordenadas -> endereço).
+
+Toda consulta passa primeiro pelo cache persistente 'geocodificacao_cache', com chave no
+endereço normalizado (minúsculas, sem acentos e sem pontuação) ou na coordenada arredondada
+para GEOCODIFICACAO_CASAS_DECIMAIS casas (4 casas ~ 11 m). Só o que não está no cache é
+enviado aos backends, na ordem de GEOCODIFICACAO_BACKENDS; endereços não encontrados também
+são guardados, e só voltam a ser consultados depois de GEOCODIFICACAO_RETENTAR_DIAS.
+
+Backends (novos podem ser registrados com @registrar_backend):
+- 'local': gazetteer local, sem rede. Reúne as coordenadas já conhecidas no banco (locais
+  das manutenções com coordenadas e os endereços, nomes e cidades de 'mapa_locais') e, se
+  existir, o arquivo CSV GEOCODIFICACAO_GAZETTEER (colunas nome;latitude;longitude). Busca
+  direta por nome normalizado exato; busca reversa pelo ponto conhecido mais próximo, até
+  GEOCODIFICACAO_RAIO_REVERSO_KM;
+- 'nominatim': API do OpenStreetMap Nominatim (no máximo 1 requisição por segundo por
+  processo, conforme a política de uso do serviço).
+
+Preenchimento em lote das coordenadas das manutenções (uma consulta por local distinto):
+    python geocodificacao.py --preencher
+
+Configuração por variáveis de ambiente:
+    GEOCODIFICACAO_BACKENDS         backends, em ordem (padrão: local,nominatim)
+    GEOCODIFICACAO_GAZETTEER        CSV do gazetteer local (padrão: gazetteer.csv)
+    GEOCODIFICACAO_CASAS_DECIMAIS   arredondamento das coordenadas da busca reversa (padrão: 4)
+    GEOCODIFICACAO_RAIO_REVERSO_KM  distância máxima da busca reversa local (padrão: 1)
+    GEOCODIFICACAO_RETENTAR_DIAS    dias até repetir uma consulta sem resultado (padrão: 7)
+    NOMINATIM_URL                   URL base do Nominatim (padrão: https://nominatim.openstreetmap.org)
+    NOMINATIM_USER_AGENT            identificação enviada ao Nominatim
+"""
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+from agrupamentos import versao_coordenadas
+from geo import distancias_km
+
+logger = logging.getLogger(__name__)
+
+GEOCODIFICACAO_BACKENDS = [b.strip() for b in os.environ.get('GEOCODIFICACAO_BACKENDS', 'local,nominatim').split(',') if b.strip()]
+GEOCODIFICACAO_GAZETTEER = os.environ.get('GEOCODIFICACAO_GAZETTEER', 'gazetteer.csv')
+GEOCODIFICACAO_CASAS_DECIMAIS = int(os.environ.get('GEOCODIFICACAO_CASAS_DECIMAIS', 4))
+GEOCODIFICACAO_RAIO_REVERSO_KM = float(os.environ.get('GEOCODIFICACAO_RAIO_REVERSO_KM', 1))
+GEOCODIFICACAO_RETENTAR_DIAS = float(os.environ.get('GEOCODIFICACAO_RETENTAR_DIAS', 7))
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org').rstrip('/')
+NOMINATIM_USER_AGENT = os.environ.get('NOMINATIM_USER_AGENT', 'sistema-manutencao/1.0 (geocodificacao)')
+
+DIRETA = 'direta'
+REVERSA = 'reversa'
+# Locais atualizados por vez no preenchimento em lote
+PREENCHIMENTO_LOTE = 200
+
+_backends = {}
+
+
+def registrar_backend(nome):
+    """Decorador que registra uma classe de backend de geocodificação com o nome informado."""
+    def decorador(classe):
+        classe.nome = nome
+        _backends[nome] = classe
+        return classe
+    return decorador
+
+
+def criar_esquema_geocodificacao(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS geocodificacao_cache
+                 (direcao TEXT NOT NULL, -- 'direta' (endereço) ou 'reversa' (coordenada)
+                  chave TEXT NOT NULL, -- endereço normalizado ou "lat,lng" arredondados
+                  latitude REAL,
+                  longitude REAL,
+                  endereco TEXT,
+                  fonte TEXT, -- backend que respondeu; NULL se nenhum encontrou
+                  criado_em REAL NOT NULL,
+                  PRIMARY KEY (direcao, chave))''')
+
+
+def normalizar_endereco(endereco):
+    """Minúsculas, sem acentos, com pontuação e espaços repetidos reduzidos a um espaço."""
+    texto = unicodedata.normalize('NFKD', endereco or '')
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch)).lower()
+    return re.sub(r'[\W_]+', ' ', texto).strip()
+
+
+def chave_coordenada(lat, lng):
+    casas = GEOCODIFICACAO_CASAS_DECIMAIS
+    return f'{round(float(lat), casas):.{casas}f},{round(float(lng), casas):.{casas}f}'
+
+
+@registrar_backend('local')
+class GazetteerLocal:
+    """Pontos conhecidos (banco + CSV opcional). Recarregado quando as coordenadas do banco mudam."""
+
+    _lock = threading.Lock()
+    _versao = None
+    _por_nome = {}
+    _nomes = []
+    _lats = np.empty(0)
+    _lngs = np.empty(0)
+
+    def _carregar(self, c):
+        versao = versao_coordenadas(c)
+        with self._lock:
+            if versao == GazetteerLocal._versao:
+                return
+            entradas = []
+            if os.path.exists(GEOCODIFICACAO_GAZETTEER):
+                with open(GEOCODIFICACAO_GAZETTEER, newline='', encoding='utf-8-sig') as arquivo:
+                    for linha in csv.DictReader(arquivo, delimiter=';'):
+                        try:
+                            entradas.append((linha['nome'], float(linha['latitude']), float(linha['longitude'])))
+                        except (KeyError, TypeError, ValueError):
+                            continue
+            c.execute('''SELECT local, AVG(latitude), AVG(longitude) FROM manutencoes
+                         WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND local IS NOT NULL AND local != ''
+                         GROUP BY local''')
+            entradas.extend(tuple(row) for row in c.fetchall())
+            c.execute('''SELECT nome, endereco, cidade, estado, latitude, longitude FROM mapa_locais''')
+            for row in c.fetchall():
+                for nome in (row['endereco'], row['nome']):
+                    if nome:
+                        entradas.append((nome, row['latitude'], row['longitude']))
+                if row['cidade'] and row['estado']:
+                    entradas.append((f"{row['cidade']} - {row['estado']}", row['latitude'], row['longitude']))
+
+            por_nome = {}
+            for nome, lat, lng in entradas:
+                por_nome.setdefault(normalizar_endereco(nome), (float(lat), float(lng), nome))
+            GazetteerLocal._por_nome = por_nome
+            GazetteerLocal._nomes = [nome for _, _, nome in por_nome.values()]
+            GazetteerLocal._lats = np.array([lat for lat, _, _ in por_nome.values()], dtype=float)
+            GazetteerLocal._lngs = np.array([lng for _, lng, _ in por_nome.values()], dtype=float)
+            GazetteerLocal._versao = versao
+            logger.info(f"Gazetteer local carregado: {len(por_nome)} nomes")
+
+    def geocodificar(self, c, endereco):
+        self._carregar(c)
+        return self._por_nome.get(normalizar_endereco(endereco))
+
+    def geocodificar_reverso(self, c, lat, lng):
+        self._carregar(c)
+        if not len(self._lats):
+            return None
+        distancias = distancias_km(lat, lng, self._lats, self._lngs)
+        i = int(np.argmin(distancias))
+        return self._nomes[i] if distancias[i] <= GEOCODIFICACAO_RAIO_REVERSO_KM else None
+
+
+@registrar_backend('nominatim')
+class Nominatim:
+    """API pública do Nominatim, limitada a 1 requisição por segundo por processo."""
+
+    _lock = threading.Lock()
+    _ultima = 0.0
+
+    def _consultar(self, caminho, parametros):
+        parametros = dict(parametros, format='json', **{'accept-language': 'pt-BR'})
+        with self._lock:
+            espera = 1.0 - (time.monotonic() - Nominatim._ultima)
+            if espera > 0:
+                time.sleep(espera)
+            try:
+                requisicao = Request(f'{NOMINATIM_URL}/{caminho}?{urlencode(parametros)}',
+                                     headers={'User-Agent': NOMINATIM_USER_AGENT})
+                with urlopen(requisicao, timeout=10) as resposta:
+                    return json.load(resposta)
+            finally:
+                Nominatim._ultima = time.monotonic()
+
+    def geocodificar(self, c, endereco):
+        dados = self._consultar('search', {'q': endereco, 'limit': 1})
+        if not dados:
+            return None
+        return float(dados[0]['lat']), float(dados[0]['lon']), dados[0].get('display_name') or endereco
+
+    def geocodificar_reverso(self, c, lat, lng):
+        dados = self._consultar('reverse', {'lat': lat, 'lon': lng})
+        return (dados or {}).get('display_name')
+
+
+_instancias = {}
+
+
+def _backends_configurados():
+    for nome in GEOCODIFICACAO_BACKENDS:
+        if nome not in _backends:
+            logger.warning(f"Backend de geocodificação desconhecido: {nome}")
+            continue
+        if nome not in _instancias:
+            _instancias[nome] = _backends[nome]()
+        yield _instancias[nome]
+
+
+def _consultar_backends(c, direcao, *args):
+    """Primeiro resultado dos backends, como (resultado, fonte). Lança a última falha se nenhum respondeu."""
+    falha = None
+    respondeu = False
+    for backend in _backends_configurados():
+        try:
+            if direcao == DIRETA:
+                resultado = backend.geocodificar(c, *args)
+            else:
+                resultado = backend.geocodificar_reverso(c, *args)
+        except Exception as e:
+            logger.warning(f"Falha no backend de geocodificação '{backend.nome}': {str(e)}")
+            falha = e
+            continue
+        respondeu = True
+        if resultado:
+            return resultado, backend.nome
+    if not respondeu and falha is not None:
+        raise falha
+    return None, None
+
+
+def _ler_cache(c, direcao, chaves):
+    """{chave: row} das entradas válidas do cache (as negativas expiram após GEOCODIFICACAO_RETENTAR_DIAS)."""
+    encontrados = {}
+    chaves = list(chaves)
+    limite_negativas = time.time() - GEOCODIFICACAO_RETENTAR_DIAS * 86400
+    for i in range(0, len(chaves), 500):
+        parte = chaves[i:i + 500]
+        c.execute(f'''SELECT chave, latitude, longitude, endereco, fonte FROM geocodificacao_cache
+                      WHERE direcao = ? AND chave IN ({','.join('?' for _ in parte)})
+                        AND (fonte IS NOT NULL OR criado_em >= ?)''', [direcao, *parte, limite_negativas])
+        encontrados.update((row['chave'], row) for row in c.fetchall())
+    return encontrados
+
+
+def _gravar_cache(c, direcao, registros):
+    c.executemany('''INSERT OR REPLACE INTO geocodificacao_cache
+                     (direcao, chave, latitude, longitude, endereco, fonte, criado_em)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  [(direcao, chave, lat, lng, endereco, fonte, time.time())
+                   for chave, (lat, lng, endereco, fonte) in registros.items()])
+
+
+def _resultado(row_ou_tupla, em_cache):
+    lat, lng, endereco, fonte = row_ou_tupla
+    if fonte is None:
+        return None
+    return {'latitude': lat, 'longitude': lng, 'endereco': endereco, 'fonte': fonte, 'cache': em_cache}
+
+
+def geocodificar_lote(c, enderecos):
+    """
+    Geocodifica vários endereços, consultando os backends apenas uma vez por endereço
+    normalizado ainda fora do cache. Retorna {endereço original: resultado ou None}.
+    A transação fica a cargo de quem chama (conn.commit()).
+    """
+    por_chave = {}
+    for endereco in enderecos:
+        chave = normalizar_endereco(endereco)
+        if chave:
+            por_chave.setdefault(chave, []).append(endereco)
+
+    em_cache = _ler_cache(c, DIRETA, por_chave)
+    novos = {}
+    for chave, originais in por_chave.items():
+        if chave in em_cache:
+            continue
+        resultado, fonte = _consultar_backends(c, DIRETA, originais[0])
+        if resultado:
+            lat, lng, endereco_formatado = resultado
+            novos[chave] = (lat, lng, endereco_formatado, fonte)
+        else:
+            novos[chave] = (None, None, None, None)
+    if novos:
+        _gravar_cache(c, DIRETA, novos)
+
+    resultados = {}
+    for chave, originais in por_chave.items():
+        if chave in em_cache:
+            row = em_cache[chave]
+            resultado = _resultado((row['latitude'], row['longitude'], row['endereco'], row['fonte']), True)
+        else:
+            resultado = _resultado(novos[chave], False)
+        for endereco in originais:
+            resultados[endereco] = resultado
+    for endereco in enderecos:
+        resultados.setdefault(endereco, None)
+    return resultados
+
+
+def geocodificar(c, endereco):
+    """Coordenadas do endereço: {latitude, longitude, endereco, fonte, cache} ou None."""
+    return geocodificar_lote(c, [endereco])[endereco]
+
+
+def geocodificar_reverso(c, lat, lng):
+    """Endereço da coordenada: {latitude, longitude, endereco, fonte, cache} ou None."""
+    chave = chave_coordenada(lat, lng)
+    em_cache = _ler_cache(c, REVERSA, [chave])
+    if chave in em_cache:
+        row = em_cache[chave]
+        return _resultado((row['latitude'], row['longitude'], row['endereco'], row['fonte']), True)
+    endereco, fonte = _consultar_backends(c, REVERSA, lat, lng)
+    registro = (lat, lng, endereco, fonte) if endereco else (lat, lng, None, None)
+    _gravar_cache(c, REVERSA, {chave: registro})
+    return _resultado(registro, False)
+
+
+def preencher_coordenadas_manutencoes(conn, ao_progredir=None):
+    """
+    Preenche latitude/longitude das manutenções sem coordenadas, geocodificando cada `local`
+    distinto uma única vez. Grava (e faz commit) a cada PREENCHIMENTO_LOTE locais.
+    `ao_progredir(locais_processados, total_locais)` é chamado após cada lote.
+    Retorna {'locais': total de locais, 'geocodificados': locais encontrados, 'manutencoes': linhas atualizadas}.
+    """
+    c = conn.cursor()
+    c.execute('''SELECT DISTINCT local FROM manutencoes
+                 WHERE (latitude IS NULL OR longitude IS NULL) AND local IS NOT NULL AND local != '' ''')
+    locais = [row[0] for row in c.fetchall()]
+    c.execute('CREATE TEMP TABLE IF NOT EXISTS geocodificacao_lote (local TEXT PRIMARY KEY, latitude REAL, longitude REAL)')
+
+    geocodificados = atualizadas = 0
+    try:
+        for i in range(0, len(locais), PREENCHIMENTO_LOTE):
+            lote = locais[i:i + PREENCHIMENTO_LOTE]
+            resultados = geocodificar_lote(c, lote)
+            encontrados = [(local, r['latitude'], r['longitude']) for local, r in resultados.items() if r]
+            c.execute('DELETE FROM geocodificacao_lote')
+            c.executemany('INSERT INTO geocodificacao_lote VALUES (?, ?, ?)', encontrados)
+            # Uma única passada na tabela por lote, em vez de um UPDATE por local
+            c.execute('''UPDATE manutencoes SET latitude = g.latitude, longitude = g.longitude
+                         FROM geocodificacao_lote g
+                         WHERE manutencoes.local = g.local
+                           AND (manutencoes.latitude IS NULL OR manutencoes.longitude IS NULL)''')
+            atualizadas += c.rowcount
+            geocodificados += len(encontrados)
+            conn.commit()
+            if ao_progredir:
+                ao_progredir(i + len(lote), len(locais))
+    finally:
+        c.execute('DROP TABLE IF EXISTS temp.geocodificacao_lote')
+        c.close()
+    logger.info(f"Coordenadas preenchidas: {atualizadas} manutenções, {geocodificados} de {len(locais)} locais")
+    return {'locais': len(locais), 'geocodificados': geocodificados, 'manutencoes': atualizadas}
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = pool.obter()
+    try:
+        criar_esquema_geocodificacao(conn.cursor())
+        conn.commit()
+        if '--preencher' in sys.argv:
+            resumo = preencher_coordenadas_manutencoes(
+                conn, lambda feitos, total: logger.info(f"{feitos}/{total} locais processados"))
+            logger.info(json.dumps(resumo, ensure_ascii=False))
+        else:
+            print(__doc__)
+    finally:
+        conn.close()
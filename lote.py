@@ -0,0 +1,212 @@
+"""
+Operações em lote (criar, atualizar e excluir) sobre uma tabela, em uma única transação.
+
+Cada operação é validada antes de tocar no banco; as válidas são executadas em ordem,
+agrupando operações consecutivas do mesmo tipo em um único executemany. Se um grupo
+falhar no banco, ele é desfeito (SAVEPOINT), junto com os anexos que gravou em disco, e
+refeito item a item para identificar quais operações falharam. O resultado traz o status de cada operação, na ordem recebida.
+
+Modos:
+- 'tudo_ou_nada': qualquer falha desfaz o lote inteiro;
+- 'melhor_esforco': as operações válidas são gravadas e as demais apenas relatadas.
+
+Configuração por variável de ambiente:
+    LOTE_MAXIMO_OPERACOES   operações aceitas por requisição (padrão: 1000)
+"""
+import logging
+import os
+import sqlite3
+
+from armazenamento import ArquivosNovos
+
+logger = logging.getLogger(__name__)
+
+LOTE_MAXIMO_OPERACOES = int(os.environ.get('LOTE_MAXIMO_OPERACOES', 1000))
+MODOS = ('tudo_ou_nada', 'melhor_esforco')
+OPERACOES = ('criar', 'atualizar', 'excluir')
+# Máximo de parâmetros por IN (...) na verificação dos ids
+_LIMITE_IN = 500
+
+
+class ErroOperacao(Exception):
+    """Falha de uma operação do lote, com o status HTTP correspondente."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class TabelaLote:
+    """
+    Descrição de uma tabela para as operações em lote.
+    - colunas: colunas gravadas ao criar/atualizar, na ordem dos valores de `validar`;
+    - validar(dados): valores das colunas; lança ValueError com a mensagem de erro;
+    - apos_gravar(c, operacao, itens): chamado após cada grupo criado/atualizado, com a
+      lista de (id, dados) dos itens, para gravar dados relacionados (anexos, serviços...).
+    """
+
+    def __init__(self, tabela, colunas, validar, apos_gravar=None):
+        self.tabela = tabela
+        self.colunas = colunas
+        self.validar = validar
+        self.apos_gravar = apos_gravar
+
+    def sql(self, operacao):
+        if operacao == 'criar':
+            return (f"INSERT INTO {self.tabela} ({', '.join(self.colunas)}) "
+                    f"VALUES ({', '.join('?' for _ in self.colunas)})")
+        if operacao == 'atualizar':
+            return f"UPDATE {self.tabela} SET {', '.join(f'{col} = ?' for col in self.colunas)} WHERE id = ?"
+        return f'DELETE FROM {self.tabela} WHERE id = ?'
+
+
+def _preparar(tabela, indice, entrada):
+    """Valida uma operação. Retorna (resultado, operação preparada ou None se inválida)."""
+    resultado = {'indice': indice}
+    try:
+        if not isinstance(entrada, dict):
+            raise ValueError('Operação deve ser um objeto')
+        operacao = entrada.get('op')
+        resultado['op'] = operacao
+        if operacao not in OPERACOES:
+            raise ValueError(f'Operação inválida. Use: {", ".join(OPERACOES)}')
+        id = entrada.get('id')
+        if operacao != 'criar':
+            if not isinstance(id, int) or isinstance(id, bool):
+                raise ValueError('Campo id (inteiro) é obrigatório para atualizar e excluir')
+            resultado['id'] = id
+        dados = entrada.get('dados') or {}
+        valores = ()
+        if operacao != 'excluir':
+            if not isinstance(dados, dict):
+                raise ValueError('Campo dados deve ser um objeto')
+            valores = tuple(tabela.validar(dados))
+    except ValueError as e:
+        resultado.update(status=400, error=str(e))
+        return resultado, None
+    return resultado, {'op': operacao, 'id': id, 'dados': dados, 'valores': valores, 'resultado': resultado}
+
+
+def _ids_existentes(c, tabela, ids):
+    ids = list(ids)
+    existentes = set()
+    for i in range(0, len(ids), _LIMITE_IN):
+        parte = ids[i:i + _LIMITE_IN]
+        c.execute(f"SELECT id FROM {tabela} WHERE id IN ({','.join('?' for _ in parte)})", parte)
+        existentes.update(row[0] for row in c.fetchall())
+    return existentes
+
+
+def _grupos(preparadas):
+    """Operações consecutivas do mesmo tipo, mantendo a ordem do lote."""
+    grupo = []
+    for item in preparadas:
+        if grupo and grupo[-1]['op'] != item['op']:
+            yield grupo
+            grupo = []
+        grupo.append(item)
+    if grupo:
+        yield grupo
+
+
+def _gravar(c, tabela, operacao, itens):
+    """Executa o grupo com executemany. Preenche o id dos itens criados."""
+    sql = tabela.sql(operacao)
+    if operacao == 'criar':
+        c.executemany(sql, [item['valores'] for item in itens])
+        # Sob o lock de escrita da transação, os ids de um executemany são consecutivos
+        ultimo = c.execute('SELECT last_insert_rowid()').fetchone()[0]
+        for deslocamento, item in enumerate(itens):
+            item['id'] = ultimo - len(itens) + 1 + deslocamento
+    elif operacao == 'atualizar':
+        c.executemany(sql, [(*item['valores'], item['id']) for item in itens])
+    else:
+        c.executemany(sql, [(item['id'],) for item in itens])
+    if operacao != 'excluir' and tabela.apos_gravar:
+        tabela.apos_gravar(c, operacao, [(item['id'], item['dados']) for item in itens])
+
+
+def _executar_grupo(c, tabela, operacao, itens):
+    c.execute('SAVEPOINT lote_grupo')
+    try:
+        with ArquivosNovos():  # Se o grupo falhar, os anexos gravados por ele são apagados antes do ROLLBACK TO
+            _gravar(c, tabela, operacao, itens)
+        c.execute('RELEASE lote_grupo')
+        return
+    except Exception as e:
+        c.execute('ROLLBACK TO lote_grupo')
+        c.execute('RELEASE lote_grupo')
+        if len(itens) == 1:
+            raise ErroOperacao(str(e), 400 if isinstance(e, (sqlite3.IntegrityError, ValueError)) else 500)
+        logger.warning(f"Grupo de {len(itens)} operações '{operacao}' falhou ({str(e)}); refazendo item a item")
+    for item in itens:
+        try:
+            _executar_grupo(c, tabela, operacao, [item])
+        except ErroOperacao as e:
+            item['resultado'].update(status=e.status, error=str(e))
+
+
+def executar_lote(conn, tabela, operacoes, modo='tudo_ou_nada'):
+    """
+    Executa as operações (lista de {"op", "id", "dados"}) em uma transação. Retorna
+    {'modo', 'aplicado', 'sucessos', 'falhas', 'resultados'}; cada resultado traz 'indice',
+    'op', 'id' e 'status' (200, 201, 400, 404 ou 500), com 'error' nas falhas.
+    """
+    resultados = []
+    preparadas = []
+    for indice, entrada in enumerate(operacoes):
+        resultado, preparada = _preparar(tabela, indice, entrada)
+        resultados.append(resultado)
+        if preparada:
+            preparadas.append(preparada)
+
+    c = conn.cursor()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Ids que existem ao longo do lote: uma exclusão invalida operações seguintes no mesmo id
+        existentes = _ids_existentes(c, tabela.tabela, {item['id'] for item in preparadas if item['op'] != 'criar'})
+        validas = []
+        for item in preparadas:
+            if item['op'] != 'criar':
+                if item['id'] not in existentes:
+                    item['resultado'].update(status=404, error='Registro não encontrado')
+                    continue
+                if item['op'] == 'excluir':
+                    existentes.discard(item['id'])
+            validas.append(item)
+
+        with ArquivosNovos() as arquivos:  # Anexos gravados em disco, apagados se o lote for desfeito
+            for grupo in _grupos(validas):
+                try:
+                    _executar_grupo(c, tabela, grupo[0]['op'], grupo)
+                except ErroOperacao as e:  # Grupo de uma única operação
+                    grupo[0]['resultado'].update(status=e.status, error=str(e))
+
+            for item in validas:
+                if 'status' not in item['resultado']:
+                    item['resultado'].update(id=item['id'], status=201 if item['op'] == 'criar' else 200)
+            falhas = sum(1 for resultado in resultados if resultado['status'] >= 400)
+            aplicado = not (falhas and modo == 'tudo_ou_nada')
+            if aplicado:
+                conn.commit()
+            else:
+                arquivos.descartar()
+                conn.rollback()
+                for item in validas:
+                    if item['op'] == 'criar':
+                        item['resultado'].pop('id', None)  # Ids desfeitos junto com o lote
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+
+    logger.info(f"Lote em '{tabela.tabela}': {len(resultados) - falhas} sucessos, {falhas} falhas "
+                f"(modo {modo}, {'aplicado' if aplicado else 'desfeito'})")
+    return {
+        'modo': modo,
+        'aplicado': aplicado,
+        'sucessos': len(resultados) - falhas,
+        'falhas': falhas,
+        'resultados': resultados,
+    }
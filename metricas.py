@@ -0,0 +1,345 @@
+"""
+Métricas de desempenho por requisição, expostas no formato texto do Prometheus em GET /metrics.
+
+Para cada requisição (rotulada pela regra da rota, ex.: /api/manutencoes/<int:id>, e pelo método)
+são registrados: latência até o último byte da resposta, tamanho da resposta em bytes, número de
+consultas SQL, tempo gasto no SQLite e linhas lidas. As consultas são medidas pelo observador dos
+cursores do pool (ver banco.py) e acumuladas num estado por thread, sem custo extra quando a
+coleta está desligada.
+
+Consultas e requisições acima dos limites configurados são registradas no log como lentas.
+Cada processo (worker do gunicorn) mantém suas próprias métricas: o Prometheus deve coletar
+cada worker ou o app deve rodar com um único worker por instância.
+
+Configuração por variáveis de ambiente:
+    METRICAS_ATIVAS         1 para coletar e expor /metrics, 0 para desligar (padrão: 1)
+    SQL_LENTA_MS            consulta registrada como lenta a partir de (padrão: 200)
+    REQUISICAO_LENTA_MS     requisição registrada como lenta a partir de (padrão: 1000)
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+
+from flask import request, Response
+
+from banco import definir_observador
+
+logger = logging.getLogger(__name__)
+
+METRICAS_ATIVAS = os.environ.get('METRICAS_ATIVAS', '1') != '0'
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', 200))
+REQUISICAO_LENTA_MS = float(os.environ.get('REQUISICAO_LENTA_MS', 1000))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+BUCKETS_LINHAS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_OPERACOES_SQL = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'BEGIN', 'COMMIT', 'ROLLBACK',
+                  'SAVEPOINT', 'RELEASE', 'PRAGMA', 'CREATE', 'DROP', 'ALTER', 'REPLACE', 'ANALYZE', 'VACUUM'}
+_SQL_LOG_MAXIMO = 500
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra=''):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador (ou gauge, com diminuir()) com rótulos; os valores ficam num dicionário por combinação."""
+
+    def __init__(self, nome, ajuda, rotulos=(), tipo='counter'):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.tipo = tipo
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def somar(self, valor=1, *rotulos):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def diminuir(self, valor=1, *rotulos):
+        self.somar(-valor, *rotulos)
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for rotulos, valor in valores:
+            linhas.append(f'{self.nome}{_rotulos(self.rotulos, rotulos)} {_numero(valor)}')
+        return linhas
+
+
+class Histograma:
+    """Histograma com buckets fixos; guarda as contagens por bucket e as acumula só na exportação."""
+
+    def __init__(self, nome, ajuda, rotulos, buckets):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        with self._lock:
+            series = sorted((rotulos, (list(contagens), soma, total))
+                            for rotulos, (contagens, soma, total) in self._series.items())
+        for rotulos, (contagens, soma, total) in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                le = f'le="{_numero(limite)}"'
+                linhas.append(f'{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}')
+            linhas.append(f'{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {_numero(soma)}')
+            linhas.append(f'{self.nome}_count{_rotulos(self.rotulos, rotulos)} {total}')
+        return linhas
+
+
+class ContadoresSQL:
+    """
+    Totais globais das consultas SQL. O observador roda a cada execute e fetch, por isso
+    todos os totais são atualizados de uma vez, sob um único lock.
+    """
+
+    def __init__(self):
+        self._por_operacao = {}  # operacao -> [consultas, segundos]
+        self._linhas = 0
+        self._lentas = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, operacao, duracao, linhas, nova_consulta, lenta):
+        with self._lock:
+            totais = self._por_operacao.get(operacao)
+            if totais is None:
+                totais = self._por_operacao[operacao] = [0, 0.0]
+            totais[0] += nova_consulta
+            totais[1] += duracao
+            self._linhas += linhas
+            self._lentas += lenta
+
+    def exportar(self):
+        with self._lock:
+            por_operacao = sorted((operacao, tuple(totais)) for operacao, totais in self._por_operacao.items())
+            linhas, lentas = self._linhas, self._lentas
+        saida = ['# HELP sql_consultas_total Consultas SQL executadas, por operação.',
+                 '# TYPE sql_consultas_total counter']
+        saida.extend(f'sql_consultas_total{{operacao="{operacao}"}} {consultas}'
+                     for operacao, (consultas, _) in por_operacao)
+        saida += ['# HELP sql_duracao_segundos_total Tempo gasto no SQLite (execução e leitura), por operação.',
+                  '# TYPE sql_duracao_segundos_total counter']
+        saida.extend(f'sql_duracao_segundos_total{{operacao="{operacao}"}} {_numero(segundos)}'
+                     for operacao, (_, segundos) in por_operacao)
+        saida += ['# HELP sql_linhas_lidas_total Linhas lidas do SQLite.',
+                  '# TYPE sql_linhas_lidas_total counter',
+                  f'sql_linhas_lidas_total {linhas}',
+                  f'# HELP sql_consultas_lentas_total Execuções ou leituras acima de SQL_LENTA_MS ({SQL_LENTA_MS:g} ms).',
+                  '# TYPE sql_consultas_lentas_total counter',
+                  f'sql_consultas_lentas_total {lentas}']
+        return saida
+
+
+_ROTULOS_HTTP = ('metodo', 'rota')
+
+REQUISICOES = Contador('http_requisicoes_total', 'Requisições atendidas.', ('metodo', 'rota', 'status'))
+EM_ANDAMENTO = Contador('http_requisicoes_em_andamento', 'Requisições em andamento.', tipo='gauge')
+DURACAO = Histograma('http_requisicao_duracao_segundos', 'Latência da requisição até o último byte da resposta.',
+                     _ROTULOS_HTTP, BUCKETS_SEGUNDOS)
+TAMANHO = Histograma('http_resposta_bytes', 'Tamanho do corpo da resposta, após a compressão.',
+                     _ROTULOS_HTTP, BUCKETS_BYTES)
+CONSULTAS_REQUISICAO = Histograma('http_requisicao_sql_consultas', 'Consultas SQL executadas por requisição.',
+                                  _ROTULOS_HTTP, BUCKETS_CONSULTAS)
+SQL_REQUISICAO = Histograma('http_requisicao_sql_duracao_segundos', 'Tempo gasto no SQLite por requisição.',
+                            _ROTULOS_HTTP, BUCKETS_SEGUNDOS)
+LINHAS_REQUISICAO = Histograma('http_requisicao_sql_linhas', 'Linhas lidas do SQLite por requisição.',
+                               _ROTULOS_HTTP, BUCKETS_LINHAS)
+SQL = ContadoresSQL()
+
+METRICAS = (REQUISICOES, EM_ANDAMENTO, DURACAO, TAMANHO, CONSULTAS_REQUISICAO, SQL_REQUISICAO, LINHAS_REQUISICAO,
+            SQL)
+
+# Medição da requisição em curso na thread (None fora de requisições, ex.: tarefas em segundo plano)
+_local = threading.local()
+
+
+class Medicao:
+    """Totais de uma requisição: consultas, tempo no SQLite, linhas lidas e bytes enviados."""
+
+    __slots__ = ('inicio', 'requisicao', 'metodo', 'rota', 'status', 'consultas', 'sql', 'linhas', 'bytes')
+
+    def __init__(self, metodo, caminho):
+        self.inicio = time.perf_counter()
+        self.requisicao = f'{metodo} {caminho}'
+        self.metodo = metodo
+        self.rota = 'nao_encontrada'
+        self.status = ''
+        self.consultas = 0
+        self.sql = 0.0
+        self.linhas = 0
+        self.bytes = 0
+
+
+# Operação (primeira palavra) de cada texto SQL já visto; as consultas do app são textos fixos
+_operacoes = {}
+_OPERACOES_MAXIMO = 4096
+
+
+def _operacao(sql):
+    operacao = _operacoes.get(sql)
+    if operacao is None:
+        partes = sql.lstrip().split(None, 1)
+        operacao = partes[0].upper() if partes else ''
+        if operacao not in _OPERACOES_SQL:
+            operacao = 'OUTRA'
+        if len(_operacoes) < _OPERACOES_MAXIMO:
+            _operacoes[sql] = operacao
+    return operacao
+
+
+def observar_sql(sql, duracao, linhas, nova_consulta):
+    """Observador instalado em banco.py: acumula a consulta nas métricas globais e na requisição atual."""
+    lenta = duracao * 1000 >= SQL_LENTA_MS
+    SQL.registrar(_operacao(sql), duracao, linhas, nova_consulta, lenta)
+    medicao = getattr(_local, 'medicao', None)
+    if medicao is not None:
+        medicao.consultas += nova_consulta
+        medicao.sql += duracao
+        medicao.linhas += linhas
+    if lenta:
+        contexto = f" em {medicao.requisicao}" if medicao is not None else ''
+        fase = 'execução' if nova_consulta else f'leitura de {linhas} linhas'
+        logger.warning(f"Consulta lenta ({fase}, {duracao * 1000:.1f} ms){contexto}: "
+                       f"{' '.join(sql.split())[:_SQL_LOG_MAXIMO]}")
+
+
+class CorpoMedido:
+    """
+    Repassa o corpo da resposta ao servidor contando os bytes enviados. As métricas da requisição
+    são registradas no close(), chamado pelo servidor WSGI ao fim do envio: respostas em fluxo
+    contam a latência e as consultas feitas durante a geração do corpo.
+    """
+
+    def __init__(self, corpo, medicao):
+        self.corpo = corpo
+        self.medicao = medicao
+
+    def __iter__(self):
+        medicao = self.medicao
+        for parte in self.corpo:
+            medicao.bytes += len(parte)
+            yield parte
+
+    def close(self):
+        try:
+            if hasattr(self.corpo, 'close'):
+                self.corpo.close()
+        finally:
+            finalizar_medicao(self.medicao)
+
+
+def finalizar_medicao(medicao):
+    if getattr(_local, 'medicao', None) is medicao:
+        _local.medicao = None
+    EM_ANDAMENTO.diminuir()
+    if medicao.rota == '/metrics':
+        return
+    duracao = time.perf_counter() - medicao.inicio
+    rotulos = (medicao.metodo, medicao.rota)
+    REQUISICOES.somar(1, *rotulos, medicao.status)
+    DURACAO.observar(duracao, *rotulos)
+    TAMANHO.observar(medicao.bytes, *rotulos)
+    CONSULTAS_REQUISICAO.observar(medicao.consultas, *rotulos)
+    SQL_REQUISICAO.observar(medicao.sql, *rotulos)
+    LINHAS_REQUISICAO.observar(medicao.linhas, *rotulos)
+    if duracao * 1000 >= REQUISICAO_LENTA_MS:
+        logger.warning(f"Requisição lenta: {medicao.requisicao} -> {medicao.status} em {duracao * 1000:.0f} ms "
+                       f"({medicao.consultas} consultas SQL, {medicao.sql * 1000:.0f} ms no SQLite, "
+                       f"{medicao.linhas} linhas, {medicao.bytes} bytes)")
+
+
+class MedidorWSGI:
+    """
+    Middleware WSGI que mede cada requisição. Fica por fora do Flask para ver o corpo final
+    (já comprimido e codificado) e o fim do envio, inclusive em send_file, cujo corpo o
+    werkzeug entrega ao servidor sem passar pelos callbacks de call_on_close.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        medicao = Medicao(environ.get('REQUEST_METHOD', ''), environ.get('PATH_INFO', ''))
+        _local.medicao = medicao
+        EM_ANDAMENTO.somar()
+
+        def iniciar_resposta(status, cabecalhos, *args):
+            medicao.status = status.split(' ', 1)[0]
+            return start_response(status, cabecalhos, *args)
+
+        try:
+            corpo = self.wsgi_app(environ, iniciar_resposta)
+        except BaseException:
+            medicao.status = medicao.status or '500'
+            finalizar_medicao(medicao)
+            raise
+        return CorpoMedido(corpo, medicao)
+
+
+def registrar_rota():
+    """before_request: rotula a medição com a regra da rota (evita uma série por id na URL)."""
+    medicao = getattr(_local, 'medicao', None)
+    if medicao is not None and request.url_rule is not None:
+        medicao.rota = request.url_rule.rule
+
+
+def exportar_metricas():
+    linhas = []
+    for metrica in METRICAS:
+        linhas.extend(metrica.exportar())
+    return '\n'.join(linhas) + '\n'
+
+
+def configurar_metricas(app):
+    """Instala a coleta de métricas (observador do pool e middleware WSGI) e a rota GET /metrics."""
+    if not METRICAS_ATIVAS:
+        logger.info("Métricas desligadas (METRICAS_ATIVAS=0)")
+        return
+    definir_observador(observar_sql)
+    app.wsgi_app = MedidorWSGI(app.wsgi_app)
+    app.before_request(registrar_rota)
+
+    @app.route('/metrics', methods=['GET'])
+    def metricas():
+        return Response(exportar_metricas(), content_type=CONTENT_TYPE)
+
+    logger.info(f"Métricas em /metrics; consultas lentas a partir de {SQL_LENTA_MS:g} ms, "
+                f"requisições lentas a partir de {REQUISICAO_LENTA_MS:g} ms")
@@ -1,5 +1,11 @@
 import sqlite3
 import logging
+import os
+
+from armazenamento import criar_esquema_arquivos, decodificar_data_url, gravar_arquivo
+
+# Quantidade de anexos lidos do banco por lote na migração para o armazenamento em disco
+LOTE_MIGRACAO_ANEXOS = int(os.environ.get('LOTE_MIGRACAO_ANEXOS', 100))
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -65,11 +71,17 @@ def migrar_banco_de_dados():
                           manutencao_id INTEGER NOT NULL,
                           nome_arquivo TEXT NOT NULL,
                           tipo_arquivo TEXT NOT NULL,
-                          dados_arquivo TEXT NOT NULL,
+                          dados_arquivo TEXT,
+                          hash TEXT,
+                          tamanho INTEGER,
                           FOREIGN KEY (manutencao_id) REFERENCES manutencoes (id) ON DELETE CASCADE
                          )''')
             logging.info("Tabela 'anexos' criada/recriada com sucesso.")
 
+        # 2. Garantir as colunas, a tabela de referências e os triggers do armazenamento em disco.
+        criar_esquema_arquivos(c)
+        conn.commit()
+
         # 3. Verificar se a coluna 'anexo_nota' existe na tabela 'manutencoes'.
         c.execute("PRAGMA table_info(manutencoes)")
         columns = [column['name'] for column in c.fetchall()]
@@ -116,5 +128,61 @@ def migrar_banco_de_dados():
         if conn:
             conn.close()
 
+def migrar_anexos_para_armazenamento():
+    """
+    Move o conteúdo dos anexos em Base64 (coluna 'dados_arquivo') para o armazenamento
+    em disco endereçado por hash (ver armazenamento.py).
+
+    Os anexos são lidos em lotes de LOTE_MIGRACAO_ANEXOS linhas, paginando por id, e cada
+    lote é confirmado separadamente. Assim a memória usada não depende do tamanho da
+    tabela e a migração pode ser interrompida e executada novamente do ponto onde parou.
+    """
+    logging.info("Iniciando migração dos anexos para o armazenamento em disco...")
+    conn = None
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        criar_esquema_arquivos(c)
+        conn.commit()
+
+        ultimo_id = 0
+        migrados = 0
+        falhas = 0
+        while True:
+            c.execute('''SELECT id, dados_arquivo FROM anexos
+                         WHERE hash IS NULL AND id > ?
+                         ORDER BY id LIMIT ?''', (ultimo_id, LOTE_MIGRACAO_ANEXOS))
+            lote = c.fetchall()
+            if not lote:
+                break
+
+            atualizacoes = []
+            for anexo in lote:
+                try:
+                    hash_arquivo, tamanho = gravar_arquivo(decodificar_data_url(anexo['dados_arquivo']))
+                    atualizacoes.append((hash_arquivo, tamanho, anexo['id']))
+                except Exception as e:
+                    falhas += 1
+                    logging.warning(f"Não foi possível migrar o anexo {anexo['id']}: {e}")
+            ultimo_id = lote[-1]['id']
+            del lote
+
+            # O trigger de UPDATE OF hash incrementa as referências em 'arquivos'
+            c.executemany("UPDATE anexos SET hash = ?, tamanho = ?, dados_arquivo = '' WHERE id = ?", atualizacoes)
+            conn.commit()
+            migrados += len(atualizacoes)
+            logging.info(f"{migrados} anexos migrados até o id {ultimo_id}...")
+
+        logging.info(f"Migração dos anexos concluída: {migrados} migrados, {falhas} com falha.")
+        if migrados:
+            logging.info("Executando VACUUM para liberar o espaço ocupado pelo Base64...")
+            conn.execute('VACUUM')
+    except Exception as e:
+        logging.error(f"Ocorreu um erro inesperado durante a migração dos anexos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
 if __name__ == '__main__':
-    migrar_banco_de_dados()
\ No newline at end of file
+    migrar_banco_de_dados()
+    migrar_anexos_para_armazenamento()
\ No newline at end of file
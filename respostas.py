@@ -0,0 +1,192 @@
+"""
+Serialização e compressão das respostas JSON da API.
+
+- JSON: com o pacote orjson instalado, jsonify (e todo o app.json) passa a serializar com ele;
+  sem o pacote, continua com o módulo json da biblioteca padrão. Nos dois casos as chaves saem
+  ordenadas, como no provider padrão do Flask. Floats não finitos (NaN, Infinity) saem como
+  null, e não como os literais NaN/Infinity do módulo json, que não são JSON válido.
+- Compressão: respostas JSON/NDJSON a partir de COMPRESSAO_MIN_BYTES são comprimidas com
+  brotli (se o pacote brotli estiver instalado) ou gzip, conforme o Accept-Encoding do
+  cliente. Respostas em fluxo são comprimidas bloco a bloco, sem esperar o fim.
+- Arrays grandes: resposta_json_em_fluxo() envia um array JSON em blocos, a partir de lotes
+  de itens lidos do banco, sem montar a string inteira em memória.
+
+Configuração por variáveis de ambiente:
+    COMPRESSAO_MIN_BYTES     tamanho mínimo de uma resposta para ser comprimida (padrão: 1024)
+    COMPRESSAO_NIVEL_GZIP    nível do gzip, de 1 a 9 (padrão: 6)
+    COMPRESSAO_NIVEL_BROTLI  nível do brotli, de 0 a 11 (padrão: 5)
+
+Comparação com o jsonify padrão do Flask: python benchmark_json.py
+"""
+import gzip
+import json
+import logging
+import math
+import os
+import zlib
+
+from flask import current_app, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependência opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSAO_MIN_BYTES = int(os.environ.get('COMPRESSAO_MIN_BYTES', 1024))
+COMPRESSAO_NIVEL_GZIP = int(os.environ.get('COMPRESSAO_NIVEL_GZIP', 6))
+COMPRESSAO_NIVEL_BROTLI = int(os.environ.get('COMPRESSAO_NIVEL_BROTLI', 5))
+
+MIMETYPES_COMPRIMIVEIS = ('application/json', 'application/x-ndjson')
+# Ordem de preferência do servidor quando o cliente aceita mais de uma
+CODIFICACOES = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+if orjson is not None:
+    _OPCOES_ORJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS
+
+
+def _finitos(obj):
+    """Cópia de obj com os floats não finitos trocados por None (o que o orjson faz)."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {chave: _finitos(valor) for chave, valor in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finitos(valor) for valor in obj]
+    return obj
+
+
+def _json_padrao(obj):
+    return json.dumps(obj, default=DefaultJSONProvider.default, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+def serializar_json(obj):
+    """
+    Serializa para bytes UTF-8 (orjson quando disponível), com as chaves ordenadas. Datas seguem
+    o padrão do Flask; NaN e Infinity viram null.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_OPCOES_ORJSON)
+    try:
+        return _json_padrao(obj)
+    except ValueError:
+        logger.warning("Valores não finitos (NaN/Infinity) serializados como null")
+        return _json_padrao(_finitos(obj))
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """Provider do Flask que usa serializar_json em dumps() e nas respostas de jsonify()."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Opções específicas do módulo json (ex.: indent) continuam com a implementação padrão
+            return super().dumps(obj, **kwargs)
+        return serializar_json(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serializar_json(obj), mimetype=self.mimetype)
+
+
+def json_em_fluxo(lotes):
+    """Gera um array JSON, em blocos de bytes, a partir de um iterável de listas de itens."""
+    yield b'['
+    primeiro = True
+    for lote in lotes:
+        if not lote:
+            continue
+        if not primeiro:
+            yield b','
+        yield serializar_json(lote)[1:-1]  # Itens do lote, sem os colchetes
+        primeiro = False
+    yield b']'
+
+
+def resposta_json_em_fluxo(lotes):
+    """Resposta com um array JSON enviado à medida que os lotes são produzidos."""
+    return current_app.response_class(stream_with_context(json_em_fluxo(lotes)), mimetype='application/json')
+
+
+def negociar_codificacao():
+    """Codificação de CODIFICACOES preferida pelo cliente (Accept-Encoding), ou None."""
+    return request.accept_encodings.best_match(CODIFICACOES)
+
+
+def comprimir(corpo, codificacao):
+    if codificacao == 'br':
+        return brotli.compress(corpo, quality=COMPRESSAO_NIVEL_BROTLI)
+    return gzip.compress(corpo, compresslevel=COMPRESSAO_NIVEL_GZIP, mtime=0)
+
+
+def _comprimir_fluxo(blocos, codificacao):
+    if codificacao == 'br':
+        compressor = brotli.Compressor(quality=COMPRESSAO_NIVEL_BROTLI)
+        comprimir_bloco, finalizar = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESSAO_NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # cabeçalho gzip
+        comprimir_bloco, finalizar = compressor.compress, compressor.flush
+    try:
+        for bloco in blocos:
+            if isinstance(bloco, str):
+                bloco = bloco.encode('utf-8')
+            saida = comprimir_bloco(bloco)
+            if saida:
+                yield saida
+        yield finalizar()
+    finally:
+        if hasattr(blocos, 'close'):
+            blocos.close()
+
+
+def comprimir_resposta(resposta, variantes=None):
+    """
+    Comprime a resposta conforme o Accept-Encoding, se o tipo e o tamanho justificarem.
+    `variantes` ({codificação: bytes}) guarda os corpos já comprimidos de uma resposta em
+    cache, para que cada codificação seja calculada uma única vez.
+    """
+    if (resposta.status_code != 200 or resposta.direct_passthrough or request.method == 'HEAD'
+            or 'Content-Encoding' in resposta.headers or resposta.mimetype not in MIMETYPES_COMPRIMIVEIS):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+
+    if resposta.is_streamed:
+        codificacao = negociar_codificacao()
+        if codificacao is None:
+            return resposta
+        resposta.response = _comprimir_fluxo(resposta.response, codificacao)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        corpo = resposta.get_data()
+        if len(corpo) < COMPRESSAO_MIN_BYTES:
+            return resposta
+        codificacao = negociar_codificacao()
+        if codificacao is None:
+            return resposta
+        comprimido = variantes.get(codificacao) if variantes is not None else None
+        if comprimido is None:
+            comprimido = comprimir(corpo, codificacao)
+            if variantes is not None:
+                variantes[codificacao] = comprimido
+        resposta.set_data(comprimido)
+
+    resposta.headers['Content-Encoding'] = codificacao
+    # A mesma versão em outra codificação: a ETag passa a ser fraca (If-None-Match a aceita)
+    etag, _ = resposta.get_etag()
+    if etag:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+
+def configurar_respostas(app):
+    """Instala o provider JSON e a compressão das respostas no app."""
+    app.json = ProvedorJSON(app)
+    app.after_request(comprimir_resposta)
+    logger.info(f"Respostas JSON: {'orjson' if orjson is not None else 'json'}; compressão: {', '.join(CODIFICACOES)}")
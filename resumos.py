@@ -0,0 +1,513 @@
+"""
+Resumos materializados usados por /api/estatisticas.
+
+- Rankings: para cada motorista e cada placa são mantidos a quantidade de manutenções, o
+  valor total e a data da última manutenção, no total e por mês (AAAA-MM). Os rankings
+  leem apenas as N primeiras linhas de um índice em vez de agrupar a tabela inteira.
+- Dashboard: quantidade e valor por mês, tipo e local. Um período qualquer é dividido em
+  meses completos, lidos desse resumo, e no máximo duas pontas de mês incompleto, lidas
+  de 'manutencoes' pelo índice de data; o custo não cresce com o histórico. Os veículos
+  atendidos vêm das placas por tipo, no total e por mês, sem os tipos de compra.
+
+As tabelas são atualizadas por triggers na tabela 'manutencoes', dentro da mesma transação
+de cada INSERT, UPDATE e DELETE, o que cobre o cadastro, a edição, a exclusão e a importação.
+
+Verificação de consistência (reconstrói as tabelas se houver divergências):
+    python resumos.py
+    python resumos.py --reconstruir   # reconstrói sempre
+"""
+import logging
+import re
+import sys
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Dimensões dos rankings: nome usado na API -> (coluna em 'manutencoes', tabela de resumo)
+DIMENSOES = {
+    'motoristas': ('motorista', 'resumo_motoristas'),
+    'veiculos': ('placa', 'resumo_veiculos'),
+}
+
+# Resumo mensal por tipo e local usado pelo dashboard
+TABELA_TIPOS_LOCAIS = 'resumo_tipos_locais_mensal'
+
+# Tipos de compra que não correspondem a um atendimento de veículo (ignorados em "veículos atendidos")
+TIPOS_SEM_VEICULO = ('Compra de Corda', 'Madeirite', 'Lona', 'Cinta e Catraca', 'EPIs', 'DIVERSOS')
+_TIPOS_SEM_VEICULO_SQL = ', '.join("'" + tipo.replace("'", "''") + "'" for tipo in TIPOS_SEM_VEICULO)
+
+# Placas atendidas por tipo (só os tipos fora de TIPOS_SEM_VEICULO), no total e por mês: os
+# veículos atendidos são as placas distintas dessas tabelas, sem ler 'manutencoes'
+TABELA_PLACAS_TIPOS = 'resumo_veiculos_tipos'
+
+# Quantidade de locais retornados no resumo do dashboard
+RESUMO_LIMITE_LOCAIS = 10
+
+_PERIODO_RE = re.compile(r'^(\d{4})(?:-(\d{2}))?(?::(\d{4})(?:-(\d{2}))?)?$')
+
+
+def _tabelas():
+    """Produz (tabela, coluna, mensal) para cada tabela de resumo."""
+    for coluna, tabela in DIMENSOES.values():
+        yield tabela, coluna, False
+        yield f'{tabela}_mensal', coluna, True
+
+
+def _sql_adicionar(tabela, coluna, mensal):
+    # Nulos e vazios são agrupados na mesma chave ('')
+    if mensal:
+        return f'''INSERT INTO {tabela} (mes, {coluna}, total_manutencoes, valor_total, ultima_data)
+                   VALUES (substr(NEW.data_iso, 1, 7), COALESCE(NEW.{coluna}, ''), 1, COALESCE(NEW.valor, 0), NEW.data_iso)
+                   ON CONFLICT(mes, {coluna}) DO UPDATE SET
+                       total_manutencoes = total_manutencoes + 1,
+                       valor_total = valor_total + excluded.valor_total,
+                       ultima_data = MAX(ultima_data, excluded.ultima_data);'''
+    return f'''INSERT INTO {tabela} ({coluna}, total_manutencoes, valor_total, ultima_data)
+               VALUES (COALESCE(NEW.{coluna}, ''), 1, COALESCE(NEW.valor, 0), NEW.data_iso)
+               ON CONFLICT({coluna}) DO UPDATE SET
+                   total_manutencoes = total_manutencoes + 1,
+                   valor_total = valor_total + excluded.valor_total,
+                   ultima_data = MAX(ultima_data, excluded.ultima_data);'''
+
+
+def _sql_remover(tabela, coluna, mensal):
+    # A última data é recalculada pelos índices (coluna, data_iso) de 'manutencoes'
+    chave = f"COALESCE(OLD.{coluna}, '')"
+    filtro = f"({coluna} = {chave} OR ({coluna} IS NULL AND {chave} = ''))"
+    filtro_mes, where_mes = '', ''
+    if mensal:
+        filtro_mes = " AND data_iso BETWEEN substr(OLD.data_iso, 1, 7) || '-01' AND substr(OLD.data_iso, 1, 7) || '-31'"
+        where_mes = ' AND mes = substr(OLD.data_iso, 1, 7)'
+    return f'''UPDATE {tabela} SET
+                   total_manutencoes = total_manutencoes - 1,
+                   valor_total = valor_total - COALESCE(OLD.valor, 0),
+                   ultima_data = COALESCE((SELECT MAX(data_iso) FROM manutencoes WHERE {filtro}{filtro_mes}), '')
+               WHERE {coluna} = {chave}{where_mes};
+               DELETE FROM {tabela} WHERE {coluna} = {chave}{where_mes} AND total_manutencoes <= 0;'''
+
+
+def criar_esquema_resumos(c):
+    """Cria (se necessário) as tabelas de resumo, seus índices e os triggers. Popula as tabelas recém-criadas."""
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name LIKE 'resumo_%'")
+    existentes = c.fetchone()[0]
+
+    for tabela, coluna, mensal in _tabelas():
+        mes = 'mes TEXT NOT NULL, ' if mensal else ''
+        chave = f'mes, {coluna}' if mensal else coluna
+        c.execute(f'''CREATE TABLE IF NOT EXISTS {tabela}
+                      ({mes}{coluna} TEXT NOT NULL,
+                       total_manutencoes INTEGER NOT NULL,
+                       valor_total REAL NOT NULL,
+                       ultima_data TEXT NOT NULL,
+                       PRIMARY KEY ({chave}))''')
+        prefixo = 'mes, ' if mensal else ''
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_{tabela}_ranking
+                      ON {tabela} ({prefixo}total_manutencoes DESC, valor_total DESC)''')
+
+    adicionar = '\n'.join(_sql_adicionar(*t) for t in _tabelas())
+    remover = '\n'.join(_sql_remover(*t) for t in _tabelas())
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumos_ai AFTER INSERT ON manutencoes
+                  BEGIN
+                      {adicionar}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumos_ad AFTER DELETE ON manutencoes
+                  BEGIN
+                      {remover}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumos_au AFTER UPDATE OF motorista, placa, valor, data_iso ON manutencoes
+                  WHEN OLD.motorista IS NOT NEW.motorista OR OLD.placa IS NOT NEW.placa
+                    OR OLD.valor IS NOT NEW.valor OR OLD.data_iso IS NOT NEW.data_iso
+                  BEGIN
+                      {remover}
+                      {adicionar}
+                  END''')
+
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {TABELA_TIPOS_LOCAIS}
+                  (mes TEXT NOT NULL,
+                   tipo TEXT NOT NULL,
+                   local TEXT NOT NULL,
+                   total_manutencoes INTEGER NOT NULL,
+                   valor_total REAL NOT NULL,
+                   PRIMARY KEY (mes, tipo, local))''')
+    adicionar = f'''INSERT INTO {TABELA_TIPOS_LOCAIS} (mes, tipo, local, total_manutencoes, valor_total)
+                     VALUES (substr(NEW.data_iso, 1, 7), COALESCE(NEW.tipo, ''), COALESCE(NEW.local, ''), 1, COALESCE(NEW.valor, 0))
+                     ON CONFLICT(mes, tipo, local) DO UPDATE SET
+                         total_manutencoes = total_manutencoes + 1,
+                         valor_total = valor_total + excluded.valor_total;'''
+    chave = "mes = substr(OLD.data_iso, 1, 7) AND tipo = COALESCE(OLD.tipo, '') AND local = COALESCE(OLD.local, '')"
+    remover = f'''UPDATE {TABELA_TIPOS_LOCAIS} SET
+                       total_manutencoes = total_manutencoes - 1,
+                       valor_total = valor_total - COALESCE(OLD.valor, 0)
+                   WHERE {chave};
+                   DELETE FROM {TABELA_TIPOS_LOCAIS} WHERE {chave} AND total_manutencoes <= 0;'''
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_tipos_ai AFTER INSERT ON manutencoes
+                  BEGIN
+                      {adicionar}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_tipos_ad AFTER DELETE ON manutencoes
+                  BEGIN
+                      {remover}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_tipos_au AFTER UPDATE OF tipo, local, valor, data_iso ON manutencoes
+                  WHEN OLD.tipo IS NOT NEW.tipo OR OLD.local IS NOT NEW.local
+                    OR OLD.valor IS NOT NEW.valor OR OLD.data_iso IS NOT NEW.data_iso
+                  BEGIN
+                      {remover}
+                      {adicionar}
+                  END''')
+    # Filtro por tipo nas pontas de mês incompleto do dashboard
+    c.execute('CREATE INDEX IF NOT EXISTS idx_manutencoes_tipo_data_iso ON manutencoes (tipo, data_iso)')
+
+    for mensal in (False, True):
+        tabela = f'{TABELA_PLACAS_TIPOS}_mensal' if mensal else TABELA_PLACAS_TIPOS
+        mes = 'mes TEXT NOT NULL, ' if mensal else ''
+        prefixo = 'mes, ' if mensal else ''
+        # Chave começando pela placa (após o mês): COUNT(DISTINCT placa) segue a ordem da chave
+        c.execute(f'''CREATE TABLE IF NOT EXISTS {tabela}
+                      ({mes}placa TEXT NOT NULL,
+                       tipo TEXT NOT NULL,
+                       total_manutencoes INTEGER NOT NULL,
+                       PRIMARY KEY ({prefixo}placa, tipo)) WITHOUT ROWID''')
+
+    def placas(linha):
+        # Manutenções sem placa ou de um tipo de compra não entram
+        return f"{linha}.placa IS NOT NULL AND COALESCE({linha}.tipo, '') NOT IN ({_TIPOS_SEM_VEICULO_SQL})"
+
+    adicionar, remover = [], []
+    for mensal in (False, True):
+        tabela = f'{TABELA_PLACAS_TIPOS}_mensal' if mensal else TABELA_PLACAS_TIPOS
+        colunas = 'mes, placa, tipo' if mensal else 'placa, tipo'
+        valores = ('substr(NEW.data_iso, 1, 7), ' if mensal else '') + "NEW.placa, COALESCE(NEW.tipo, '')"
+        chave = ('mes = substr(OLD.data_iso, 1, 7) AND ' if mensal else '') + "placa = OLD.placa AND tipo = COALESCE(OLD.tipo, '')"
+        adicionar.append(f'''INSERT INTO {tabela} ({colunas}, total_manutencoes)
+                             SELECT {valores}, 1 WHERE {placas('NEW')}
+                             ON CONFLICT({colunas}) DO UPDATE SET total_manutencoes = total_manutencoes + 1;''')
+        remover.append(f'''UPDATE {tabela} SET total_manutencoes = total_manutencoes - 1
+                           WHERE {chave} AND {placas('OLD')};
+                           DELETE FROM {tabela} WHERE {chave} AND total_manutencoes <= 0;''')
+    adicionar, remover = '\n'.join(adicionar), '\n'.join(remover)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_placas_ai AFTER INSERT ON manutencoes
+                  BEGIN
+                      {adicionar}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_placas_ad AFTER DELETE ON manutencoes
+                  BEGIN
+                      {remover}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS manutencoes_resumo_placas_au AFTER UPDATE OF placa, tipo, data_iso ON manutencoes
+                  WHEN OLD.placa IS NOT NEW.placa OR OLD.tipo IS NOT NEW.tipo OR OLD.data_iso IS NOT NEW.data_iso
+                  BEGIN
+                      {remover}
+                      {adicionar}
+                  END''')
+
+    if existentes < len(list(_resumos())):
+        reconstruir_resumos(c)
+
+
+def _resumos():
+    """
+    Produz (tabela, colunas, consulta) para cada tabela de resumo, onde `consulta` recalcula
+    as `colunas` da tabela, na mesma ordem, a partir de 'manutencoes'.
+    """
+    for tabela, coluna, mensal in _tabelas():
+        mes = 'substr(data_iso, 1, 7) AS mes, ' if mensal else ''
+        grupo = 'mes, ' if mensal else ''
+        colunas = ['mes'] if mensal else []
+        colunas += [coluna, 'total_manutencoes', 'valor_total', 'ultima_data']
+        yield tabela, colunas, f'''SELECT {mes}COALESCE({coluna}, '') AS chave, COUNT(*),
+                                          COALESCE(SUM(valor), 0), MAX(data_iso)
+                                   FROM manutencoes GROUP BY {grupo}chave'''
+    yield (TABELA_TIPOS_LOCAIS, ['mes', 'tipo', 'local', 'total_manutencoes', 'valor_total'],
+           '''SELECT substr(data_iso, 1, 7) AS mes, COALESCE(tipo, '') AS t, COALESCE(local, '') AS l,
+                     COUNT(*), COALESCE(SUM(valor), 0)
+              FROM manutencoes GROUP BY mes, t, l''')
+    for mensal in (False, True):
+        mes = 'substr(data_iso, 1, 7) AS mes, ' if mensal else ''
+        yield (f'{TABELA_PLACAS_TIPOS}_mensal' if mensal else TABELA_PLACAS_TIPOS,
+               (['mes'] if mensal else []) + ['placa', 'tipo', 'total_manutencoes'],
+               f'''SELECT {mes}placa, COALESCE(tipo, '') AS t, COUNT(*) FROM manutencoes
+                   WHERE placa IS NOT NULL AND t NOT IN ({_TIPOS_SEM_VEICULO_SQL})
+                   GROUP BY {'mes, ' if mensal else ''}placa, t''')
+
+
+def reconstruir_resumos(c):
+    """Recalcula todas as tabelas de resumo a partir de 'manutencoes' (na transação corrente)."""
+    for tabela, colunas, consulta in _resumos():
+        c.execute(f'DELETE FROM {tabela}')
+        c.execute(f'INSERT INTO {tabela} ({", ".join(colunas)}) {consulta}')
+    logger.info("Tabelas de resumo reconstruídas")
+
+
+def verificar_resumos(c):
+    """Compara as tabelas de resumo com um agrupamento completo. Retorna {tabela: linhas divergentes}."""
+    divergencias = {}
+    for tabela, colunas, consulta in _resumos():
+        # Valores comparados com 2 casas decimais: somas e subtrações sucessivas acumulam erro de ponto flutuante
+        nomes = [f'c{i}' for i in range(len(colunas))]
+        arredondados = ', '.join(f'ROUND({n}, 2)' if col == 'valor_total' else n for n, col in zip(nomes, colunas))
+        c.execute(f'''WITH esperado({", ".join(nomes)}) AS ({consulta}),
+                           atual({", ".join(nomes)}) AS (SELECT {", ".join(colunas)} FROM {tabela})
+                      SELECT (SELECT COUNT(*) FROM (SELECT {arredondados} FROM esperado
+                                                   EXCEPT SELECT {arredondados} FROM atual)) +
+                             (SELECT COUNT(*) FROM (SELECT {arredondados} FROM atual
+                                                   EXCEPT SELECT {arredondados} FROM esperado))''')
+        divergencias[tabela] = c.fetchone()[0]
+    return divergencias
+
+
+def interpretar_periodo(periodo):
+    """
+    Converte o parâmetro 'periodo' em (mes_inicial, mes_final), no formato AAAA-MM.
+    Aceita um mês (2025-06), um ano (2025) ou um intervalo (2025-01:2025-06).
+    Lança ValueError se o formato for inválido.
+    """
+    m = _PERIODO_RE.match(periodo.strip())
+    if not m:
+        raise ValueError('Período inválido. Use AAAA-MM, AAAA ou AAAA-MM:AAAA-MM')
+    ano_inicio, mes_inicio, ano_fim, mes_fim = m.groups()
+    inicio = f'{ano_inicio}-{mes_inicio or "01"}'
+    if ano_fim:
+        fim = f'{ano_fim}-{mes_fim or "12"}'
+    else:
+        fim = f'{ano_inicio}-{mes_inicio or "12"}'
+    if not ('01' <= inicio[5:] <= '12' and '01' <= fim[5:] <= '12') or inicio > fim:
+        raise ValueError('Período inválido. Use AAAA-MM, AAAA ou AAAA-MM:AAAA-MM')
+    return inicio, fim
+
+
+def consultar_ranking(c, dimensao, limite=5, periodo=None):
+    """
+    Retorna os `limite` primeiros da dimensão ('motoristas' ou 'veiculos') por quantidade de
+    manutenções e valor total. Sem período, ou com um único mês, a leitura percorre apenas
+    as primeiras linhas do índice; intervalos somam os resumos mensais.
+    """
+    coluna, tabela = DIMENSOES[dimensao]
+    campos = f'{coluna}, total_manutencoes, ROUND(valor_total, 2) AS valor_total, ultima_data'
+    ordem = 'ORDER BY total_manutencoes DESC, valor_total DESC LIMIT ?'
+    if not periodo:
+        c.execute(f'SELECT {campos} FROM {tabela} {ordem}', (limite,))
+    else:
+        inicio, fim = interpretar_periodo(periodo)
+        if inicio == fim:
+            c.execute(f'SELECT {campos} FROM {tabela}_mensal WHERE mes = ? {ordem}', (inicio, limite))
+        else:
+            c.execute(f'''SELECT {coluna}, SUM(total_manutencoes) AS total_manutencoes,
+                                 ROUND(SUM(valor_total), 2) AS valor_total, MAX(ultima_data) AS ultima_data
+                          FROM {tabela}_mensal WHERE mes BETWEEN ? AND ?
+                          GROUP BY {coluna} {ordem}''', (inicio, fim, limite))
+    return [dict(row) for row in c.fetchall()]
+
+
+PERIODOS_DASHBOARD = ('todos', 'hoje', 'semana', 'mes', 'trimestre', 'ano')
+
+
+def _fim_do_mes(dia):
+    return (dia.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def intervalo_periodo(periodo, referencia):
+    """Converte um período do dashboard em (inicio, fim), relativo à data `referencia`. 'todos' -> (None, None)."""
+    if periodo == 'hoje':
+        return referencia, referencia
+    if periodo == 'semana':
+        # Semana de domingo a sábado, como no dashboard
+        inicio = referencia - timedelta(days=(referencia.weekday() + 1) % 7)
+        return inicio, inicio + timedelta(days=6)
+    if periodo == 'mes':
+        return referencia.replace(day=1), _fim_do_mes(referencia)
+    if periodo == 'trimestre':
+        inicio = referencia.replace(month=(referencia.month - 1) // 3 * 3 + 1, day=1)
+        return inicio, _fim_do_mes(inicio.replace(month=inicio.month + 2))
+    if periodo == 'ano':
+        return date(referencia.year, 1, 1), date(referencia.year, 12, 31)
+    return None, None
+
+
+def _intersecao(a, b):
+    """Interseção de dois intervalos (None = sem limite). Retorna None se for vazia."""
+    inicio = max((d for d in (a[0], b[0]) if d), default=None)
+    fim = min((d for d in (a[1], b[1]) if d), default=None)
+    if inicio and fim and inicio > fim:
+        return None
+    return inicio, fim
+
+
+def _dividir_intervalo(inicio, fim):
+    """
+    Divide [inicio, fim] em pontas de mês incompleto, lidas de 'manutencoes' pelo índice de
+    data, e um intervalo de meses completos, lido do resumo mensal. Retorna (pontas, meses),
+    com meses = (mes_inicial, mes_final), (None, None) para todos os meses ou None.
+    """
+    if inicio is None:
+        return [], (None, None)
+    primeiro = inicio if inicio.day == 1 else _fim_do_mes(inicio) + timedelta(days=1)
+    ultimo = fim if fim == _fim_do_mes(fim) else fim.replace(day=1) - timedelta(days=1)
+    if primeiro > ultimo:
+        return [(inicio, fim)], None
+    pontas = []
+    if inicio < primeiro:
+        pontas.append((inicio, primeiro - timedelta(days=1)))
+    if ultimo < fim:
+        pontas.append((ultimo + timedelta(days=1), fim))
+    return pontas, (primeiro.strftime('%Y-%m'), ultimo.strftime('%Y-%m'))
+
+
+def _condicoes(filtros, inicio=None, fim=None):
+    condicoes, params = [], []
+    for campo in ('motorista', 'placa', 'tipo'):
+        if filtros.get(campo):
+            condicoes.append(f'{campo} = ?')
+            params.append(filtros[campo])
+    if inicio:
+        condicoes.append('data_iso BETWEEN ? AND ?')
+        params += [inicio.isoformat(), fim.isoformat()]
+    return condicoes, params
+
+
+def _where(condicoes):
+    return f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+
+def _agregar(c, inicio, fim, filtros, agrupar=None):
+    """
+    Quantidade e valor das manutenções em [inicio, fim] (None = sem limite) que atendem aos
+    filtros, agrupados por `agrupar` ('tipo' ou 'local') ou no total (chave '').
+    Retorna {chave: [quantidade, valor]}.
+    """
+    resultado = {}
+
+    def somar(consulta, params):
+        c.execute(consulta, params)
+        for chave, quantidade, valor in c.fetchall():
+            acumulado = resultado.setdefault(chave, [0, 0.0])
+            acumulado[0] += quantidade
+            acumulado[1] += valor or 0
+
+    if filtros.get('motorista') or filtros.get('placa'):
+        # O resumo mensal não tem essas dimensões: o índice (motorista|placa, data_iso)
+        # limita a leitura às manutenções do motorista ou da placa
+        pontas, meses = [(inicio, fim)], None
+    else:
+        pontas, meses = _dividir_intervalo(inicio, fim)
+
+    chave = f"COALESCE({agrupar}, '')" if agrupar else "''"
+    for ponta_inicio, ponta_fim in pontas:
+        condicoes, params = _condicoes(filtros, ponta_inicio, ponta_fim)
+        somar(f'SELECT {chave}, COUNT(*), SUM(valor) FROM manutencoes {_where(condicoes)} GROUP BY 1', params)
+
+    if meses is not None:
+        condicoes, params = _condicoes({'tipo': filtros.get('tipo')})
+        if meses[0]:
+            condicoes.append('mes BETWEEN ? AND ?')
+            params += list(meses)
+        somar(f'''SELECT {agrupar or "''"}, SUM(total_manutencoes), SUM(valor_total)
+                   FROM {TABELA_TIPOS_LOCAIS} {_where(condicoes)} GROUP BY 1''', params)
+    return resultado
+
+
+def _veiculos_atendidos(c, inicio, fim, filtros):
+    """
+    Placas distintas atendidas no intervalo, desconsiderando os tipos de compra (TIPOS_SEM_VEICULO).
+    Os meses completos (ou todo o histórico) vêm das placas por tipo; as pontas de mês
+    incompleto e o filtro por motorista, de 'manutencoes' pelos índices.
+    """
+    if filtros.get('tipo') in TIPOS_SEM_VEICULO:
+        return 0
+    if filtros.get('motorista'):
+        pontas, meses = [(inicio, fim)], None
+    else:
+        pontas, meses = _dividir_intervalo(inicio, fim)
+
+    consultas, params = [], []
+    for ponta_inicio, ponta_fim in pontas:
+        condicoes, parametros = _condicoes(filtros, ponta_inicio, ponta_fim)
+        condicoes.append(f"COALESCE(tipo, '') NOT IN ({_TIPOS_SEM_VEICULO_SQL})")
+        consultas.append(f'SELECT placa FROM manutencoes {_where(condicoes)}')
+        params += parametros
+    if meses is not None:
+        condicoes, parametros = _condicoes(filtros)
+        tabela = TABELA_PLACAS_TIPOS
+        if meses[0]:
+            tabela += '_mensal'
+            condicoes.append('mes BETWEEN ? AND ?')
+            parametros += list(meses)
+        consultas.append(f'SELECT placa FROM {tabela} {_where(condicoes)}')
+        params += parametros
+    c.execute(f"SELECT COUNT(DISTINCT placa) FROM ({' UNION ALL '.join(consultas)})", params)
+    return c.fetchone()[0]
+
+
+def _lista_agregada(agregado, campo, limite=None):
+    itens = [{campo: chave, 'quantidade': quantidade, 'valor_total': round(valor, 2)}
+             for chave, (quantidade, valor) in agregado.items() if quantidade > 0]
+    itens.sort(key=lambda item: (-item['quantidade'], -item['valor_total']))
+    return itens[:limite] if limite else itens
+
+
+def resumo_dashboard(c, referencia, periodo='todos', filtros=None):
+    """
+    KPIs do dashboard: totais do período selecionado, veículos atendidos, comparação
+    hoje / semana / mês (dentro do período selecionado) e distribuição por tipo e por local.
+    `referencia` é a data considerada como "hoje"; `filtros` aceita motorista, placa e tipo.
+    """
+    filtros = {campo: valor for campo, valor in (filtros or {}).items() if valor}
+    selecionado = intervalo_periodo(periodo, referencia)
+    total_manutencoes, valor_total = _agregar(c, *selecionado, filtros).get('', [0, 0.0])
+
+    comparacao = {}
+    for nome in ('hoje', 'semana', 'mes'):
+        janela = _intersecao(selecionado, intervalo_periodo(nome, referencia))
+        quantidade, valor = _agregar(c, *janela, filtros).get('', [0, 0.0]) if janela else (0, 0.0)
+        comparacao[nome] = {'quantidade': quantidade, 'valor_total': round(valor, 2)}
+
+    return {
+        'referencia': referencia.isoformat(),
+        'periodo': {
+            'nome': periodo,
+            'inicio': selecionado[0].isoformat() if selecionado[0] else None,
+            'fim': selecionado[1].isoformat() if selecionado[1] else None
+        },
+        'total_manutencoes': total_manutencoes,
+        'valor_total': round(valor_total, 2),
+        'veiculos_atendidos': _veiculos_atendidos(c, *selecionado, filtros),
+        'manutencoes_mes': comparacao['mes']['quantidade'],
+        'comparacao': comparacao,
+        'por_tipo': _lista_agregada(_agregar(c, *selecionado, filtros, 'tipo'), 'tipo'),
+        'por_local': _lista_agregada(_agregar(c, *selecionado, filtros, 'local'), 'local', RESUMO_LIMITE_LOCAIS)
+    }
+
+
+def opcoes_filtros(c):
+    """Motoristas, placas e tipos existentes, para os filtros do dashboard, lidos das tabelas de resumo."""
+    c.execute("SELECT motorista FROM resumo_motoristas WHERE motorista != '' ORDER BY motorista")
+    motoristas = [row[0] for row in c.fetchall()]
+    c.execute("SELECT placa FROM resumo_veiculos WHERE placa != '' ORDER BY placa")
+    placas = [row[0] for row in c.fetchall()]
+    c.execute(f"SELECT DISTINCT tipo FROM {TABELA_TIPOS_LOCAIS} WHERE tipo != '' ORDER BY tipo")
+    tipos = [row[0] for row in c.fetchall()]
+    return {'motoristas': motoristas, 'placas': placas, 'tipos': tipos}
+
+
+if __name__ == '__main__':
+    from banco import pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        criar_esquema_resumos(c)
+        if '--reconstruir' in sys.argv:
+            reconstruir_resumos(c)
+        else:
+            divergencias = verificar_resumos(c)
+            for tabela, total in divergencias.items():
+                logger.info(f"{tabela}: {total} linha(s) divergente(s)")
+            if any(divergencias.values()):
+                logger.warning("Resumos inconsistentes; reconstruindo...")
+                reconstruir_resumos(c)
+            else:
+                logger.info("Resumos consistentes")
+        conn.commit()
+    finally:
+        conn.close()
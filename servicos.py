@@ -0,0 +1,129 @@
+"""
+Serviços oferecidos pelos locais do mapa (prestadores), em tabelas normalizadas.
+
+- 'servicos': dicionário dos nomes de serviço (únicos, sem diferenciar maiúsculas);
+- 'mapa_locais_servicos': vínculo local -> serviço, na ordem em que foram informados, com
+  índice por serviço para os filtros.
+
+A API continua recebendo e devolvendo `servicos` como lista de textos. Os vínculos de um
+local são apagados por trigger junto com ele. Na criação do esquema, os serviços ainda
+gravados como texto separado por vírgulas na coluna legada 'mapa_locais.servicos' são
+migrados para as tabelas e a coluna é esvaziada.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Como combinar vários serviços no filtro: o local precisa ter todos ou pelo menos um
+MODOS_FILTRO = ('todos', 'algum')
+# Acima disso, os serviços de uma lista de locais são lidos de uma vez, sem IN (...)
+_LIMITE_IN = 500
+
+
+def criar_esquema_servicos(c):
+    """Cria (se necessário) as tabelas, os índices e o trigger; migra a coluna legada."""
+    c.execute('''CREATE TABLE IF NOT EXISTS servicos
+                 (id INTEGER PRIMARY KEY,
+                  nome TEXT NOT NULL UNIQUE COLLATE NOCASE)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS mapa_locais_servicos
+                 (local_id INTEGER NOT NULL REFERENCES mapa_locais (id) ON DELETE CASCADE,
+                  servico_id INTEGER NOT NULL REFERENCES servicos (id),
+                  posicao INTEGER NOT NULL, -- Ordem do serviço na lista do local
+                  PRIMARY KEY (local_id, servico_id)) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_mapa_locais_servicos_servico ON mapa_locais_servicos (servico_id, local_id)')
+    # Filtros por estado/cidade e por tipo das consultas do mapa
+    c.execute('CREATE INDEX IF NOT EXISTS idx_mapa_locais_estado_cidade ON mapa_locais (estado COLLATE NOCASE, cidade COLLATE NOCASE)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_mapa_locais_tipo ON mapa_locais (tipo)')
+    # Não depende de PRAGMA foreign_keys
+    c.execute('''CREATE TRIGGER IF NOT EXISTS mapa_locais_servicos_ad AFTER DELETE ON mapa_locais
+                 BEGIN
+                     DELETE FROM mapa_locais_servicos WHERE local_id = OLD.id;
+                 END''')
+
+    c.execute("SELECT id, servicos FROM mapa_locais WHERE servicos IS NOT NULL AND servicos != ''")
+    legados = c.fetchall()
+    if legados:
+        logger.info(f"Migrando serviços de {len(legados)} locais do mapa para 'mapa_locais_servicos'...")
+        gravar_servicos_lote(c, {local_id: texto.split(',') for local_id, texto in legados})
+        c.execute("UPDATE mapa_locais SET servicos = NULL WHERE servicos IS NOT NULL")
+
+
+def normalizar_servicos(servicos):
+    """Lista de nomes sem espaços nas pontas, vazios ou repetidos (sem diferenciar maiúsculas)."""
+    if isinstance(servicos, str):
+        servicos = servicos.split(',')
+    vistos = set()
+    nomes = []
+    for servico in servicos or []:
+        nome = str(servico).strip()
+        if nome and nome.lower() not in vistos:
+            vistos.add(nome.lower())
+            nomes.append(nome)
+    return nomes
+
+
+def gravar_servicos(c, local_id, servicos):
+    """
+    Substitui os serviços do local. Retorna a lista gravada, com os nomes como estão no
+    dicionário (um serviço já cadastrado mantém a grafia original de maiúsculas).
+    """
+    gravar_servicos_lote(c, {local_id: servicos})
+    return servicos_por_local(c, [local_id]).get(local_id, [])
+
+
+def gravar_servicos_lote(c, servicos_por_id):
+    """Substitui os serviços de vários locais ({local_id: serviços}) com executemany."""
+    vinculos = [(local_id, posicao, nome)
+                for local_id, servicos in servicos_por_id.items()
+                for posicao, nome in enumerate(normalizar_servicos(servicos))]
+    c.executemany('DELETE FROM mapa_locais_servicos WHERE local_id = ?', [(local_id,) for local_id in servicos_por_id])
+    if vinculos:
+        c.executemany('INSERT OR IGNORE INTO servicos (nome) VALUES (?)', [(nome,) for _, _, nome in vinculos])
+        c.executemany('''INSERT INTO mapa_locais_servicos (local_id, servico_id, posicao)
+                         SELECT ?, id, ? FROM servicos WHERE nome = ?''', vinculos)
+
+
+def servicos_por_local(c, ids=None):
+    """{local_id: [serviços em ordem]} dos locais informados (ou de todos)."""
+    consulta = '''SELECT ls.local_id, s.nome FROM mapa_locais_servicos ls JOIN servicos s ON s.id = ls.servico_id'''
+    if ids is None or len(ids) > _LIMITE_IN:
+        c.execute(f'{consulta} ORDER BY ls.local_id, ls.posicao')
+    else:
+        if not ids:
+            return {}
+        c.execute(f"{consulta} WHERE ls.local_id IN ({','.join('?' for _ in ids)}) ORDER BY ls.local_id, ls.posicao",
+                  list(ids))
+    por_local = {}
+    for local_id, nome in c.fetchall():
+        por_local.setdefault(local_id, []).append(nome)
+    return por_local
+
+
+def anexar_servicos(c, locais):
+    """Preenche 'servicos' (lista) em cada dicionário de local. Retorna a própria lista."""
+    por_local = servicos_por_local(c, [local['id'] for local in locais])
+    for local in locais:
+        local['servicos'] = por_local.get(local['id'], [])
+    return locais
+
+
+def condicao_servicos(servicos, modo='todos', coluna='m.id'):
+    """
+    Condição SQL (e parâmetros) que restringe `coluna` (id do local) aos locais com todos os
+    serviços informados (modo 'todos') ou com pelo menos um deles (modo 'algum').
+    """
+    nomes = normalizar_servicos(servicos)
+    marcadores = ','.join('?' for _ in nomes)
+    subconsulta = f'''SELECT ls.local_id FROM mapa_locais_servicos ls JOIN servicos s ON s.id = ls.servico_id
+                      WHERE s.nome IN ({marcadores})'''
+    if modo == 'todos':
+        subconsulta += f' GROUP BY ls.local_id HAVING COUNT(*) = {len(nomes)}'
+    return f'{coluna} IN ({subconsulta})', nomes
+
+
+def listar_servicos(c):
+    """Serviços em uso, com a quantidade de locais que oferecem cada um, do mais comum ao menos comum."""
+    c.execute('''SELECT s.nome, COUNT(*) AS locais FROM servicos s
+                 JOIN mapa_locais_servicos ls ON ls.servico_id = s.id
+                 GROUP BY s.id ORDER BY locais DESC, s.nome''')
+    return [dict(row) for row in c.fetchall()]
@@ -14,22 +14,62 @@ if (isLocal && window.location.port !== '5000') {
 axios.defaults.baseURL = API_BASE_URL;
 axios.defaults.timeout = 30000;
 
-export async function carregarManutencoesAPI(telefone = '') {
-    let url = '/api/manutencoes';
-    if (telefone) {
-        url += `?telefone=${encodeURIComponent(telefone)}`;
-    }
-    const response = await axios.get(url);
-    if (!Array.isArray(response.data)) {
-        throw new Error('Resposta da API não é um array');
-    }
+/**
+ * Carrega uma página da listagem de manutenções (paginação por cursor).
+ * Com `q` (texto livre) os itens vêm ordenados por relevância; `telefone` e `placa` aceitam trechos.
+ * @param {{limit?: number, cursor?: string, fields?: string[], q?: string, telefone?: string, placa?: string, tipo?: string}} opcoes
+ * @returns {Promise<{items: object[], next_cursor: string|null, limit: number}>}
+ */
+export async function carregarPaginaManutencoesAPI({ limit = 50, cursor = null, fields = null, q = '', telefone = '', placa = '', tipo = '' } = {}) {
+    const params = { limit };
+    if (cursor) params.cursor = cursor;
+    if (fields && fields.length > 0) params.fields = fields.join(',');
+    if (q) params.q = q;
+    if (telefone) params.telefone = telefone;
+    if (placa) params.placa = placa;
+    if (tipo) params.tipo = tipo;
+    const response = await axios.get('/api/manutencoes', { params });
+    return response.data;
+}
+
+/**
+ * Alterações desde a última sincronização (GET /api/alteracoes). Sem `desde`, retorna apenas
+ * o seq atual. Rejeita com status 410 quando o trecho já foi compactado (recarregar tudo).
+ * @param {number|null} desde Seq da última sincronização.
+ * @returns {Promise<{desde: number|null, seq: number, mais: boolean, manutencoes?: {gravados: object[], excluidos: number[]}, anexos?: object, mapa_locais?: object}>}
+ */
+export async function carregarAlteracoesAPI(desde = null) {
+    const params = desde === null ? {} : { desde };
+    const response = await axios.get('/api/alteracoes', { params });
     return response.data;
 }
 
-export async function carregarRankingsAPI() {
+/**
+ * Abre o fluxo de alterações (Server-Sent Events) a partir do seq informado.
+ * Eventos: 'alteracoes' (mesmo formato de carregarAlteracoesAPI) e 'recarregar'.
+ */
+export function abrirFluxoAlteracoes(desde) {
+    return new EventSource(`${API_BASE_URL}/api/alteracoes/fluxo?desde=${encodeURIComponent(desde)}`);
+}
+
+/**
+ * Monta a URL absoluta de download de um anexo (GET /api/anexos/<id>).
+ * @param {{id: number}} anexo Metadados do anexo retornados pela listagem.
+ * @param {boolean} download Força o download em vez da visualização no navegador.
+ */
+export function urlAnexo(anexo, download = false) {
+    return `${API_BASE_URL}/api/anexos/${anexo.id}${download ? '?download=1' : ''}`;
+}
+
+/**
+ * Carrega os rankings de motoristas e veículos.
+ * @param {string} [periodo] Mês (AAAA-MM), ano (AAAA) ou intervalo (AAAA-MM:AAAA-MM); vazio para todo o histórico.
+ */
+export async function carregarRankingsAPI(periodo = '') {
+    const config = periodo ? { params: { periodo } } : {};
     const [motoristasResponse, veiculosResponse] = await Promise.all([
-        axios.get('/api/estatisticas/motoristas'),
-        axios.get('/api/estatisticas/veiculos')
+        axios.get('/api/estatisticas/motoristas', config),
+        axios.get('/api/estatisticas/veiculos', config)
     ]);
     return {
         topMotoristas: motoristasResponse.data.slice(0, 5),
@@ -37,6 +77,24 @@ export async function carregarRankingsAPI() {
     };
 }
 
+/**
+ * Carrega os KPIs do dashboard calculados no servidor (GET /api/estatisticas/resumo).
+ * @param {{periodo?: string, motorista?: string, placa?: string, tipo?: string, opcoes?: boolean}} filtros
+ *   `opcoes` inclui na resposta as listas de motoristas, placas e tipos para os filtros.
+ */
+export async function carregarResumoDashboardAPI({ periodo = 'todos', motorista = '', placa = '', tipo = '', opcoes = false } = {}) {
+    // A data de referência ("hoje") é a do navegador, não a do servidor
+    const agora = new Date();
+    const hoje = `${agora.getFullYear()}-${String(agora.getMonth() + 1).padStart(2, '0')}-${String(agora.getDate()).padStart(2, '0')}`;
+    const params = { periodo, hoje };
+    if (motorista) params.motorista = motorista;
+    if (placa) params.placa = placa;
+    if (tipo) params.tipo = tipo;
+    if (opcoes) params.opcoes = 1;
+    const response = await axios.get('/api/estatisticas/resumo', { params });
+    return response.data;
+}
+
 export async function cadastrarManutencaoAPI(manutencao) {
     return await axios.post('/api/manutencoes', manutencao);
 }
@@ -45,40 +103,69 @@ export async function atualizarManutencaoAPI(manutencao) {
     return await axios.put(`/api/manutencoes/${manutencao.id}`, manutencao);
 }
 
+/**
+ * Atualização parcial (PATCH): só os campos enviados são alterados. Aceita também
+ * anexos_novos (arquivos em Base64) e anexos_remover (ids), sem reenviar os anexos mantidos.
+ */
+export async function alterarManutencaoAPI(id, alteracoes) {
+    return await axios.patch(`/api/manutencoes/${id}`, alteracoes);
+}
+
 export async function excluirManutencaoAPI(id) {
     return await axios.delete(`/api/manutencoes/${id}`);
 }
 
-export async function exportarExcelAPI() {
-    const response = await axios.get('/api/exportar_excel', { responseType: 'blob' });
-    const url = window.URL.createObjectURL(new Blob([response.data]));
+/**
+ * Acompanha uma tarefa em segundo plano (GET /api/tarefas/<id>) até ela terminar.
+ * @param {string} id Id retornado por POST /api/tarefas.
+ * @param {(tarefa: object) => void} [onProgresso] Chamado a cada consulta com o estado da tarefa.
+ * @returns {Promise<object>} A tarefa concluída; rejeita se ela terminar com erro ou for cancelada.
+ */
+export async function aguardarTarefaAPI(id, onProgresso = null, intervaloMs = 1000) {
+    while (true) {
+        const { data: tarefa } = await axios.get(`/api/tarefas/${id}`);
+        if (onProgresso) onProgresso(tarefa);
+        if (tarefa.status === 'concluida') return tarefa;
+        if (tarefa.status === 'erro') throw new Error(tarefa.erro || 'Erro ao executar a tarefa');
+        if (tarefa.status === 'cancelada') throw new Error('Tarefa cancelada');
+        await new Promise(resolve => setTimeout(resolve, intervaloMs));
+    }
+}
+
+export async function cancelarTarefaAPI(id) {
+    return await axios.post(`/api/tarefas/${id}/cancelar`);
+}
+
+// Baixa o arquivo de uma tarefa concluída direto do servidor, sem carregá-lo na memória do navegador.
+function baixarArquivoTarefa(tarefa) {
     const link = document.createElement('a');
-    link.href = url;
-    link.setAttribute('download', `manutencoes_${new Date().toISOString().split('T')[0]}.xlsx`);
+    link.href = `${API_BASE_URL}${tarefa.url_arquivo}`;
+    link.setAttribute('download', '');
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
-    window.URL.revokeObjectURL(url);
-}
-
-export async function importarExcelAPI(file) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = async function (event) {
-            try {
-                const fileData = event.target.result.split(',')[1];
-                const response = await axios.post('/api/importar_excel', {
-                    file_data: fileData,
-                    filename: file.name
-                });
-                resolve(response);
-            } catch (error) {
-                reject(error);
-            }
-        };
-        reader.onerror = (error) => reject(error);
-        reader.readAsDataURL(file);
-    });
+}
+
+async function exportarEmSegundoPlano(parametros, onProgresso) {
+    const { data } = await axios.post('/api/tarefas', { tipo: 'exportar', parametros });
+    const tarefa = await aguardarTarefaAPI(data.id, onProgresso);
+    baixarArquivoTarefa(tarefa);
+    return tarefa;
+}
+
+export async function exportarExcelAPI(onProgresso = null) {
+    return await exportarEmSegundoPlano({ escopo: 'geral', formato: 'xlsx' }, onProgresso);
+}
+
+export async function importarExcelAPI(file, onProgresso = null) {
+    // O arquivo é enviado como multipart/form-data e importado em segundo plano, em lotes;
+    // o resultado tem o mesmo formato da resposta de /api/importar_excel.
+    const formData = new FormData();
+    formData.append('tipo', 'importar');
+    formData.append('file', file, file.name);
+    const { data } = await axios.post('/api/tarefas', formData);
+    const tarefa = await aguardarTarefaAPI(data.id, onProgresso);
+    return { data: tarefa.resultado };
 }
 
 export async function gerarRelatorioAPI(filtros) {
@@ -86,6 +173,23 @@ export async function gerarRelatorioAPI(filtros) {
     return response.data;
 }
 
-export async function exportarRelatorioExcelAPI(filtros) {
-    return await axios.post('/api/exportar_relatorio_excel', filtros, { responseType: 'blob' });
-}
\ No newline at end of file
+/**
+ * Agrupamentos e tabelas dinâmicas calculados no servidor sobre os fatos pré-agregados
+ * (GET /api/relatorios/cubo). Dimensões: dia, mes, ano, placa, motorista, tipo e local.
+ * @param {{linhas: string[], colunas?: string[], medida?: string, ordem?: string, limit?: number, filtros?: object}} consulta
+ *   `filtros`: data_inicio, data_fim e placa, motorista, tipo, local (texto ou lista).
+ */
+export async function consultarCuboAPI({ linhas, colunas = [], medida = 'valor_total', ordem = 'chave', limit = null, filtros = {} }) {
+    const params = new URLSearchParams({ linhas: linhas.join(','), medida, ordem });
+    if (colunas.length > 0) params.set('colunas', colunas.join(','));
+    if (limit) params.set('limit', limit);
+    Object.entries(filtros).forEach(([campo, valor]) => {
+        (Array.isArray(valor) ? valor : [valor]).filter(Boolean).forEach(item => params.append(campo, item));
+    });
+    const response = await axios.get('/api/relatorios/cubo', { params });
+    return response.data;
+}
+
+export async function exportarRelatorioExcelAPI(filtros, onProgresso = null) {
+    return await exportarEmSegundoPlano({ escopo: 'relatorio', formato: 'xlsx', ...filtros }, onProgresso);
+}
@@ -1,9 +1,12 @@
-import { gerarCores, formatarMoeda, normalizeDate, isSameDay, isSameWeek, isSameMonth } from './utils.js';
+import { gerarCores, formatarMoeda } from './utils.js';
 
 let graficoTipos = null;
 let graficoComparacao = null;
 
-export function atualizarGraficoTipos(manutencoesFiltradas) {
+/**
+ * @param {{tipo: string, quantidade: number}[]} porTipo Distribuição por tipo retornada pelo resumo do dashboard.
+ */
+export function atualizarGraficoTipos(porTipo) {
     const canvas = document.getElementById('grafico-tipos');
     if (!canvas) {
         console.error('Elemento grafico-tipos não encontrado');
@@ -12,13 +15,8 @@ export function atualizarGraficoTipos(manutencoesFiltradas) {
     const ctx = canvas.getContext('2d');
     if (graficoTipos) graficoTipos.destroy();
 
-    const tiposCount = {};
-    manutencoesFiltradas.forEach(man => {
-        tiposCount[man.tipo] = (tiposCount[man.tipo] || 0) + 1;
-    });
-
-    const labels = Object.keys(tiposCount);
-    const data = Object.values(tiposCount);
+    const labels = (porTipo || []).map(item => item.tipo);
+    const data = (porTipo || []).map(item => item.quantidade);
     const cores = gerarCores(labels.length);
 
     if (labels.length === 0) {
@@ -66,7 +64,10 @@ export function atualizarGraficoTipos(manutencoesFiltradas) {
     });
 }
 
-export function atualizarGraficoComparacao(manutencoesFiltradas) {
+/**
+ * @param {{hoje: object, semana: object, mes: object}} comparacao Quantidade e valor por janela, retornados pelo resumo do dashboard.
+ */
+export function atualizarGraficoComparacao(comparacao) {
     const canvas = document.getElementById('grafico-comparacao');
     if (!canvas) {
         console.error('Elemento grafico-comparacao não encontrado');
@@ -75,17 +76,11 @@ export function atualizarGraficoComparacao(manutencoesFiltradas) {
     const ctx = canvas.getContext('2d');
     if (graficoComparacao) graficoComparacao.destroy();
 
-    const hoje = new Date();
-    const hojeUTC = new Date(Date.UTC(hoje.getFullYear(), hoje.getMonth(), hoje.getDate()));
-
-    const atendimentosDia = manutencoesFiltradas.filter(man => isSameDay(normalizeDate(man.data), hojeUTC)).length;
-    const valorDia = manutencoesFiltradas.reduce((acc, man) => isSameDay(normalizeDate(man.data), hojeUTC) ? acc + Number(man.valor || 0) : acc, 0);
-
-    const atendimentosSemana = manutencoesFiltradas.filter(man => isSameWeek(normalizeDate(man.data), hojeUTC)).length;
-    const valorSemana = manutencoesFiltradas.reduce((acc, man) => isSameWeek(normalizeDate(man.data), hojeUTC) ? acc + Number(man.valor || 0) : acc, 0);
-
-    const atendimentosMes = manutencoesFiltradas.filter(man => isSameMonth(normalizeDate(man.data), hojeUTC)).length;
-    const valorMes = manutencoesFiltradas.reduce((acc, man) => isSameMonth(normalizeDate(man.data), hojeUTC) ? acc + Number(man.valor || 0) : acc, 0);
+    const vazio = { quantidade: 0, valor_total: 0 };
+    const { hoje = vazio, semana = vazio, mes = vazio } = comparacao || {};
+    const atendimentosDia = hoje.quantidade, valorDia = hoje.valor_total;
+    const atendimentosSemana = semana.quantidade, valorSemana = semana.valor_total;
+    const atendimentosMes = mes.quantidade, valorMes = mes.valor_total;
 
     if (atendimentosDia === 0 && atendimentosSemana === 0 && atendimentosMes === 0) {
         ctx.clearRect(0, 0, ctx.canvas.width, ctx.canvas.height);
@@ -6,9 +6,16 @@ import * as map from './map.js';
 
 document.addEventListener('DOMContentLoaded', () => {
     // --- STATE ---
+    // Páginas da listagem já carregadas (GET /api/manutencoes paginado por cursor)
     let manutencoes = [];
-    let manutencoesFiltradas = [];
+    let proximoCursor = null;
+    // Busca exibida na tabela: { filtros, itens, proximoCursor }, ou null para a listagem
+    let buscaAtual = null;
     let relatorioAtual = [];
+    // Seq da última alteração já aplicada à cópia local (ver sincronizarAlteracoes)
+    let seqAlteracoes = null;
+    let fluxoAlteracoes = null;
+    let sincronizacaoEmAndamento = null;
 
     // --- DOM ELEMENTS ---
     const loaderOverlay = document.getElementById('loader-overlay');
@@ -19,6 +26,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const formRelatorios = document.getElementById('form-relatorios');
     const colinhaContent = document.getElementById('colinha-content');
     const tabelaManutencoes = document.getElementById('tabela-manutencoes');
+    const carregarMaisBtn = document.getElementById('carregar-mais-manutencoes');
     const navLinks = document.querySelectorAll('.sidebar ul li a');
     const sections = document.querySelectorAll('.section');
 
@@ -50,44 +58,110 @@ document.addEventListener('DOMContentLoaded', () => {
     const filtroListagemTipoSelect = document.getElementById('filtro-listagem-tipo');
     const filtroColinhaInput = document.getElementById('filtro-colinha');
 
+    // Itens buscados por página na listagem e na busca; as seguintes vêm sob demanda ("Carregar mais")
+    const LISTAGEM_LIMITE_PAGINA = 100;
+    // Colunas usadas pela tabela, pela colinha e pelo formulário de edição, e data_iso para a ordenação
+    const LISTAGEM_CAMPOS = ['id', 'data', 'placa', 'motorista', 'telefone', 'tipo', 'oc', 'valor', 'pix',
+        'favorecido', 'local', 'defeito', 'latitude', 'longitude', 'data_iso', 'anexos'];
+
     // --- CORE LOGIC ---
 
-    async function carregarDadosIniciais() {
-        ui.showLoader(loaderOverlay, 'Carregando manutenções...');
+    // Ordem da listagem, a mesma das páginas do servidor: por data_iso (mais nova primeiro) e depois
+    // por ID (mais novo primeiro). 'data' guarda o texto digitado (DD/MM/AAAA ou ISO) e não serve para ordenar
+    function compararManutencoes(a, b) {
+        const dataA = a.data_iso || '';
+        const dataB = b.data_iso || '';
+        if (dataA !== dataB) {
+            return dataA < dataB ? 1 : -1;
+        }
+        return b.id - a.id;
+    }
+
+    function ordenarManutencoes(lista) {
+        const manutencoesTemp = lista.filter(man => {
+            const isValid = man.data && man.placa && man.motorista && man.tipo && man.local && man.defeito;
+            if (!isValid) console.warn('Manutenção com dados incompletos descartada:', man);
+            return isValid;
+        });
+
+        // Força a ordenação no frontend para garantir o comportamento desejado.
+        manutencoesTemp.sort(compararManutencoes);
+        return manutencoesTemp;
+    }
+
+    function buscarManutencaoCarregada(id) {
+        return manutencoes.find(m => m.id == id) || buscaAtual?.itens.find(m => m.id == id);
+    }
+
+    // Exibe na tabela a busca atual ou as páginas carregadas da listagem
+    function exibirTabela() {
+        const itens = buscaAtual ? buscaAtual.itens : manutencoes;
+        ui.atualizarTabela(itens, tabelaManutencoes, handleEditar, handleExcluir);
+        if (carregarMaisBtn) {
+            carregarMaisBtn.style.display = (buscaAtual ? buscaAtual.proximoCursor : proximoCursor) ? '' : 'none';
+        }
+    }
+
+    async function carregarMaisManutencoes() {
+        ui.showLoader(loaderOverlay, 'Carregando mais manutenções...');
         try {
-            const data = await api.carregarManutencoesAPI();
-            console.log('Dados brutos da API:', data);
+            if (buscaAtual) {
+                const busca = buscaAtual;
+                const pagina = await api.carregarPaginaManutencoesAPI({
+                    ...busca.filtros, limit: LISTAGEM_LIMITE_PAGINA, fields: LISTAGEM_CAMPOS, cursor: busca.proximoCursor
+                });
+                if (buscaAtual !== busca) return; // A busca mudou enquanto a página era carregada
+                busca.itens = [...busca.itens, ...pagina.items];
+                busca.proximoCursor = pagina.next_cursor;
+            } else {
+                const pagina = await api.carregarPaginaManutencoesAPI({
+                    limit: LISTAGEM_LIMITE_PAGINA, fields: LISTAGEM_CAMPOS, cursor: proximoCursor
+                });
+                const carregados = new Set(manutencoes.map(man => man.id));
+                manutencoes = ordenarManutencoes([...manutencoes, ...pagina.items.filter(man => !carregados.has(man.id))]);
+                proximoCursor = pagina.next_cursor;
+                ui.atualizarColinha(manutencoes, colinhaContent);
+            }
+            exibirTabela();
+        } catch (error) {
+            console.error('Erro ao carregar mais manutenções:', error);
+            ui.mostrarNotificacao(`Erro ao carregar manutenções: ${error.response?.data?.error || error.message}`, 'error');
+        } finally {
+            ui.hideLoader(loaderOverlay);
+        }
+    }
 
-            let manutencoesTemp = data.filter(man => {
-                const isValid = man.data && man.placa && man.motorista && man.tipo && man.local && man.defeito;
-                if (!isValid) console.warn('Manutenção com dados incompletos descartada:', man);
-                return isValid;
-            });
+    // Com `manterBusca`, uma busca exibida na listagem não é substituída pela lista completa
+    function atualizarTelas(manterBusca = false) {
+        relatorioAtual = [...manutencoes];
 
-            // Força a ordenação no frontend para garantir o comportamento desejado.
-            // Ordena por data (mais nova primeiro) e depois por ID (mais novo primeiro).
-            manutencoesTemp.sort((a, b) => {
-                const dateComparison = b.data.localeCompare(a.data);
-                if (dateComparison !== 0) {
-                    return dateComparison;
-                }
-                return b.id - a.id;
-            });
+        aplicarFiltrosDashboard(true); // Atualiza o dashboard e as opções dos filtros
+        if (!manterBusca) {
+            buscaAtual = null;
+        }
+        exibirTabela();
+        ui.atualizarColinha(manutencoes, colinhaContent);
+        carregarRankings();
+    }
 
-            manutencoes = manutencoesTemp;
+    async function carregarDadosIniciais() {
+        ui.showLoader(loaderOverlay, 'Carregando manutenções...');
+        try {
+            // O seq é lido antes da carga: alterações gravadas durante ela chegam na sincronização
+            const { seq } = await api.carregarAlteracoesAPI();
+            // Só a primeira página; as seguintes são buscadas sob demanda (carregarMaisManutencoes)
+            const pagina = await api.carregarPaginaManutencoesAPI({ limit: LISTAGEM_LIMITE_PAGINA, fields: LISTAGEM_CAMPOS });
+
+            manutencoes = ordenarManutencoes(pagina.items);
+            proximoCursor = pagina.next_cursor;
+            seqAlteracoes = seq;
 
             if (manutencoes.length === 0) {
                 ui.mostrarNotificacao('Nenhuma manutenção encontrada no banco de dados.', 'info', 10000);
             }
 
-            manutencoesFiltradas = [...manutencoes];
-            relatorioAtual = [...manutencoes];
-
-            ui.atualizarFiltros(manutencoes, uiElements);
-            aplicarFiltrosDashboard(); // Atualiza o dashboard com os dados completos
-            ui.atualizarTabela(manutencoes, tabelaManutencoes, handleEditar, handleExcluir);
-            ui.atualizarColinha(manutencoes, colinhaContent);
-            carregarRankings();
+            atualizarTelas();
+            iniciarFluxoAlteracoes();
 
         } catch (error) {
             console.error('Erro ao carregar manutenções:', error);
@@ -95,15 +169,94 @@ document.addEventListener('DOMContentLoaded', () => {
             ui.mostrarNotificacao(`Erro ao carregar dados: ${errorMessage}`, 'error', 10000);
             // Limpa a UI em caso de erro
             manutencoes = [];
-            manutencoesFiltradas = [];
-            ui.atualizarDashboardUI([], uiElements);
-            ui.atualizarTabela([], tabelaManutencoes, handleEditar, handleExcluir);
+            proximoCursor = null;
+            buscaAtual = null;
+            ui.atualizarDashboardUI(null, uiElements);
+            exibirTabela();
             ui.atualizarColinha([], colinhaContent);
         } finally {
             ui.hideLoader(loaderOverlay);
         }
     }
 
+    /**
+     * Aplica à cópia local um trecho do registro de alterações (GET /api/alteracoes ou evento SSE).
+     * Trechos já aplicados são ignorados. Retorna true se alguma manutenção ou anexo mudou.
+     * Enquanto houver páginas não carregadas, só entram as manutenções que ficam antes da última
+     * carregada; as demais chegam com as próximas páginas, que continuam a partir dela.
+     */
+    function aplicarAlteracoes(alteracoes) {
+        if (seqAlteracoes === null || alteracoes.seq <= seqAlteracoes) return false;
+        const limite = proximoCursor ? manutencoes[manutencoes.length - 1] : null;
+        const porId = new Map(manutencoes.map(man => [man.id, man]));
+        const { manutencoes: alteradas, anexos } = alteracoes;
+        if (alteradas) {
+            alteradas.excluidos.forEach(id => porId.delete(id));
+            alteradas.gravados.forEach(man => porId.set(man.id, { ...man, anexos: porId.get(man.id)?.anexos || [] }));
+        }
+        if (anexos) {
+            const substituidos = new Set([...anexos.excluidos, ...anexos.gravados.map(anexo => anexo.id)]);
+            porId.forEach(man => {
+                man.anexos = (man.anexos || []).filter(anexo => !substituidos.has(anexo.id));
+            });
+            anexos.gravados.forEach(anexo => porId.get(anexo.manutencao_id)?.anexos.push(anexo));
+        }
+        manutencoes = ordenarManutencoes([...porId.values()]);
+        if (limite) {
+            manutencoes = manutencoes.filter(man => compararManutencoes(man, limite) <= 0);
+        }
+        seqAlteracoes = alteracoes.seq;
+        return Boolean(alteradas || anexos);
+    }
+
+    // Busca só o que mudou desde a última sincronização, em vez de recarregar todas as manutenções
+    function sincronizarAlteracoes() {
+        if (seqAlteracoes === null) return carregarDadosIniciais();
+        // Chamadas simultâneas (ex.: cadastro e evento do fluxo) esperam a que está em andamento
+        const sincronizacao = (sincronizacaoEmAndamento || Promise.resolve()).then(async () => {
+            let mudou = false;
+            let alteracoes;
+            do {
+                alteracoes = await api.carregarAlteracoesAPI(seqAlteracoes);
+                mudou = aplicarAlteracoes(alteracoes) || mudou;
+            } while (alteracoes.mais);
+            if (mudou) atualizarTelas();
+        }).catch(error => {
+            if (error.response?.status === 410) {
+                console.warn('Registro de alterações compactado; recarregando tudo.');
+                seqAlteracoes = null;
+                return carregarDadosIniciais();
+            }
+            console.error('Erro ao sincronizar alterações:', error);
+            ui.mostrarNotificacao(`Erro ao atualizar os dados: ${error.response?.data?.error || error.message}`, 'error');
+        }).finally(() => {
+            if (sincronizacaoEmAndamento === sincronizacao) sincronizacaoEmAndamento = null;
+        });
+        sincronizacaoEmAndamento = sincronizacao;
+        return sincronizacao;
+    }
+
+    // Recebe as alterações feitas por outros usuários assim que são gravadas (Server-Sent Events)
+    function iniciarFluxoAlteracoes() {
+        if (!window.EventSource) return;
+        if (fluxoAlteracoes) fluxoAlteracoes.close();
+        fluxoAlteracoes = api.abrirFluxoAlteracoes(seqAlteracoes);
+        fluxoAlteracoes.addEventListener('alteracoes', evento => {
+            const alteracoes = JSON.parse(evento.data);
+            if (alteracoes.desde > seqAlteracoes || sincronizacaoEmAndamento) {
+                // Trecho não é contíguo à cópia local: busca o que falta
+                sincronizarAlteracoes();
+            } else if (aplicarAlteracoes(alteracoes)) {
+                atualizarTelas(true);
+            }
+        });
+        fluxoAlteracoes.addEventListener('recarregar', () => {
+            fluxoAlteracoes.close();
+            fluxoAlteracoes = null;
+            carregarDadosIniciais();
+        });
+    }
+
     async function carregarRankings() {
         try {
             const rankings = await api.carregarRankingsAPI();
@@ -114,72 +267,37 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function aplicarFiltrosDashboard() {
-        let dadosFiltrados = [...manutencoes];
-
-        if (uiElements.filtroMotorista?.value) {
-            dadosFiltrados = dadosFiltrados.filter(m => m.motorista === uiElements.filtroMotorista.value);
-        }
-        if (uiElements.filtroPlaca?.value) {
-            dadosFiltrados = dadosFiltrados.filter(m => m.placa === uiElements.filtroPlaca.value);
-        }
-        if (uiElements.filtroTipo?.value) {
-            dadosFiltrados = dadosFiltrados.filter(m => m.tipo === uiElements.filtroTipo.value);
-        }
-
-        if (filtroPeriodo?.value !== 'todos') {
-            const hoje = new Date();
-            const hojeUTC = new Date(Date.UTC(hoje.getFullYear(), hoje.getMonth(), hoje.getDate()));
-            let dataInicio, dataFim;
-
-            switch (filtroPeriodo.value) {
-                case 'hoje':
-                    dataInicio = new Date(Date.UTC(hojeUTC.getUTCFullYear(), hojeUTC.getUTCMonth(), hojeUTC.getUTCDate()));
-                    dataFim = new Date(Date.UTC(hojeUTC.getUTCFullYear(), hojeUTC.getUTCMonth(), hojeUTC.getUTCDate(), 23, 59, 59, 999));
-                    break;
-                case 'semana':
-                    const dayOfWeek = hojeUTC.getUTCDay();
-                    dataInicio = new Date(Date.UTC(hojeUTC.getUTCFullYear(), hojeUTC.getUTCMonth(), hojeUTC.getUTCDate() - dayOfWeek));
-                    dataFim = new Date(Date.UTC(dataInicio.getUTCFullYear(), dataInicio.getUTCMonth(), dataInicio.getUTCDate() + 6, 23, 59, 59, 999));
-                    break;
-                case 'mes':
-                    dataInicio = new Date(Date.UTC(hojeUTC.getUTCFullYear(), hojeUTC.getUTCMonth(), 1));
-                    dataFim = new Date(Date.UTC(hojeUTC.getUTCFullYear(), hojeUTC.getUTCMonth() + 1, 0, 23, 59, 59, 999));
-                    break;
-                case 'trimestre':
-                    const trimestre = Math.floor(hojeUTC.getUTCMonth() / 3);
-                    dataInicio = new Date(Date.UTC(hojeUTC.getUTCFullYear(), trimestre * 3, 1));
-                    dataFim = new Date(Date.UTC(hojeUTC.getUTCFullYear(), (trimestre + 1) * 3, 0, 23, 59, 59, 999));
-                    break;
-                case 'ano':
-                    dataInicio = new Date(Date.UTC(hojeUTC.getUTCFullYear(), 0, 1));
-                    dataFim = new Date(Date.UTC(hojeUTC.getUTCFullYear(), 11, 31, 23, 59, 59, 999));
-                    break;
-            }
-
-            if (dataInicio && dataFim) {
-                dadosFiltrados = dadosFiltrados.filter(m => {
-                    const dataMan = utils.normalizeDate(m.data);
-                    return dataMan && dataMan.getTime() >= dataInicio.getTime() && dataMan.getTime() <= dataFim.getTime();
-                });
+    // Os KPIs e gráficos do dashboard são calculados no servidor (GET /api/estatisticas/resumo)
+    async function aplicarFiltrosDashboard(carregarOpcoes = false) {
+        try {
+            const resumo = await api.carregarResumoDashboardAPI({
+                periodo: filtroPeriodo?.value || 'todos',
+                motorista: uiElements.filtroMotorista?.value || '',
+                placa: uiElements.filtroPlaca?.value || '',
+                tipo: uiElements.filtroTipo?.value || '',
+                opcoes: carregarOpcoes
+            });
+            if (resumo.opcoes) {
+                ui.atualizarFiltros(resumo.opcoes, uiElements);
             }
+            ui.atualizarDashboardUI(resumo, uiElements);
+            charts.atualizarGraficoTipos(resumo.por_tipo);
+            charts.atualizarGraficoComparacao(resumo.comparacao);
+        } catch (error) {
+            console.error('Erro ao carregar o resumo do dashboard:', error);
+            ui.mostrarNotificacao(`Erro ao carregar o dashboard: ${error.response?.data?.error || error.message}`, 'error');
         }
-
-        manutencoesFiltradas = dadosFiltrados;
-        ui.atualizarDashboardUI(manutencoesFiltradas, uiElements);
-        charts.atualizarGraficoTipos(manutencoesFiltradas);
-        charts.atualizarGraficoComparacao(manutencoesFiltradas);
     }
 
     // --- EVENT HANDLERS ---
 
     function handleEditar(id) {
-        const manutencao = manutencoes.find(m => m.id == id);
+        const manutencao = buscarManutencaoCarregada(id);
         ui.preencherFormularioEdicao(manutencao, formEditar, modal);
     }
 
     async function handleExcluir(id) {
-        const manutencao = manutencoes.find(m => m.id == id);
+        const manutencao = buscarManutencaoCarregada(id);
         if (!manutencao) return;
 
         if (confirm(`Tem certeza que deseja excluir a manutenção da placa ${manutencao.placa}?`)) {
@@ -187,7 +305,7 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 await api.excluirManutencaoAPI(id);
                 ui.mostrarNotificacao('Manutenção excluída com sucesso!', 'success');
-                carregarDadosIniciais();
+                sincronizarAlteracoes();
             } catch (error) {
                 console.error('Erro ao excluir manutenção:', error);
                 ui.mostrarNotificacao(`Erro ao excluir: ${error.response?.data?.error || error.message}`, 'error');
@@ -252,7 +370,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 ui.mostrarNotificacao('Manutenção cadastrada com sucesso!', 'success');
                 formCadastrar.reset();
                 anexoInput.value = ''; // Limpa o campo de arquivo
-                carregarDadosIniciais();
+                sincronizarAlteracoes();
             } catch (error) {
                 console.error('Erro ao cadastrar manutenção:', error);
                 ui.mostrarNotificacao(`Erro ao cadastrar: ${error.response?.data?.error || error.message}`, 'error');
@@ -281,6 +399,9 @@ document.addEventListener('DOMContentLoaded', () => {
             });
 
             const novosAnexos = await Promise.all(anexoPromises);
+            // Anexos existentes marcados para remoção; os demais não são reenviados
+            const anexosRemover = Array.from(formEditar.querySelectorAll('#anexo-atual-container .anexo-item-atual.removido'))
+                .map(item => Number(item.dataset.id));
 
             const manutencao = {
                 id: formData.get('id'),
@@ -294,19 +415,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 pix: formData.get('pix') || '',
                 favorecido: formData.get('favorecido') || '',
                 local: formData.get('local').trim(),
-                defeito: formData.get('defeito').trim(),
-                // A lógica do backend é de substituição total.
-                // Se o usuário não selecionar novos arquivos, a lista de anexos será vazia, e o backend removerá todos os anexos existentes.
-                anexos: novosAnexos
+                defeito: formData.get('defeito').trim()
             };
 
             try {
                 utils.validarDadosManutencao(manutencao);
-                await api.atualizarManutencaoAPI(manutencao);
+                // PATCH: o servidor grava apenas os campos que mudaram e só os anexos novos/removidos
+                const { id, ...campos } = manutencao;
+                await api.alterarManutencaoAPI(id, {
+                    ...campos,
+                    anexos_novos: novosAnexos,
+                    anexos_remover: anexosRemover
+                });
                 ui.mostrarNotificacao('Manutenção atualizada com sucesso!', 'success');
                 if (modal) modal.style.display = 'none';
                 anexoInput.value = ''; // Limpa o campo de arquivo
-                carregarDadosIniciais();
+                sincronizarAlteracoes();
             } catch (error) {
                 console.error('Erro ao atualizar manutenção:', error);
                 ui.mostrarNotificacao(`Erro ao atualizar: ${error.response?.data?.error || error.message}`, 'error');
@@ -317,7 +441,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     if (aplicarFiltrosBtn) {
-        aplicarFiltrosBtn.addEventListener('click', aplicarFiltrosDashboard);
+        aplicarFiltrosBtn.addEventListener('click', () => aplicarFiltrosDashboard());
     }
 
     if (limparFiltrosBtn) {
@@ -347,11 +471,20 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Atualiza a mensagem do loader com o progresso de uma tarefa em segundo plano
+    function mostrarProgressoTarefa(mensagem, tarefa) {
+        if (tarefa.progresso != null) {
+            ui.showLoader(loaderOverlay, `${mensagem} ${Math.round(tarefa.progresso * 100)}%`);
+        } else if (tarefa.linhas_processadas > 0) {
+            ui.showLoader(loaderOverlay, `${mensagem} ${tarefa.linhas_processadas} linhas`);
+        }
+    }
+
     if (exportarExcelBtn) {
         exportarExcelBtn.addEventListener('click', async () => {
             ui.showLoader(loaderOverlay, 'Gerando arquivo Excel...');
             try {
-                await api.exportarExcelAPI();
+                await api.exportarExcelAPI(tarefa => mostrarProgressoTarefa('Gerando arquivo Excel...', tarefa));
                 ui.mostrarNotificacao('Exportação para Excel concluída!', 'success');
             } catch (error) {
                 console.error('Erro ao exportar para Excel:', error);
@@ -369,10 +502,15 @@ document.addEventListener('DOMContentLoaded', () => {
             if (file) {
                 ui.showLoader(loaderOverlay, 'Importando arquivo...');
                 try {
-                    const response = await api.importarExcelAPI(file);
+                    const response = await api.importarExcelAPI(file, tarefa => mostrarProgressoTarefa('Importando arquivo...', tarefa));
                     ui.mostrarNotificacao(response.data.message, 'success');
+                    if (response.data.rejeitadas > 0) {
+                        const exemplos = response.data.erros.slice(0, 5).map(e => `linha ${e.linha}: ${e.motivo}`).join('; ');
+                        console.warn('Linhas rejeitadas na importação:', response.data.erros);
+                        ui.mostrarNotificacao(`${response.data.rejeitadas} linha(s) rejeitada(s). ${exemplos}`, 'info', 15000);
+                    }
                     fileInput.value = '';
-                    carregarDadosIniciais();
+                    sincronizarAlteracoes();
                 } catch (error) {
                     console.error('Erro ao importar Excel:', error);
                     ui.mostrarNotificacao(`Erro ao importar: ${error.response?.data?.error || error.message}`, 'error');
@@ -384,24 +522,32 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     if (aplicarFiltroListagemBtn) {
-        aplicarFiltroListagemBtn.addEventListener('click', () => {
-            let dadosFiltrados = [...manutencoes];
-            const termo = filtroListagemInput.value.toLowerCase();
-            const telefone = filtroListagemTelefoneInput.value;
+        aplicarFiltroListagemBtn.addEventListener('click', async () => {
+            const q = filtroListagemInput.value.trim();
+            const telefone = filtroListagemTelefoneInput.value.trim();
             const tipo = filtroListagemTipoSelect.value;
 
-            if (termo) {
-                dadosFiltrados = dadosFiltrados.filter(man =>
-                    Object.values(man).some(value => value && value.toString().toLowerCase().includes(termo))
-                );
-            }
-            if (telefone) {
-                dadosFiltrados = dadosFiltrados.filter(man => man.telefone && man.telefone.includes(telefone));
+            if (!q && !telefone && !tipo) {
+                buscaAtual = null;
+                exibirTabela();
+                return;
             }
-            if (tipo) {
-                dadosFiltrados = dadosFiltrados.filter(man => man.tipo === tipo);
+
+            // A busca é feita no servidor (índice de texto e de telefone parcial); os itens
+            // vêm ordenados por relevância quando há termo de busca.
+            ui.showLoader(loaderOverlay, 'Buscando manutenções...');
+            try {
+                const filtros = { q, telefone, tipo };
+                const pagina = await api.carregarPaginaManutencoesAPI({ ...filtros, limit: LISTAGEM_LIMITE_PAGINA, fields: LISTAGEM_CAMPOS });
+                buscaAtual = { filtros, itens: pagina.items, proximoCursor: pagina.next_cursor };
+                exibirTabela();
+            } catch (error) {
+                console.error('Erro ao filtrar manutenções:', error);
+                const errorMessage = error.response?.data?.error || error.message || 'Erro desconhecido';
+                ui.mostrarNotificacao(`Erro ao filtrar manutenções: ${errorMessage}`, 'error');
+            } finally {
+                ui.hideLoader(loaderOverlay);
             }
-            ui.atualizarTabela(dadosFiltrados, tabelaManutencoes, handleEditar, handleExcluir);
         });
     }
 
@@ -410,10 +556,15 @@ document.addEventListener('DOMContentLoaded', () => {
             filtroListagemInput.value = '';
             filtroListagemTelefoneInput.value = '';
             filtroListagemTipoSelect.value = '';
-            ui.atualizarTabela(manutencoes, tabelaManutencoes, handleEditar, handleExcluir);
+            buscaAtual = null;
+            exibirTabela();
         });
     }
 
+    if (carregarMaisBtn) {
+        carregarMaisBtn.addEventListener('click', carregarMaisManutencoes);
+    }
+
     if (formRelatorios) {
         formRelatorios.addEventListener('submit', async (e) => {
             e.preventDefault();
@@ -426,14 +577,21 @@ document.addEventListener('DOMContentLoaded', () => {
             };
 
             try {
-                relatorioAtual = await api.gerarRelatorioAPI(filtros);
+                // Totais e custo por placa e mês vêm agregados do servidor; as linhas, só para a listagem
+                const [linhas, porPlaca, porPlacaMes] = await Promise.all([
+                    api.gerarRelatorioAPI(filtros),
+                    api.consultarCuboAPI({ linhas: ['placa'], filtros }),
+                    api.consultarCuboAPI({ linhas: ['placa'], colunas: ['mes'], ordem: 'medida', filtros })
+                ]);
+                relatorioAtual = linhas;
                 const relatorioElements = {
                     statsContainer: document.getElementById('relatorio-stats'),
+                    pivoContainer: document.getElementById('relatorio-pivo'),
                     tabelaContainer: document.getElementById('relatorio-tabela'),
                     exportarRelatorioBtn: formRelatorios.querySelector('button.btn-success')
                 };
                 document.getElementById('resultado-relatorio').style.display = 'block';
-                ui.atualizarRelatorioUI(relatorioAtual, relatorioElements);
+                ui.atualizarRelatorioUI(relatorioAtual, relatorioElements, { porPlaca, porPlacaMes });
                 ui.mostrarNotificacao('Relatório gerado com sucesso!', 'success');
             } catch (error) {
                 console.error('Erro ao gerar relatório:', error);
@@ -458,15 +616,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     motorista: document.getElementById('motorista').value,
                 };
                 try {
-                    const response = await api.exportarRelatorioExcelAPI(filtros);
-                    const url = window.URL.createObjectURL(new Blob([response.data]));
-                    const link = document.createElement('a');
-                    link.href = url;
-                    link.setAttribute('download', `relatorio_${filtros.data_inicio}_a_${filtros.data_fim}.xlsx`);
-                    document.body.appendChild(link);
-                    link.click();
-                    document.body.removeChild(link);
-                    window.URL.revokeObjectURL(url);
+                    await api.exportarRelatorioExcelAPI(filtros, tarefa => mostrarProgressoTarefa('Exportando relatório...', tarefa));
                     ui.mostrarNotificacao('Relatório exportado com sucesso!', 'success');
                 } catch (error) {
                     console.error('Erro ao exportar relatório:', error);
@@ -6,6 +6,14 @@ let routeControl;
 let unidades = [];
 let prestadores = [];
 let geocoder;
+// Visão sem filtros: marcadores agrupados pelo servidor e redesenhados a cada movimento
+let visaoAgrupada = false;
+let requisicaoAgrupamentos = 0;
+
+// Quantidade máxima de prestadores retornados pelas buscas por raio
+const LIMITE_LOCAIS_PROXIMOS = 1000;
+// Operações por requisição na importação de backup (limite padrão do servidor)
+const LOTE_IMPORTACAO_LOCAIS = 1000;
 
 // Mapeia os valores internos para nomes amigáveis
 const tipoServicoNomes = {
@@ -298,6 +306,11 @@ function configurarEventosMapa() {
       }
     }
   });
+
+  // Na visão sem filtros, os agrupamentos dependem do zoom e da área visível
+  mapa.on('moveend', function() {
+    if (visaoAgrupada) renderizarAgrupamentos();
+  });
 }
 
 /**
@@ -520,17 +533,17 @@ async function salvarCadastro(tipo, form) {
 }
 
 /**
- * Busca endereço por coordenadas usando API de geocoding reverso
+ * Busca endereço por coordenadas (geocodificação reversa no servidor, com cache)
  */
 async function buscarEnderecoPorCoordenadas(lat, lng) {
   try {
-    const response = await fetch(
-      `https://nominatim.openstreetmap.org/reverse?lat=${lat}&lon=${lng}&format=json&addressdetails=1&accept-language=pt-BR`
-    );
-    const data = await response.json();
+    const response = await axios.get('/api/geocodificacao/reversa', {
+      params: { lat, lng },
+      validateStatus: status => status === 200 || status === 404
+    });
     
-    if (data && data.display_name) {
-      return data.display_name;
+    if (response.status === 200 && response.data.endereco) {
+      return response.data.endereco;
     }
   } catch (error) {
     console.warn('Erro ao buscar endereço:', error);
@@ -552,13 +565,6 @@ async function carregarDadosDoServidor() {
     unidades = locais.filter(l => l.tipo === 'unidade');
     prestadores = locais.filter(l => l.tipo !== 'unidade');
 
-    // Converte a string de serviços de volta para um array
-    prestadores.forEach(p => {
-      if (p.servicos && typeof p.servicos === 'string') {
-        p.servicos = p.servicos.split(',').filter(s => s);
-      }
-    });
-
     adicionarMarcadores();
     popularFiltros();
   } catch (error) {
@@ -568,33 +574,77 @@ async function carregarDadosDoServidor() {
 }
 
 /**
- * Adiciona todos os marcadores no mapa
+ * Adiciona todos os marcadores no mapa (visão sem filtros). Os pontos são agrupados no
+ * servidor conforme o zoom e a área visível, e redesenhados a cada movimento do mapa.
  */
 function adicionarMarcadores() {
   if (!markersLayer) return;
-  
-  markersLayer.clearLayers();
-
-  // Adiciona marcadores das unidades
-  unidades.forEach(unidade => {
-    const marker = L.marker([unidade.latitude, unidade.longitude], { 
-      icon: icones.unidade 
-    }).addTo(markersLayer);
+  visaoAgrupada = true;
+  renderizarAgrupamentos();
+}
 
-    const popupContent = criarPopupUnidade(unidade);
-    marker.bindPopup(popupContent);
+/**
+ * Ícone de um grupo de pontos, com a quantidade
+ */
+function iconeGrupo(grupo) {
+  const cor = grupo.categoria === 'unidade' ? '#ff6b35' : '#28a745';
+  const tamanho = grupo.quantidade < 10 ? 30 : grupo.quantidade < 100 ? 36 : 44;
+  return L.divIcon({
+    className: 'custom-div-icon',
+    html: `<div style="background: ${cor}; color: white; border-radius: 50%; width: ${tamanho}px; height: ${tamanho}px; display: flex; align-items: center; justify-content: center; font-size: 13px; font-weight: bold; border: 3px solid rgba(255,255,255,0.8); box-shadow: 0 2px 5px rgba(0,0,0,0.3);">${grupo.quantidade}</div>`,
+    iconSize: [tamanho, tamanho],
+    iconAnchor: [tamanho / 2, tamanho / 2]
   });
-  
-  // Adiciona marcadores dos prestadores
-  prestadores.forEach(prestador => {
-    const icone = icones[prestador.tipo] || icones.fornecedor;
-    const marker = L.marker([prestador.latitude, prestador.longitude], { 
-      icon: icone 
-    }).addTo(markersLayer);
+}
 
-    const popupContent = criarPopupPrestador(prestador);
-    marker.bindPopup(popupContent);
-  });
+/**
+ * Busca os grupos da área visível (GET /api/mapa/agrupamentos) e desenha os marcadores
+ */
+async function renderizarAgrupamentos() {
+  const limites = mapa.getBounds();
+  const requisicao = ++requisicaoAgrupamentos;
+  try {
+    const response = await axios.get('/api/mapa/agrupamentos', {
+      params: {
+        zoom: Math.round(mapa.getZoom()),
+        min_lat: Math.max(limites.getSouth(), -90),
+        max_lat: Math.min(limites.getNorth(), 90),
+        min_lng: Math.max(limites.getWest(), -180),
+        max_lng: Math.min(limites.getEast(), 180)
+      }
+    });
+    // Ignora respostas de movimentos anteriores ou que chegaram depois de um filtro
+    if (requisicao !== requisicaoAgrupamentos || !visaoAgrupada) return;
+
+    markersLayer.clearLayers();
+    const unidadesPorId = new Map(unidades.map(u => [u.id, u]));
+    const prestadoresMap = new Map(prestadores.map(p => [p.id, p]));
+
+    response.data.forEach(item => {
+      if (item.quantidade > 1) {
+        const [minLat, minLng, maxLat, maxLng] = item.limites;
+        L.marker([item.latitude, item.longitude], { icon: iconeGrupo(item) })
+          .on('click', () => mapa.fitBounds([[minLat, minLng], [maxLat, maxLng]], { padding: [20, 20] }))
+          .addTo(markersLayer);
+        return;
+      }
+      const unidade = unidadesPorId.get(item.id);
+      if (unidade) {
+        L.marker([unidade.latitude, unidade.longitude], { icon: icones.unidade })
+          .bindPopup(criarPopupUnidade(unidade))
+          .addTo(markersLayer);
+        return;
+      }
+      const prestador = prestadoresMap.get(item.id);
+      if (prestador) {
+        L.marker([prestador.latitude, prestador.longitude], { icon: icones[prestador.tipo] || icones.fornecedor })
+          .bindPopup(criarPopupPrestador(prestador))
+          .addTo(markersLayer);
+      }
+    });
+  } catch (error) {
+    console.error('Erro ao carregar agrupamentos do mapa:', error);
+  }
 }
 
 /**
@@ -626,7 +676,7 @@ function popularFiltros() {
 /**
  * Aplica filtros selecionados
  */
-function aplicarFiltros() {
+async function aplicarFiltros() {
   const baseId = document.getElementById('filtro-base')?.value;
   const tipoServico = document.getElementById('filtro-tipo-servico')?.value;
   const raio = document.getElementById('filtro-raio')?.value;
@@ -634,19 +684,22 @@ function aplicarFiltros() {
   let prestadoresFiltrados = [...prestadores];
   let baseSelecionada = null;
 
-  // Filtra por base (raio)
+  // Filtra por base (raio) e tipo no servidor, pelo índice espacial
   if (baseId && raio) {
     baseSelecionada = unidades.find(u => u.id == baseId);
     if (baseSelecionada) {
-      prestadoresFiltrados = prestadoresFiltrados.filter(prestador => {
-        const distancia = calcularDistancia(
-          baseSelecionada.latitude, 
-          baseSelecionada.longitude,
-          prestador.latitude, 
-          prestador.longitude
-        );
-        return distancia <= parseInt(raio);
-      });
+      try {
+        const proximos = await buscarLocaisProximos(baseSelecionada.latitude, baseSelecionada.longitude, {
+          raio_km: parseInt(raio),
+          tipo: tipoServico,
+          limit: LIMITE_LOCAIS_PROXIMOS
+        });
+        prestadoresFiltrados = prestadoresPorId(proximos);
+      } catch (error) {
+        console.error('Erro ao buscar prestadores próximos:', error);
+        mostrarNotificacao('Erro ao buscar prestadores próximos!', 'error');
+        return;
+      }
     }
   }
 
@@ -673,6 +726,7 @@ function aplicarFiltros() {
  * Atualiza marcadores no mapa conforme filtros
  */
 function atualizarMarcadores(prestadoresFiltrados, baseSelecionada = null) {
+  visaoAgrupada = false;
   markersLayer.clearLayers();
 
   // Sempre mostra todas as unidades
@@ -766,6 +820,7 @@ function filtrarPorTexto() {
  * Atualiza marcadores com filtro de texto
  */
 function atualizarMarcadoresComTexto(prestadoresFiltrados, unidadesFiltradas) {
+  visaoAgrupada = false;
   markersLayer.clearLayers();
 
   // Adiciona unidades filtradas
@@ -886,7 +941,7 @@ window.buscarPrestadoresProximos = function(unidadeId) {
 /**
  * Cria rota até um prestador
  */
-window.criarRota = function(prestadorId) {
+window.criarRota = async function(prestadorId) {
   const prestador = prestadores.find(p => p.id === prestadorId);
   if (!prestador) return;
 
@@ -897,18 +952,16 @@ window.criarRota = function(prestadorId) {
   if (baseIdSelecionada) {
     baseOrigem = unidades.find(u => u.id == baseIdSelecionada);
   } else {
-    // Encontra a base mais próxima
-    let menorDistancia = Infinity;
-    unidades.forEach(unidade => {
-      const distancia = calcularDistancia(
-        unidade.latitude, unidade.longitude,
-        prestador.latitude, prestador.longitude
-      );
-      if (distancia < menorDistancia) {
-        menorDistancia = distancia;
-        baseOrigem = unidade;
-      }
-    });
+    // Encontra a base mais próxima (consulta dos k mais próximos no servidor, com k = 1)
+    try {
+      const [maisProxima] = await buscarLocaisProximos(prestador.latitude, prestador.longitude, {
+        categoria: 'unidade',
+        limit: 1
+      });
+      baseOrigem = maisProxima ? unidades.find(u => u.id === maisProxima.id) : null;
+    } catch (error) {
+      console.error('Erro ao buscar a base mais próxima:', error);
+    }
   }
 
   if (!baseOrigem) return;
@@ -1207,18 +1260,25 @@ function limparRota() {
 }
 
 /**
- * Calcula distância entre dois pontos em km (Fórmula de Haversine)
+ * Consulta os locais próximos de um ponto no servidor (GET /api/mapa/locais/proximos),
+ * ordenados por distância. Por padrão, apenas prestadores.
+ * @param {{raio_km?: number, tipo?: string, servicos?: string, servicos_modo?: string, estado?: string, cidade?: string, categoria?: string, limit?: number}} filtros
+ */
+async function buscarLocaisProximos(lat, lng, filtros = {}) {
+  const params = { lat, lng, categoria: 'prestador' };
+  Object.entries(filtros).forEach(([chave, valor]) => {
+    if (valor !== undefined && valor !== null && valor !== '') params[chave] = valor;
+  });
+  const response = await axios.get('/api/mapa/locais/proximos', { params });
+  return response.data;
+}
+
+/**
+ * Converte os locais retornados pelo servidor nos prestadores já carregados, mantendo a ordem
  */
-function calcularDistancia(lat1, lng1, lat2, lng2) {
-  const R = 6371; // Raio da Terra em km
-  const dLat = (lat2 - lat1) * Math.PI / 180;
-  const dLng = (lng2 - lng1) * Math.PI / 180;
-  const a = 
-    Math.sin(dLat/2) * Math.sin(dLat/2) +
-    Math.cos(lat1 * Math.PI / 180) * Math.cos(lat2 * Math.PI / 180) * 
-    Math.sin(dLng/2) * Math.sin(dLng/2);
-  const c = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1-a));
-  return R * c;
+function prestadoresPorId(locais) {
+  const porId = new Map(prestadores.map(p => [p.id, p]));
+  return locais.map(l => porId.get(l.id)).filter(Boolean);
 }
 
 /**
@@ -1307,8 +1367,7 @@ export function importarDados() {
         
         // Valida estrutura dos dados
         if (dados.unidades && dados.prestadores && Array.isArray(dados.unidades) && Array.isArray(dados.prestadores)) {
-          // TODO: Implementar lógica de importação para o servidor
-          mostrarNotificacao('Funcionalidade de importação ainda não conectada ao servidor.', 'info');
+          await importarLocaisEmLote([...dados.unidades, ...dados.prestadores]);
         } else {
           mostrarNotificacao('Formato de arquivo inválido!', 'error');
         }
@@ -1324,6 +1383,36 @@ export function importarDados() {
   input.click();
 }
 
+/**
+ * Envia os locais de um backup ao servidor em lotes (POST /api/mapa/locais/lote): locais
+ * com id já cadastrado são atualizados e os demais, criados. Falhas individuais não
+ * impedem a gravação dos demais locais.
+ */
+async function importarLocaisEmLote(locais) {
+  const idsExistentes = new Set([...unidades, ...prestadores].map(l => l.id));
+  const operacoes = locais.map(({ id, ...dados }) => (
+    idsExistentes.has(id) ? { op: 'atualizar', id, dados } : { op: 'criar', dados }
+  ));
+
+  let sucessos = 0;
+  let falhas = 0;
+  for (let i = 0; i < operacoes.length; i += LOTE_IMPORTACAO_LOCAIS) {
+    const response = await axios.post('/api/mapa/locais/lote', {
+      modo: 'melhor_esforco',
+      operacoes: operacoes.slice(i, i + LOTE_IMPORTACAO_LOCAIS)
+    });
+    sucessos += response.data.sucessos;
+    falhas += response.data.falhas;
+    response.data.resultados
+      .filter(r => r.error)
+      .forEach(r => console.warn(`Local ${i + r.indice + 1} do backup não importado: ${r.error}`));
+  }
+
+  await carregarDadosDoServidor();
+  mostrarNotificacao(`${sucessos} locais importados${falhas ? `, ${falhas} com erro (veja o console)` : ''}.`,
+    falhas ? 'warning' : 'success');
+}
+
 /**
  * Limpa todos os dados (reset)
  */
@@ -1411,16 +1500,16 @@ export function gerarRelatorio() {
  */
 export async function buscarPorEndereco(endereco) {
   try {
-    // Busca coordenadas do endereço usando API Nominatim
-    const response = await fetch(
-      `https://nominatim.openstreetmap.org/search?q=${encodeURIComponent(endereco)}&format=json&addressdetails=1&limit=1&accept-language=pt-BR`
-    );
-    const data = await response.json();
+    // Busca coordenadas do endereço no servidor (cache + gazetteer local + Nominatim)
+    const response = await axios.get('/api/geocodificacao', {
+      params: { endereco },
+      validateStatus: status => status === 200 || status === 404
+    });
     
-    if (data && data.length > 0) {
-      const local = data[0];
-      const lat = parseFloat(local.lat);
-      const lng = parseFloat(local.lon);
+    if (response.status === 200) {
+      const local = response.data;
+      const lat = local.latitude;
+      const lng = local.longitude;
       
       // Centraliza mapa no endereço encontrado
       mapa.setView([lat, lng], 13);
@@ -1435,23 +1524,23 @@ export async function buscarPorEndereco(endereco) {
         })
       }).addTo(mapa);
       
-      marcadorTemp.bindPopup(`<strong>📍 Localização Encontrada:</strong><br>${local.display_name}`).openPopup();
+      marcadorTemp.bindPopup(`<strong>📍 Localização Encontrada:</strong><br>${local.endereco}`).openPopup();
       
       // Remove marcador após 10 segundos
       setTimeout(() => {
         mapa.removeLayer(marcadorTemp);
       }, 10000);
       
-      // Busca prestadores próximos (raio de 50km)
-      const prestadoresProximos = prestadores.filter(prestador => {
-        const distancia = calcularDistancia(lat, lng, prestador.latitude, prestador.longitude);
-        return distancia <= 50;
-      });
+      // Busca prestadores próximos (raio de 50km), do mais próximo para o mais distante
+      const prestadoresProximos = prestadoresPorId(await buscarLocaisProximos(lat, lng, {
+        raio_km: 50,
+        limit: LIMITE_LOCAIS_PROXIMOS
+      }));
       
       mostrarNotificacao(`Endereço encontrado! ${prestadoresProximos.length} prestadores num raio de 50km`, 'success');
       
       return {
-        endereco: local.display_name,
+        endereco: local.endereco,
         lat,
         lng,
         prestadoresProximos
@@ -1507,37 +1596,31 @@ export function obterEstatisticas() {
 }
 
 /**
- * Função para buscar duplicatas
+ * Busca locais duplicados ou quase duplicados (nome semelhante na mesma cidade, mesmo
+ * telefone ou muito próximos). Os grupos são calculados no servidor.
  */
-export function buscarDuplicatas() {
+export async function buscarDuplicatas() {
   const duplicatas = {
     unidades: [],
     prestadores: []
   };
 
-  // Busca duplicatas em unidades (mesmo nome e cidade)
-  for (let i = 0; i < unidades.length; i++) {
-    for (let j = i + 1; j < unidades.length; j++) {
-      if (unidades[i].nome.toLowerCase() === unidades[j].nome.toLowerCase() && 
-          unidades[i].cidade.toLowerCase() === unidades[j].cidade.toLowerCase()) {
-        duplicatas.unidades.push([unidades[i], unidades[j]]);
-      }
-    }
-  }
-
-  // Busca duplicatas em prestadores (mesmo nome e cidade)
-  for (let i = 0; i < prestadores.length; i++) {
-    for (let j = i + 1; j < prestadores.length; j++) {
-      if (prestadores[i].nome.toLowerCase() === prestadores[j].nome.toLowerCase() && 
-          prestadores[i].cidade.toLowerCase() === prestadores[j].cidade.toLowerCase()) {
-        duplicatas.prestadores.push([prestadores[i], prestadores[j]]);
-      }
-    }
+  try {
+    const response = await axios.get('/api/mapa/locais/duplicatas');
+    response.data.grupos.forEach(grupo => {
+      // Cada grupo tem só unidades ou só prestadores (o servidor compara dentro da mesma categoria)
+      const categoria = grupo.registros[0].tipo === 'unidade' ? 'unidades' : 'prestadores';
+      duplicatas[categoria].push(grupo.registros);
+    });
+  } catch (error) {
+    console.error('Erro ao buscar duplicatas:', error);
+    mostrarNotificacao('Erro ao buscar duplicatas!', 'error');
+    return duplicatas;
   }
 
   if (duplicatas.unidades.length > 0 || duplicatas.prestadores.length > 0) {
     console.warn('Duplicatas encontradas:', duplicatas);
-    mostrarNotificacao(`Encontradas ${duplicatas.unidades.length + duplicatas.prestadores.length} possíveis duplicatas`, 'warning');
+    mostrarNotificacao(`Encontrados ${duplicatas.unidades.length + duplicatas.prestadores.length} grupos de possíveis duplicatas`, 'warning');
   } else {
     mostrarNotificacao('Nenhuma duplicata encontrada!', 'success');
   }
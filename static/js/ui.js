@@ -1,4 +1,5 @@
-import { formatarMoeda, normalizeDate, isSameMonth } from './utils.js';
+import { formatarMoeda, normalizeDate } from './utils.js';
+import { urlAnexo } from './api.js';
 
 export function mostrarNotificacao(mensagem, tipo = 'info', duracao = 5000) {
     const notificacao = document.createElement('div');
@@ -39,12 +40,13 @@ export function mostrarSecao(sectionId, sections, navLinks) {
     }
 }
 
-export function atualizarFiltros(manutencoes, elements) {
+/**
+ * Preenche os selects de filtros.
+ * @param {{motoristas: string[], placas: string[], tipos: string[]}} opcoes Listas retornadas pelo resumo do dashboard.
+ */
+export function atualizarFiltros(opcoes, elements) {
     const { filtroMotorista, filtroPlaca, filtroTipo, filtroListagemTipo, relatorioPlaca, relatorioMotorista } = elements;
-
-    const motoristas = [...new Set(manutencoes.map(m => m.motorista))].sort();
-    const placas = [...new Set(manutencoes.map(m => m.placa))].sort();
-    const tipos = [...new Set(manutencoes.map(m => m.tipo))].sort();
+    const { motoristas = [], placas = [], tipos = [] } = opcoes || {};
 
     const preencherSelect = (select, options, placeholder) => {
         if (!select) return;
@@ -65,28 +67,24 @@ export function atualizarFiltros(manutencoes, elements) {
     preencherSelect(relatorioMotorista, motoristas, 'Todos os Motoristas');
 }
 
-export function atualizarDashboardUI(dados, elements) {
+/**
+ * Atualiza os cards do dashboard com o resumo calculado no servidor.
+ * @param {object|null} resumo Resposta de GET /api/estatisticas/resumo (null limpa os cards).
+ */
+export function atualizarDashboardUI(resumo, elements) {
     const { totalManutencoes, valorTotal, veiculosAtendidos, manutencoesMes } = elements;
 
     if (totalManutencoes) {
-        totalManutencoes.textContent = dados.length || '0';
+        totalManutencoes.textContent = resumo?.total_manutencoes || '0';
     }
-    const valor = dados.reduce((acc, man) => acc + Number(man.valor || 0), 0);
     if (valorTotal) {
-        valorTotal.textContent = formatarMoeda(valor);
+        valorTotal.textContent = formatarMoeda(resumo?.valor_total || 0);
     }
-
-    const tiposExcluidos = ['Compra de Corda', 'Madeirite', 'Lona', 'Cinta e Catraca', 'EPIs', 'DIVERSOS'];
-    const veiculosAtendidosSet = new Set(dados.filter(man => !tiposExcluidos.includes(man.tipo)).map(man => man.placa));
     if (veiculosAtendidos) {
-        veiculosAtendidos.textContent = veiculosAtendidosSet.size || '0';
+        veiculosAtendidos.textContent = resumo?.veiculos_atendidos || '0';
     }
-
-    const hoje = new Date();
-    const hojeUTC = new Date(Date.UTC(hoje.getFullYear(), hoje.getMonth(), hoje.getDate()));
-    const manutencoesMesCount = dados.filter(man => isSameMonth(normalizeDate(man.data), hojeUTC)).length;
     if (manutencoesMes) {
-        manutencoesMes.textContent = manutencoesMesCount || '0';
+        manutencoesMes.textContent = resumo?.manutencoes_mes || '0';
     }
 }
 
@@ -216,7 +214,7 @@ export function atualizarColinha(manutencoes, colinhaContent) {
         let anexosHTML = '';
         if (man.anexos && man.anexos.length > 0) {
             anexosHTML = man.anexos.map((anexo, index) => `
-                <a href="${anexo.dados_arquivo}" 
+                <a href="${urlAnexo(anexo, true)}" 
                    class="anexo-link" 
                    download="${anexo.nome_arquivo}" 
                    title="Baixar ${anexo.nome_arquivo}"
@@ -270,13 +268,22 @@ export function preencherFormularioEdicao(manutencao, formEditar, modal) {
 
     if (manutencao.anexos && manutencao.anexos.length > 0) {
         const linksHTML = manutencao.anexos.map(anexo => `
-            <div class="anexo-item-atual">
-                <a href="${anexo.dados_arquivo}" target="_blank" class="link-anexo-atual" download="${anexo.nome_arquivo}">
+            <div class="anexo-item-atual" data-id="${anexo.id}">
+                <a href="${urlAnexo(anexo)}" target="_blank" class="link-anexo-atual" download="${anexo.nome_arquivo}">
                     ${anexo.nome_arquivo}
                 </a>
+                <button type="button" class="btn-remover-anexo" title="Remover anexo">&times;</button>
             </div>
         `).join('');
         anexoAtualContainer.innerHTML = linksHTML;
+        // Marca/desmarca o anexo para remoção; a remoção só é enviada ao salvar
+        anexoAtualContainer.querySelectorAll('.btn-remover-anexo').forEach(botao => {
+            botao.addEventListener('click', () => {
+                const item = botao.closest('.anexo-item-atual');
+                item.classList.toggle('removido');
+                botao.title = item.classList.contains('removido') ? 'Manter anexo' : 'Remover anexo';
+            });
+        });
     } else {
         anexoAtualContainer.innerHTML = '<p><em>Nenhum anexo existente.</em></p>';
     }
@@ -284,13 +291,54 @@ export function preencherFormularioEdicao(manutencao, formEditar, modal) {
     if (modal) modal.style.display = 'flex';
 }
 
-export function atualizarRelatorioUI(relatorio, elements) {
-    const { statsContainer, tabelaContainer, exportarRelatorioBtn } = elements;
+/**
+ * Tabela dinâmica retornada por GET /api/relatorios/cubo com `colunas` (uma dimensão por eixo).
+ */
+function renderizarTabelaDinamica(cubo, container, titulo, formatar) {
+    container.innerHTML = '';
+    if (!cubo || cubo.itens.length === 0) return;
+
+    const tabela = document.createElement('table');
+    const criarLinha = (celulas, tag = 'td') => {
+        const tr = document.createElement('tr');
+        celulas.forEach(texto => {
+            const celula = document.createElement(tag);
+            celula.textContent = texto;
+            tr.appendChild(celula);
+        });
+        return tr;
+    };
+    const thead = document.createElement('thead');
+    thead.appendChild(criarLinha([cubo.linhas.join(' / '), ...cubo.cabecalho.map(chave => chave.join(' / ')), 'Total'], 'th'));
+    tabela.appendChild(thead);
+
+    const tbody = document.createElement('tbody');
+    cubo.itens.forEach(item => {
+        tbody.appendChild(criarLinha([item.chave.join(' / ') || 'N/A', ...item.valores.map(formatar), formatar(item.total)]));
+    });
+    tbody.appendChild(criarLinha(['Total', ...cubo.totais.map(formatar), formatar(cubo.total)]));
+    tabela.appendChild(tbody);
+
+    const legenda = document.createElement('h4');
+    legenda.textContent = titulo;
+    container.appendChild(legenda);
+    container.appendChild(tabela);
+}
+
+/**
+ * @param {object[]} relatorio Linhas do relatório.
+ * @param {object} elements Containers do resultado.
+ * @param {{porPlaca?: object, porPlacaMes?: object}} [cubo] Agregações do servidor (GET /api/relatorios/cubo);
+ *   sem elas, os totais são calculados a partir das linhas.
+ */
+export function atualizarRelatorioUI(relatorio, elements, cubo = {}) {
+    const { statsContainer, pivoContainer, tabelaContainer, exportarRelatorioBtn } = elements;
 
     if (!statsContainer || !tabelaContainer) return;
 
     statsContainer.innerHTML = '';
     tabelaContainer.innerHTML = '';
+    if (pivoContainer) pivoContainer.innerHTML = '';
 
     if (relatorio.length === 0) {
         tabelaContainer.innerHTML = '<p>Nenhum dado encontrado para o relatório.</p>';
@@ -298,9 +346,10 @@ export function atualizarRelatorioUI(relatorio, elements) {
         return;
     }
 
-    const totalManutencoes = relatorio.length;
-    const totalValor = relatorio.reduce((acc, man) => acc + Number(man.valor || 0), 0);
-    const veiculosUnicos = new Set(relatorio.map(man => man.placa)).size;
+    const { porPlaca, porPlacaMes } = cubo;
+    const totalManutencoes = porPlaca ? porPlaca.total.quantidade : relatorio.length;
+    const totalValor = porPlaca ? porPlaca.total.valor_total : relatorio.reduce((acc, man) => acc + Number(man.valor || 0), 0);
+    const veiculosUnicos = porPlaca ? porPlaca.itens.length : new Set(relatorio.map(man => man.placa)).size;
 
     statsContainer.innerHTML = `
         <div class="relatorio-stat"><span class="stat-label">Total de Manutenções</span><span class="stat-value">${totalManutencoes}</span></div>
@@ -308,6 +357,10 @@ export function atualizarRelatorioUI(relatorio, elements) {
         <div class="relatorio-stat"><span class="stat-label">Veículos Únicos</span><span class="stat-value">${veiculosUnicos}</span></div>
     `;
 
+    if (pivoContainer) {
+        renderizarTabelaDinamica(porPlacaMes, pivoContainer, 'Custo por placa e mês', formatarMoeda);
+    }
+
     const tabela = document.createElement('table');
     const thead = document.createElement('thead');
     thead.innerHTML = `
@@ -0,0 +1,297 @@
+"""
+Fila de tarefas em segundo plano (exportações e importações grandes).
+
+As tarefas ficam registradas na tabela 'tarefas' do SQLite, o que permite que qualquer
+worker do gunicorn responda à consulta de progresso, ao cancelamento e ao download do
+resultado, mesmo que a execução esteja acontecendo em outro processo. A execução usa um
+pool de threads por processo; os arquivos gerados ficam em TAREFAS_DIR.
+
+Uso:
+    @registrar_tarefa('exportar')
+    def executar_exportacao(contexto, parametros):
+        ...
+        contexto.atualizar(linhas_processadas, total)  # lança TarefaCancelada se cancelada
+        return {'arquivo': caminho, 'nome_arquivo': ..., 'mimetype': ...}
+
+    tarefa_id, reutilizada = enviar_tarefa('exportar', parametros)
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from banco import pool
+
+logger = logging.getLogger(__name__)
+
+TAREFAS_DIR = os.environ.get('TAREFAS_DIR', 'tarefas_arquivos')
+TAREFAS_WORKERS = int(os.environ.get('TAREFAS_WORKERS', 2))
+# Por quanto tempo (segundos) o resultado de uma tarefa idêntica pode ser reaproveitado
+TAREFAS_REUSO_SEGUNDOS = int(os.environ.get('TAREFAS_REUSO_SEGUNDOS', 300))
+# Por quanto tempo (segundos) tarefas finalizadas e seus arquivos são mantidos
+TAREFAS_RETENCAO_SEGUNDOS = int(os.environ.get('TAREFAS_RETENCAO_SEGUNDOS', 24 * 3600))
+# Intervalo mínimo (segundos) entre gravações de progresso no banco
+_INTERVALO_PROGRESSO = 0.5
+
+STATUS_FINAIS = ('concluida', 'erro', 'cancelada')
+
+_handlers = {}
+_executor = None
+_executor_pid = None
+
+
+class TarefaCancelada(Exception):
+    """Lançada dentro da tarefa quando o cancelamento foi solicitado."""
+
+
+def registrar_tarefa(tipo):
+    """Decorador que registra a função que executa as tarefas do tipo informado."""
+    def decorador(funcao):
+        _handlers[tipo] = funcao
+        return funcao
+    return decorador
+
+
+def criar_esquema_tarefas(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS tarefas
+                 (id TEXT PRIMARY KEY,
+                  tipo TEXT NOT NULL,
+                  chave TEXT, -- hash de tipo + parâmetros + versão dos dados, usado para reaproveitar resultados
+                  parametros TEXT,
+                  status TEXT NOT NULL, -- pendente, executando, concluida, erro, cancelada
+                  cancelar INTEGER NOT NULL DEFAULT 0,
+                  linhas_processadas INTEGER NOT NULL DEFAULT 0,
+                  total_linhas INTEGER,
+                  resultado TEXT,
+                  erro TEXT,
+                  pid INTEGER,
+                  criada_em REAL NOT NULL,
+                  iniciada_em REAL,
+                  concluida_em REAL)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tarefas_chave ON tarefas (chave, status, concluida_em)')
+
+
+def _obter_executor():
+    global _executor, _executor_pid
+    # Threads não sobrevivem a um fork: cada worker do gunicorn cria o seu próprio pool
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=TAREFAS_WORKERS, thread_name_prefix='tarefa')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _chave(tipo, parametros, versao=None):
+    bruto = json.dumps([tipo, parametros, versao], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+
+def _processo_ativo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class TarefaContexto:
+    """Interface entregue à função da tarefa para informar progresso e verificar cancelamento."""
+
+    def __init__(self, tarefa_id):
+        self.tarefa_id = tarefa_id
+        self._ultima_gravacao = 0.0
+
+    def caminho_arquivo(self, extensao):
+        """Caminho onde a tarefa deve gravar o arquivo de resultado."""
+        os.makedirs(TAREFAS_DIR, exist_ok=True)
+        return os.path.join(TAREFAS_DIR, f'{self.tarefa_id}{extensao}')
+
+    def atualizar(self, linhas_processadas, total_linhas=None, forcar=False):
+        """Registra o progresso. Lança TarefaCancelada se o cancelamento foi solicitado."""
+        agora = time.monotonic()
+        if not forcar and agora - self._ultima_gravacao < _INTERVALO_PROGRESSO:
+            return
+        self._ultima_gravacao = agora
+        conn = pool.obter()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE tarefas SET linhas_processadas = ?, total_linhas = COALESCE(?, total_linhas) WHERE id = ?',
+                      (linhas_processadas, total_linhas, self.tarefa_id))
+            c.execute('SELECT cancelar FROM tarefas WHERE id = ?', (self.tarefa_id,))
+            row = c.fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+        if row and row['cancelar']:
+            raise TarefaCancelada()
+
+
+def _finalizar(tarefa_id, status, resultado=None, erro=None, linhas=None):
+    conn = pool.obter()
+    try:
+        conn.execute('''UPDATE tarefas SET status = ?, resultado = ?, erro = ?, concluida_em = ?,
+                                           linhas_processadas = COALESCE(?, linhas_processadas)
+                        WHERE id = ?''',
+                     (status, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                      erro, time.time(), linhas, tarefa_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _executar(tarefa_id, tipo, parametros):
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        c.execute('''UPDATE tarefas SET status = 'executando', iniciada_em = ?, pid = ?
+                     WHERE id = ? AND status = 'pendente' AND cancelar = 0''', (time.time(), os.getpid(), tarefa_id))
+        iniciada = c.rowcount == 1
+        conn.commit()
+    finally:
+        conn.close()
+    if not iniciada:
+        _finalizar(tarefa_id, 'cancelada')
+        return
+
+    contexto = TarefaContexto(tarefa_id)
+    try:
+        resultado = _handlers[tipo](contexto, parametros)
+        status, erro = 'concluida', None
+        logger.info(f"Tarefa {tipo} {tarefa_id} concluída")
+    except TarefaCancelada:
+        resultado, status, erro = None, 'cancelada', None
+        logger.info(f"Tarefa {tipo} {tarefa_id} cancelada")
+    except Exception as e:
+        logger.error(f"Erro na tarefa {tipo} {tarefa_id}: {str(e)}", exc_info=True)
+        resultado, status, erro = None, 'erro', str(e)
+    try:
+        _finalizar(tarefa_id, status, resultado=resultado, erro=erro,
+                   linhas=(resultado or {}).get('linhas_processadas'))
+    except Exception as e:
+        # O executor descarta exceções silenciosamente: registra para não perder o motivo
+        logger.error(f"Erro ao finalizar a tarefa {tipo} {tarefa_id}: {str(e)}", exc_info=True)
+
+
+def enviar_tarefa(tipo, parametros, reutilizavel=True, versao=None):
+    """
+    Registra e agenda uma tarefa. Se `reutilizavel` e houver uma tarefa idêntica concluída há
+    menos de TAREFAS_REUSO_SEGUNDOS (ou ainda em andamento), retorna o id dela.
+    `versao` é a versão dos dados lidos pela tarefa (ver cache_respostas.py): uma tarefa só é
+    reaproveitada se os dados não mudaram desde que foi registrada.
+    Retorna (tarefa_id, reutilizada).
+    """
+    if tipo not in _handlers:
+        raise ValueError(f'Tipo de tarefa desconhecido: {tipo}')
+    chave = _chave(tipo, parametros, versao)
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        if reutilizavel:
+            c.execute('''SELECT id, resultado FROM tarefas
+                         WHERE chave = ? AND cancelar = 0
+                           AND (status IN ('pendente', 'executando')
+                                OR (status = 'concluida' AND concluida_em >= ?))
+                         ORDER BY criada_em DESC LIMIT 1''', (chave, time.time() - TAREFAS_REUSO_SEGUNDOS))
+            existente = c.fetchone()
+            if existente:
+                arquivo = json.loads(existente['resultado'] or '{}').get('arquivo')
+                if not arquivo or os.path.exists(arquivo):
+                    return existente['id'], True
+
+        tarefa_id = uuid.uuid4().hex
+        c.execute('''INSERT INTO tarefas (id, tipo, chave, parametros, status, pid, criada_em)
+                     VALUES (?, ?, ?, ?, 'pendente', ?, ?)''',
+                  (tarefa_id, tipo, chave, json.dumps(parametros, ensure_ascii=False), os.getpid(), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+    _obter_executor().submit(_executar, tarefa_id, tipo, parametros)
+    limpar_tarefas_antigas()
+    return tarefa_id, False
+
+
+def obter_tarefa(tarefa_id):
+    """Retorna o estado da tarefa como dicionário, ou None se não existir."""
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        c.execute('SELECT * FROM tarefas WHERE id = ?', (tarefa_id,))
+        row = c.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    tarefa = dict(row)
+    tarefa['parametros'] = json.loads(tarefa['parametros'] or '{}')
+    tarefa['resultado'] = json.loads(tarefa['resultado']) if tarefa['resultado'] else None
+    total = tarefa['total_linhas']
+    if tarefa['status'] == 'concluida':
+        tarefa['progresso'] = 1.0
+    else:
+        tarefa['progresso'] = min(tarefa['linhas_processadas'] / total, 1.0) if total else None
+    for campo in ('criada_em', 'iniciada_em', 'concluida_em'):
+        if tarefa[campo]:
+            tarefa[campo] = datetime.fromtimestamp(tarefa[campo]).isoformat(timespec='seconds')
+    tarefa.pop('chave', None)
+    tarefa.pop('pid', None)
+    return tarefa
+
+
+def cancelar_tarefa(tarefa_id):
+    """Solicita o cancelamento. Retorna False se a tarefa não existir ou já tiver terminado."""
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        c.execute(f'''UPDATE tarefas SET cancelar = 1
+                      WHERE id = ? AND status NOT IN ({",".join("?" for _ in STATUS_FINAIS)})''',
+                  (tarefa_id, *STATUS_FINAIS))
+        solicitado = c.rowcount == 1
+        # Tarefas que ainda não começaram são canceladas imediatamente
+        c.execute("UPDATE tarefas SET status = 'cancelada', concluida_em = ? WHERE id = ? AND status = 'pendente'",
+                  (time.time(), tarefa_id))
+        conn.commit()
+        return solicitado
+    finally:
+        conn.close()
+
+
+def recuperar_tarefas_interrompidas(c):
+    """
+    Marca como erro as tarefas em andamento cujo processo não existe mais (ex.: reinício do
+    servidor). Chamada na inicialização: tarefas com o pid do processo atual também são
+    consideradas interrompidas, pois o pid pode ter sido reaproveitado.
+    """
+    c.execute("SELECT id, pid FROM tarefas WHERE status IN ('pendente', 'executando')")
+    interrompidas = [row[0] for row in c.fetchall()
+                     if not row[1] or row[1] == os.getpid() or not _processo_ativo(row[1])]
+    c.executemany("UPDATE tarefas SET status = 'erro', erro = 'Tarefa interrompida', concluida_em = ? WHERE id = ?",
+                  [(time.time(), tarefa_id) for tarefa_id in interrompidas])
+
+
+def limpar_tarefas_antigas():
+    """Remove tarefas finalizadas há mais de TAREFAS_RETENCAO_SEGUNDOS e seus arquivos."""
+    limite = time.time() - TAREFAS_RETENCAO_SEGUNDOS
+    conn = pool.obter()
+    try:
+        c = conn.cursor()
+        c.execute(f'''SELECT id, resultado, parametros FROM tarefas
+                      WHERE status IN ({",".join("?" for _ in STATUS_FINAIS)}) AND concluida_em < ?''',
+                  (*STATUS_FINAIS, limite))
+        antigas = c.fetchall()
+        for row in antigas:
+            for bruto in (row['resultado'], row['parametros']):
+                arquivo = json.loads(bruto or '{}').get('arquivo')
+                if arquivo and os.path.exists(arquivo):
+                    os.remove(arquivo)
+        c.executemany('DELETE FROM tarefas WHERE id = ?', [(row['id'],) for row in antigas])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Erro ao limpar tarefas antigas: {str(e)}", exc_info=True)
+    finally:
+        conn.close()
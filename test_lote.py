@@ -0,0 +1,86 @@
+"""
+Testes das operações em lote de manutenções com anexos (lote.py e armazenamento.py).
+
+    python -m pytest test_lote.py
+"""
+import base64
+import hashlib
+import os
+import tempfile
+
+_DIRETORIO = tempfile.mkdtemp(prefix='teste_lote_')
+os.environ['DB_PATH'] = os.path.join(_DIRETORIO, 'manutencoes.db')
+os.environ['ANEXOS_DIR'] = os.path.join(_DIRETORIO, 'anexos_arquivos')
+
+import pytest  # noqa: E402
+
+import app  # noqa: E402  (DB_PATH e ANEXOS_DIR são lidos na importação)
+
+MANUTENCAO = {'data': '2025-01-15', 'placa': 'ABC1234', 'motorista': 'Motorista', 'tipo': 'Preventiva',
+              'valor': 100, 'local': 'Oficina', 'defeito': 'Revisão'}
+
+
+@pytest.fixture
+def cliente():
+    return app.app.test_client()
+
+
+def anexo(texto):
+    return {'nome': f'{texto}.txt', 'tipo': 'text/plain',
+            'dados': 'data:text/plain;base64,' + base64.b64encode(texto.encode('utf-8')).decode('ascii')}
+
+
+def hash_de(texto):
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def manutencao(placa, *anexos):
+    return dict(MANUTENCAO, placa=placa, anexos=list(anexos))
+
+
+def arquivos_em_disco():
+    return {nome for _, _, nomes in os.walk(os.environ['ANEXOS_DIR']) for nome in nomes}
+
+
+def arquivos_referenciados():
+    conn = app.get_db_connection()
+    try:
+        return {row[0] for row in conn.execute('SELECT hash FROM arquivos WHERE referencias > 0')}
+    finally:
+        conn.close()
+
+
+def lote(cliente, modo, *operacoes):
+    return cliente.post('/api/manutencoes/lote', json={'modo': modo, 'operacoes': list(operacoes)})
+
+
+def test_lote_desfeito_nao_deixa_arquivos(cliente):
+    resposta = lote(cliente, 'tudo_ou_nada',
+                    {'op': 'criar', 'dados': manutencao('DES0001', anexo('lote desfeito'))},
+                    {'op': 'excluir', 'id': 999999})
+    assert resposta.status_code == 400
+    assert resposta.get_json()['aplicado'] is False
+    assert arquivos_em_disco() == arquivos_referenciados()
+
+
+def test_grupo_refeito_item_a_item_nao_deixa_arquivos(cliente):
+    # O grupo de duas criações falha no anexo inválido da segunda: a tentativa agrupada já gravou
+    # os anexos válidos, que precisam sumir do disco junto com o savepoint desfeito
+    resposta = lote(cliente, 'melhor_esforco',
+                    {'op': 'criar', 'dados': manutencao('GRP0001', anexo('grupo valido'))},
+                    {'op': 'criar', 'dados': manutencao('GRP0002', anexo('grupo com falha'),
+                                                        {'nome': 'x.txt', 'tipo': 'text/plain', 'dados': '@@@'})})
+    assert resposta.status_code == 200
+    resultados = resposta.get_json()['resultados']
+    assert [r['status'] for r in resultados] == [201, 400]
+    assert hash_de('grupo valido') in arquivos_em_disco()
+    assert hash_de('grupo com falha') not in arquivos_em_disco()
+    assert arquivos_em_disco() == arquivos_referenciados()
+
+
+def test_operacao_unica_com_falha_retorna_resultado(cliente):
+    resposta = lote(cliente, 'melhor_esforco',
+                    {'op': 'criar', 'dados': manutencao('UNI0001', {'nome': 'x.txt', 'tipo': 'text/plain', 'dados': ''})})
+    assert resposta.status_code == 200
+    assert resposta.get_json()['resultados'][0]['status'] == 400
+    assert arquivos_em_disco() == arquivos_referenciados()